@@ -0,0 +1,93 @@
+"""Cost of turning a shard's stream entries into gateway batches.
+
+    PYTHONPATH=../libs python benchmarks/bench_forwarding.py
+
+Only the CPU work StreamWorker does per entry is timed, with no Redis or
+gRPC involved: reading the entry, getting its routing keys, and building the
+serialized batch the gateway receives. Three paths are compared:
+
+- legacy: one field per attribute, decoded and rebuilt into an Event
+- parsed: one serialized Event per entry, parsed to read its routing keys
+- forwarded: routing keys from their own fields, payload passed through
+
+A shard at 10k-100k events/s has 100 ms down to 10 ms of CPU per 1k events.
+"""
+
+import timeit
+import uuid
+
+from libs.event.codec import EventCodec
+from libs.event.event_pb2 import EventBatch
+from libs.event.forwarding import RawEventBatch
+from libs.event.schema import Event, EventType
+
+BATCH_SIZE = 100  # REDIS_XREAD_COUNT
+RECEIVERS = [str(uuid.uuid4()) for _ in range(20)]
+
+
+def make_events() -> list[Event]:
+    return [
+        Event(
+            event_type=EventType.MESSAGE,
+            sender_id=RECEIVERS[0],
+            receiver_id=RECEIVERS[i % len(RECEIVERS)],
+            text="hello there " * 5,
+            metadata={"guild_id": RECEIVERS[1], "attachments": []},
+        )
+        for i in range(BATCH_SIZE)
+    ]
+
+
+def as_read(fields: dict) -> dict[bytes, bytes]:
+    """What XREADGROUP hands back for an entry written with `fields`."""
+    return {
+        k.encode(): v if isinstance(v, bytes) else str(v).encode()
+        for k, v in fields.items()
+    }
+
+
+EVENTS = make_events()
+LEGACY = [as_read(EventCodec.to_redis(event)) for event in EVENTS]
+TAGGED = [as_read(EventCodec.to_stream(event)) for event in EVENTS]
+
+
+def legacy():
+    events = []
+    for fields in LEGACY:
+        decoded = {k.decode(): v.decode() for k, v in fields.items()}
+        event = EventCodec.to_grpc(decoded)
+        (event.receiver_id, event.event_type)
+        events.append(event)
+    return EventBatch(events=events).SerializeToString()
+
+
+def parsed():
+    events = []
+    for fields in TAGGED:
+        event = EventCodec.from_stream(fields)
+        (event.receiver_id, event.event_type)
+        events.append(event)
+    return EventBatch(events=events).SerializeToString()
+
+
+def forwarded():
+    payloads = []
+    for fields in TAGGED:
+        receiver_id, event_type, payload = EventCodec.route_stream_entry(fields)
+        payloads.append(payload)
+    return RawEventBatch(payloads).SerializeToString()
+
+
+def main():
+    assert legacy() == parsed() == forwarded()
+    for bench in (legacy, parsed, forwarded):
+        seconds = min(timeit.repeat(bench, number=200, repeat=5)) / 200
+        per_event = seconds / BATCH_SIZE
+        print(
+            f"{bench.__name__:<10} {per_event * 1e9:7.0f} ns/event"
+            f"  {1 / per_event / 1000:7.0f}k events/s per core"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,42 @@ class Config:
     heartbeat_ttl: int = int(os.getenv("HEARTBEAT_TTL"))
     grpc_timeout: int = int(os.getenv("GRPC_TIMEOUT"))
     max_grpc_connections: int = int(os.getenv("MAX_GRPC_CONNECTIONS"))
+    # "stream": one long-lived StreamEvents call per gateway, acked
+    # cumulatively. "unary": one SendEvents call per batch.
+    grpc_delivery_mode: str = os.getenv("GRPC_DELIVERY_MODE", "stream")
+    # Batches one shard may have read but not yet acked. When gRPC delivery
+    # lags, the window fills and the worker stops reading until it drains.
+    max_inflight_batches: int = int(os.getenv("MAX_INFLIGHT_BATCHES", "4"))
+    # Lease changes are pushed; this is the safety-net poll. While the pub/sub
+    # subscription is down the leases are polled every second instead.
+    lease_poll_interval: float = float(os.getenv("LEASE_POLL_INTERVAL", "5"))
+    # How long a shard that moved away may take to finish its in-flight
+    # batches before its lease is released anyway
+    lease_drain_timeout: float = float(os.getenv("LEASE_DRAIN_TIMEOUT", "10"))
+    # Failures in a row that open a gateway's circuit, and how long it stays
+    # open before a trial delivery is let through
+    circuit_failure_threshold: int = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    circuit_open_seconds: float = float(os.getenv("CIRCUIT_OPEN_SECONDS", "10"))
+    # A failed delivery stays pending and is retried after RETRY_BASE_MS,
+    # doubling per delivery up to RETRY_MAX_MS. After MAX_DELIVERIES attempts
+    # the entry moves to its shard's dead-letter stream.
+    retry_base_ms: int = int(os.getenv("RETRY_BASE_MS", "1000"))
+    retry_max_ms: int = int(os.getenv("RETRY_MAX_MS", "60000"))
+    max_deliveries: int = int(os.getenv("MAX_DELIVERIES", "10"))
+    # Entries each shard's dead-letter stream keeps, approximately; older
+    # ones are trimmed as new ones arrive
+    dead_letter_max_len: int = int(os.getenv("DEAD_LETTER_MAX_LEN", "100000"))
+    # Endpoint cache TTL while endpoint changes are being pushed to us. When the
+    # pub/sub channel is down the cache falls back to a 30s TTL.
+    endpoint_cache_ttl: int = int(os.getenv("ENDPOINT_CACHE_TTL", "300"))
+    # Past this fraction of the TTL a hit is still served, and refreshed in the
+    # background, so a hot key never expires under load
+    endpoint_cache_revalidate_after: float = float(
+        os.getenv("ENDPOINT_CACHE_REVALIDATE_AFTER", "0.8")
+    )
+    endpoint_cache_max_entries: int = int(
+        os.getenv("ENDPOINT_CACHE_MAX_ENTRIES", "100000")
+    )
     log_level: str = os.getenv("LOG_LEVEL")
     log_format: str = os.getenv("LOG_FORMAT")
 
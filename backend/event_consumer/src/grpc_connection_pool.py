@@ -1,24 +1,131 @@
 import asyncio
+import time
 from collections import OrderedDict
+from dataclasses import dataclass
+from enum import Enum
+from typing import ClassVar
 
 import grpc
 import structlog
 
-from libs.event import event_pb2_grpc
+from libs.event.forwarding import ForwardingEventServiceStub
+from src.config import config
+from src.grpc_event_stream import EventStream
 
 logger = structlog.get_logger(__name__)
 
 
+class CircuitOpen(Exception):
+    """Delivery to the endpoint was skipped: its circuit is open."""
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+@dataclass
+class EndpointHealth:
+    """
+    Delivery health of one gateway endpoint, kept as a circuit breaker.
+
+    `failure_threshold` failures in a row open the circuit, and deliveries to
+    the endpoint then fail at once instead of each waiting out the gRPC
+    deadline. After `open_seconds` a single trial delivery is let through: its
+    success closes the circuit, its failure opens it again.
+    """
+
+    LATENCY_ALPHA: ClassVar[float] = 0.2
+
+    endpoint: str
+    failure_threshold: int = config.circuit_failure_threshold
+    open_seconds: float = config.circuit_open_seconds
+    state: CircuitState = CircuitState.CLOSED
+    consecutive_failures: int = 0
+    # Seconds per successful delivery, exponentially weighted
+    latency_ewma: float | None = None
+    opened_at: float = 0.0
+    trial_in_flight: bool = False
+
+    def allow_request(self) -> bool:
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                return False
+            self._transition(CircuitState.HALF_OPEN)
+        if self.trial_in_flight:
+            return False
+        self.trial_in_flight = True
+        return True
+
+    def record_success(self, latency: float):
+        self.latency_ewma = (
+            latency
+            if self.latency_ewma is None
+            else self.LATENCY_ALPHA * latency
+            + (1 - self.LATENCY_ALPHA) * self.latency_ewma
+        )
+        self.consecutive_failures = 0
+        self.trial_in_flight = False
+        if self.state != CircuitState.CLOSED:
+            self._transition(CircuitState.CLOSED)
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if (
+            self.state == CircuitState.HALF_OPEN
+            or self.consecutive_failures >= self.failure_threshold
+        ):
+            self.opened_at = time.monotonic()
+            if self.state != CircuitState.OPEN:
+                self._transition(CircuitState.OPEN)
+
+    def record_cancelled(self):
+        """The delivery was abandoned; it says nothing about the endpoint."""
+        self.trial_in_flight = False
+
+    def _transition(self, state: CircuitState):
+        logger.warning(
+            "Gateway circuit state changed",
+            endpoint=self.endpoint,
+            state=state.value,
+            previous=self.state.value,
+            consecutive_failures=self.consecutive_failures,
+            latency_ewma=self.latency_ewma,
+        )
+        self.state = state
+
+
 class GrpcConnectionPool:
     """
     Simple LRU-based gRPC connection pool optimized for real-time messaging.
     No background cleanup tasks - connections are evicted only when pool is full.
+
+    There is no lock. Looking up, creating and evicting a channel never
+    awaits — `grpc.aio.insecure_channel` connects lazily, on the first call —
+    so each of them runs to completion on the event loop, and concurrent
+    misses for one endpoint cannot create two channels. Only closing a channel
+    awaits, and an evicted channel is closed in the background.
     """
 
     def __init__(self, max_connections: int):
-        self._channels = OrderedDict()  # LRU cache: oldest first
+        # LRU cache: oldest first. The stub is built once per channel.
+        self._channels: OrderedDict[
+            str, tuple[grpc.aio.Channel, ForwardingEventServiceStub]
+        ] = OrderedDict()
         self._max_connections = max_connections
-        self._lock = asyncio.Lock()
+        # One event stream per connected endpoint
+        self._streams: dict[str, EventStream] = {}
+        # Endpoints that answered StreamEvents with UNIMPLEMENTED -> when to
+        # try streaming again (they may have been upgraded meanwhile)
+        self._unary_only: dict[str, float] = {}
+        self.unary_retry_interval = 60
+        self._health: dict[str, EndpointHealth] = {}
+        # Evicted channels still closing
+        self._closing: set[asyncio.Task] = set()
 
     async def start(self):
         """No-op for compatibility - no background tasks needed."""
@@ -28,74 +135,143 @@ class GrpcConnectionPool:
 
     async def stop(self):
         """Close all connections."""
-        async with self._lock:
-            for endpoint, channel in self._channels.items():
-                try:
-                    await channel.close()
-                except Exception as e:
-                    logger.warning("Error closing channel for %s: %s", endpoint, e)
-            self._channels.clear()
-            logger.info("gRPC connection pool stopped")
+        channels, self._channels = self._channels, OrderedDict()
+        streams, self._streams = self._streams, {}
+        for stream in streams.values():
+            await stream.close()
+        for endpoint, (channel, _) in channels.items():
+            try:
+                await channel.close()
+            except Exception as e:
+                logger.warning("Error closing channel for %s: %s", endpoint, e)
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+        logger.info("gRPC connection pool stopped")
 
     async def get_stub(self, endpoint: str):
         """
         Get or create a gRPC stub for the endpoint.
         Uses simple LRU eviction when pool is full.
         """
-        async with self._lock:
-            # Check if channel exists
-            if endpoint in self._channels:
-                # Move to end (most recently used)
-                self._channels.move_to_end(endpoint)
-                return event_pb2_grpc.EventServiceStub(self._channels[endpoint])
-
-            # Evict oldest connection if pool is full
-            if len(self._channels) >= self._max_connections:
-                oldest_endpoint, oldest_channel = self._channels.popitem(last=False)
-                try:
-                    await oldest_channel.close()
-                    logger.debug("Evicted connection to %s", oldest_endpoint)
-                except Exception as e:
-                    logger.warning(
-                        "Error closing evicted channel %s: %s", oldest_endpoint, e
-                    )
-
-            # Create new channel with optimized settings for real-time messaging
-            channel = grpc.aio.insecure_channel(
-                endpoint,
-                options=[
-                    # Keep connections alive for real-time messaging
-                    ("grpc.keepalive_time_ms", 30000),  # 30 seconds
-                    ("grpc.keepalive_timeout_ms", 5000),  # 5 seconds
-                    ("grpc.keepalive_permit_without_calls", True),
-                    # HTTP/2 settings for better performance
-                    ("grpc.http2.max_pings_without_data", 0),
-                    ("grpc.http2.min_time_between_pings_ms", 10000),
-                    (
-                        "grpc.http2.min_ping_interval_without_data_ms",
-                        300000,
-                    ),  # 5 minutes
-                    # Connection settings
-                    ("grpc.max_receive_message_length", 4 * 1024 * 1024),  # 4MB
-                    ("grpc.max_send_message_length", 4 * 1024 * 1024),  # 4MB
-                ],
-            )
-
-            # Add to end (most recently used)
-            self._channels[endpoint] = channel
-            logger.debug("Created new connection to %s", endpoint)
-            return event_pb2_grpc.EventServiceStub(channel)
+        entry = self._channels.get(endpoint)
+        if entry is not None:
+            # Move to end (most recently used)
+            self._channels.move_to_end(endpoint)
+            return entry[1]
+
+        # Evict oldest connection if pool is full
+        while len(self._channels) >= self._max_connections:
+            self._evict(*self._channels.popitem(last=False))
+
+        channel = self._create_channel(endpoint)
+        # Takes the pre-serialized batches shard workers forward
+        stub = ForwardingEventServiceStub(channel)
+        # Add to end (most recently used)
+        self._channels[endpoint] = (channel, stub)
+        logger.debug("Created new connection to %s", endpoint)
+        return stub
 
     async def close_connection(self, endpoint: str):
         """Manually close a specific connection"""
-        async with self._lock:
-            if endpoint in self._channels:
-                try:
-                    await self._channels[endpoint].close()
-                    del self._channels[endpoint]
-                    logger.info("Manually closed connection to %s", endpoint)
-                except Exception as e:
-                    logger.warning("Error closing connection to %s: %s", endpoint, e)
+        entry = self._channels.pop(endpoint, None)
+        if entry is None:
+            return
+        stream = self._streams.pop(endpoint, None)
+        try:
+            if stream is not None:
+                await stream.close()
+            await entry[0].close()
+            logger.info("Manually closed connection to %s", endpoint)
+        except Exception as e:
+            logger.warning("Error closing connection to %s: %s", endpoint, e)
+
+    def _evict(self, endpoint: str, entry: tuple):
+        # Taken out of the pool right away, so a new channel to the same
+        # endpoint never meets the old one's stream
+        stream = self._streams.pop(endpoint, None)
+        # Forget a healthy endpoint; remember one that is failing
+        health = self._health.get(endpoint)
+        if health is not None and health.state == CircuitState.CLOSED:
+            del self._health[endpoint]
+
+        task = asyncio.create_task(self._close_evicted(endpoint, entry[0], stream))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close_evicted(
+        self, endpoint: str, channel: grpc.aio.Channel, stream: EventStream | None
+    ):
+        try:
+            if stream is not None:
+                await stream.close()
+            await channel.close()
+            logger.debug("Evicted connection to %s", endpoint)
+        except Exception as e:
+            logger.warning("Error closing evicted channel %s: %s", endpoint, e)
+
+    @staticmethod
+    def _create_channel(endpoint: str) -> grpc.aio.Channel:
+        # Create new channel with optimized settings for real-time messaging
+        return grpc.aio.insecure_channel(
+            endpoint,
+            options=[
+                # Keep connections alive for real-time messaging
+                ("grpc.keepalive_time_ms", 30000),  # 30 seconds
+                ("grpc.keepalive_timeout_ms", 5000),  # 5 seconds
+                ("grpc.keepalive_permit_without_calls", True),
+                # HTTP/2 settings for better performance
+                ("grpc.http2.max_pings_without_data", 0),
+                ("grpc.http2.min_time_between_pings_ms", 10000),
+                (
+                    "grpc.http2.min_ping_interval_without_data_ms",
+                    300000,
+                ),  # 5 minutes
+                # Connection settings
+                ("grpc.max_receive_message_length", 4 * 1024 * 1024),  # 4MB
+                ("grpc.max_send_message_length", 4 * 1024 * 1024),  # 4MB
+            ],
+        )
+
+    async def get_stream(self, endpoint: str) -> EventStream | None:
+        """
+        The endpoint's long-lived event stream, or None while the gateway only
+        speaks the unary RPCs.
+        """
+        retry_at = self._unary_only.get(endpoint)
+        if retry_at is not None:
+            if time.monotonic() < retry_at:
+                return None
+            del self._unary_only[endpoint]
+
+        stream = self._streams.get(endpoint)
+        if stream is None:
+            stub = await self.get_stub(endpoint)
+            stream = self._streams.setdefault(endpoint, EventStream(endpoint, stub))
+        return stream
+
+    async def mark_unary_only(self, endpoint: str):
+        """Deliver to this endpoint with SendEvents for a while."""
+        self._unary_only[endpoint] = time.monotonic() + self.unary_retry_interval
+        await self._drop_stream(endpoint)
+        logger.info("Gateway does not support event streams", endpoint=endpoint)
+
+    async def _drop_stream(self, endpoint: str):
+        stream = self._streams.pop(endpoint, None)
+        if stream is not None:
+            await stream.close()
+
+    def health(self, endpoint: str) -> EndpointHealth:
+        health = self._health.get(endpoint)
+        if health is None:
+            health = self._health[endpoint] = EndpointHealth(endpoint)
+        return health
+
+    def health_stats(self) -> dict[str, int]:
+        states = [health.state for health in self._health.values()]
+        return {
+            "open_circuits": states.count(CircuitState.OPEN),
+            "half_open_circuits": states.count(CircuitState.HALF_OPEN),
+        }
 
     def is_connected(self, endpoint: str) -> bool:
         """Check if a connection exists for the endpoint."""
@@ -1,56 +1,260 @@
 import asyncio
 import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Iterable
 
 import structlog
 from libs.event.schema import EventType
+from libs.rediskeys import RediKeys
+from libs.routing import EndpointChange, EndpointOp
+from pydantic import ValidationError
+from src.config import config
 from src.redis_manager import RedisManager
 
 logger = structlog.get_logger(__name__)
 
 
+@dataclass
+class CacheStats:
+    """Cumulative counters, for tuning `cache_ttl` and `max_entries`."""
+
+    hits: int = 0
+    misses: int = 0
+    # Misses that Redis answered with "nobody connected"
+    negative_lookups: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    # Hits served while a background refresh ran
+    stale_hits: int = 0
+    # Misses that waited on a fetch already in flight
+    coalesced: int = 0
+    # Entries dropped because a gateway they named failed a delivery
+    invalidations: int = 0
+
+
+@dataclass
+class _InflightFetch:
+    future: asyncio.Future
+    # A change for the key arrived while the fetch was on its way back
+    changed: bool = False
+
+
 class GrpcEndpointCache:
-    def __init__(self):
-        self.endpoint_cache = {}
-        self.cache_ttl = 30  # 30 seconds - short enough to handle reconnections
-        self.cache_cleanup_interval = 60  # Cleanup every minute
+    """
+    Which gateways hold a receiver, per Redis routing key.
+
+    The gateways publish every change to those keys
+    (`RediKeys.grpc_endpoint_changes()`) and the cache patches itself from
+    them, so while subscribed an entry can live for `push_cache_ttl`. Without
+    the subscription nothing tells us about changes, and the cache falls back
+    to the short `ttl_only_cache_ttl`.
+
+    It is an LRU bounded at `max_entries`. Expiry is checked when an entry is
+    read, so neither expiry nor eviction ever walks the whole cache.
+    """
+
+    def __init__(self, max_entries: int = config.endpoint_cache_max_entries):
+        # Least recently used first
+        self.endpoint_cache: OrderedDict[str, tuple[float, list[str]]] = OrderedDict()
+        self.max_entries = max_entries
+        self.ttl_only_cache_ttl = 30  # short enough to handle reconnections
+        self.push_cache_ttl = config.endpoint_cache_ttl
+        self.cache_ttl = self.ttl_only_cache_ttl
+        self.stats = CacheStats()
+        self.stats_interval = 60
         self.redis_manager: RedisManager | None = None
         self.running = True
+        # Fraction of the TTL after which a hit also triggers a refresh
+        self.revalidate_after = config.endpoint_cache_revalidate_after
+        self.stats_task: asyncio.Task | None = None
+        self.watch_task: asyncio.Task | None = None
+        # One fetch per key at a time; everyone else waits on its future
+        self._inflight: dict[str, _InflightFetch] = {}
+        self._fetch_tasks: set[asyncio.Task] = set()
+        # Endpoint -> when its entries were last dropped, see invalidate_endpoint
+        self._invalidated_at: dict[str, float] = {}
+        self.invalidate_interval = 1.0
 
     async def set_redis_manager(self, redis_manager: RedisManager):
         self.redis_manager = redis_manager
 
     async def start(self):
-        self.cleanup_task = asyncio.create_task(self._cleanup_cache())
+        self.stats_task = asyncio.create_task(self._report_stats())
+        self.watch_task = asyncio.create_task(self._watch_endpoint_changes())
 
     async def stop(self):
         self.running = False
-        if self.cleanup_task:
-            self.cleanup_task.cancel()
+        for task in (self.stats_task, self.watch_task, *self._fetch_tasks):
+            if task:
+                task.cancel()
+
+    @staticmethod
+    def cache_key(receiver_id: str, event_type: str) -> str:
+        """The Redis key a receiver's endpoints live under.
+
+        `receiver_id` is a user id for some event types and a channel id for
+        others (libs.event.schema owns that distinction), so the key keeps the
+        two apart.
+        """
+        if EventType.is_user_addressed(event_type):
+            return RediKeys.user_grpc_endpoint(receiver_id)
+        return RediKeys.channel_grpc_endpoints(receiver_id)
 
     async def get_cached_endpoints(self, receiver_id: str, event_type: str):
-        cache_key = f"{receiver_id}:{event_type}"
+        resolved = await self.get_cached_endpoints_many([(receiver_id, event_type)])
+        return resolved[(receiver_id, event_type)]
+
+    async def get_cached_endpoints_many(
+        self, receivers: Iterable[tuple[str, str]]
+    ) -> dict[tuple[str, str], list[str]]:
+        """
+        Resolve every `(receiver_id, event_type)` of a batch at once.
+
+        Receivers are deduped, hits are served from the cache, and all misses
+        are fetched in a single pipelined round trip. A miss that another
+        caller is already fetching waits for that fetch instead of starting
+        its own, and entries past their revalidate point are served as they
+        are while one background fetch refreshes them.
+        """
         current_time = time.time()
+        keys: dict[tuple[str, str], str] = {}
+        resolved: dict[str, list[str]] = {}
+        pending: dict[str, asyncio.Future] = {}
+        missing_users: dict[str, str] = {}  # receiver_id -> cache key
+        missing_channels: dict[str, str] = {}
+        stale_users: dict[str, str] = {}
+        stale_channels: dict[str, str] = {}
 
-        # Check cache
-        if cache_key in self.endpoint_cache:
-            cached_time, endpoints = self.endpoint_cache[cache_key]
-            if current_time - cached_time < self.cache_ttl:
-                logger.debug(
-                    "Returning cached endpoints",
-                    user_id=receiver_id,
-                    cache_key=cache_key,
-                )
-                return endpoints
+        for receiver in receivers:
+            if receiver in keys:
+                continue
+            receiver_id, event_type = receiver
+            cache_key = self.cache_key(receiver_id, event_type)
+            keys[receiver] = cache_key
+            if cache_key in resolved or cache_key in pending:
+                continue
+            user_addressed = EventType.is_user_addressed(event_type)
+            endpoints, fresh = self._lookup(cache_key, current_time)
+            if endpoints is not None:
+                resolved[cache_key] = endpoints
+                if not fresh and cache_key not in self._inflight:
+                    stale = stale_users if user_addressed else stale_channels
+                    stale[receiver_id] = cache_key
+            elif cache_key in self._inflight:
+                self.stats.coalesced += 1
+                pending[cache_key] = self._inflight[cache_key].future
+            else:
+                missing = missing_users if user_addressed else missing_channels
+                missing[receiver_id] = cache_key
 
-        # Fetch from Redis — receiver_id is a user id for some event types and a
-        # channel id for others (libs.event.schema owns that distinction)
-        if EventType.is_user_addressed(event_type):
-            endpoints = await self.redis_manager.get_grpc_endpoint_for_user(receiver_id)
-        else:
-            endpoints = await self.redis_manager.get_grpc_endpoints_for_channel(
-                receiver_id
+        if stale_users or stale_channels:
+            self._start_fetch(stale_users, stale_channels)
+        if missing_users or missing_channels:
+            pending.update(self._start_fetch(missing_users, missing_channels))
+
+        for cache_key, future in pending.items():
+            # Shielded: a cancelled caller must not cancel a fetch others share
+            resolved[cache_key] = await asyncio.shield(future)
+
+        logger.debug(
+            "Resolved endpoints for batch",
+            receivers=len(keys),
+            fetched=len(missing_users) + len(missing_channels),
+            revalidated=len(stale_users) + len(stale_channels),
+        )
+        return {receiver: resolved[cache_key] for receiver, cache_key in keys.items()}
+
+    def _start_fetch(
+        self, users: dict[str, str], channels: dict[str, str]
+    ) -> dict[str, asyncio.Future]:
+        """
+        Fetch these receivers in one pipeline, in a task of its own. Each key
+        is registered as in flight until the answer is back.
+        """
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for cache_key in (*users.values(), *channels.values()):
+            future = loop.create_future()
+            # Nobody may be waiting on a background refresh; do not let its
+            # failure be reported as "exception never retrieved"
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._inflight[cache_key] = _InflightFetch(future)
+            futures[cache_key] = future
+
+        task = asyncio.create_task(self._fetch(users, channels))
+        self._fetch_tasks.add(task)
+        task.add_done_callback(self._fetch_tasks.discard)
+        return futures
+
+    async def _fetch(self, users: dict[str, str], channels: dict[str, str]):
+        started = time.time()
+        fetch_keys = [*users.values(), *channels.values()]
+        try:
+            user_endpoints, channel_endpoints = (
+                await self.redis_manager.get_grpc_endpoints_bulk(
+                    list(users), list(channels)
+                )
             )
+        except BaseException as e:
+            for cache_key in fetch_keys:
+                inflight = self._inflight.pop(cache_key, None)
+                if inflight and not inflight.future.done():
+                    inflight.future.set_exception(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            logger.error("Failed to fetch gRPC endpoints", error=e)
+            return
+
+        for missing, fetched in (
+            (users, user_endpoints),
+            (channels, channel_endpoints),
+        ):
+            for receiver_id, cache_key in missing.items():
+                endpoints = fetched.get(receiver_id) or []
+                inflight = self._inflight.pop(cache_key, None)
+                # A change published while the answer was on its way back
+                # makes that answer stale; use it once, do not cache it
+                if inflight is not None and not inflight.changed:
+                    self._store(cache_key, endpoints, started)
+                if inflight is not None and not inflight.future.done():
+                    inflight.future.set_result(endpoints)
+
+    def stats_snapshot(self) -> dict[str, int]:
+        return {
+            **asdict(self.stats),
+            "size": len(self.endpoint_cache),
+            "max_entries": self.max_entries,
+            "ttl": self.cache_ttl,
+        }
 
+    def _lookup(
+        self, cache_key: str, current_time: float
+    ) -> tuple[list[str] | None, bool]:
+        """
+        The cached answer and whether it is still fresh; `(None, False)` when
+        Redis has to be asked. A stale answer is past its revalidate point but
+        never past the TTL.
+        """
+        entry = self.endpoint_cache.get(cache_key)
+        if entry is None:
+            self.stats.misses += 1
+            return None, False
+        cached_time, endpoints = entry
+        age = current_time - cached_time
+        if age < self.cache_ttl:
+            self.endpoint_cache.move_to_end(cache_key)
+            self.stats.hits += 1
+            fresh = age < self.cache_ttl * self.revalidate_after
+            if not fresh:
+                self.stats.stale_hits += 1
+            return endpoints, fresh
+        del self.endpoint_cache[cache_key]
+        self.stats.expirations += 1
+        self.stats.misses += 1
+        return None, False
+
+    def _store(self, cache_key: str, endpoints: list[str] | None, current_time: float):
         # Only cache a positive result. "Nobody is connected" is the one answer
         # that changes the instant a client reconnects, and caching it for 30s
         # means every event to that channel is dropped for the rest of the
@@ -58,28 +262,128 @@ class GrpcEndpointCache:
         # page refresh was enough to silence a channel.
         if endpoints:
             self.endpoint_cache[cache_key] = (current_time, endpoints)
+            self.endpoint_cache.move_to_end(cache_key)
+            while len(self.endpoint_cache) > self.max_entries:
+                self.endpoint_cache.popitem(last=False)
+                self.stats.evictions += 1
         else:
+            self.stats.negative_lookups += 1
             self.endpoint_cache.pop(cache_key, None)
 
-        logger.debug(
-            "Fetched endpoints from Redis", receiver_id=receiver_id, endpoints=endpoints
-        )
-        return endpoints
+    def apply_change(self, change: EndpointChange):
+        """
+        Patch the cached entry for one published change. Keys that are not
+        cached are left alone — the next lookup fetches them anyway.
+        """
+        inflight = self._inflight.get(change.key)
+        if inflight is not None:
+            inflight.changed = True
+
+        entry = self.endpoint_cache.get(change.key)
+        if entry is None:
+            return
+        cached_time, endpoints = entry
+
+        # New lists rather than in-place edits: callers may hold the old one
+        if change.op == EndpointOp.SET:
+            patched = [change.endpoint]
+        elif change.op == EndpointOp.ADDED:
+            patched = (
+                endpoints
+                if change.endpoint in endpoints
+                else [*endpoints, change.endpoint]
+            )
+        elif change.op == EndpointOp.REMOVED:
+            patched = [e for e in endpoints if e != change.endpoint]
+        else:
+            patched = []
+
+        if patched:
+            self.endpoint_cache[change.key] = (cached_time, patched)
+        else:
+            del self.endpoint_cache[change.key]
+
+    def invalidate_endpoint(self, endpoint: str):
+        """
+        Drop every cached entry naming `endpoint`, after a delivery to it
+        failed or its circuit opened. A gateway that dies without
+        unregistering publishes no change, and the push TTL would otherwise
+        keep routing to it. Entries that are being fetched are not cached
+        when their answer comes back.
+
+        A gateway that is down fails every batch sent its way, so the cache
+        is walked at most once per `invalidate_interval` per endpoint.
+        """
+        current_time = time.time()
+        if (
+            current_time - self._invalidated_at.get(endpoint, 0)
+            < self.invalidate_interval
+        ):
+            return
+        self._invalidated_at[endpoint] = current_time
+
+        for inflight in self._inflight.values():
+            inflight.changed = True
+        stale = [
+            cache_key
+            for cache_key, (_, endpoints) in self.endpoint_cache.items()
+            if endpoint in endpoints
+        ]
+        for cache_key in stale:
+            del self.endpoint_cache[cache_key]
+        self.stats.invalidations += len(stale)
+        if stale:
+            logger.info(
+                "Dropped cached routes to failing gateway",
+                endpoint=endpoint,
+                entries=len(stale),
+            )
 
-    async def _cleanup_cache(self):
-        """Periodic cache cleanup to prevent memory leaks."""
+    async def _watch_endpoint_changes(self):
+        """
+        Follow the gateways' endpoint changes, falling back to TTL-only mode
+        whenever the subscription is down.
+        """
         while self.running:
-            await asyncio.sleep(self.cache_cleanup_interval)
-            current_time = time.time()
-            expired_keys = [
-                key
-                for key, (cached_time, _) in self.endpoint_cache.items()
-                if current_time - cached_time > self.cache_ttl
-            ]
-            for key in expired_keys:
-                del self.endpoint_cache[key]
-            if expired_keys:
-                logger.debug(
-                    "Cleaned up expired cache entries",
-                    num_expired_keys=len(expired_keys),
+            pubsub = None
+            try:
+                pubsub = await self.redis_manager.subscribe_endpoint_changes()
+                # Changes made before the subscription existed were missed
+                self.endpoint_cache.clear()
+                self.cache_ttl = self.push_cache_ttl
+                logger.info("Endpoint cache following pushed changes")
+
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        change = EndpointChange.model_validate_json(message["data"])
+                    except ValidationError as e:
+                        logger.warning("Ignoring malformed endpoint change", error=e)
+                        continue
+                    self.apply_change(change)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    "Endpoint change subscription lost, using TTL-only mode",
+                    error=e,
                 )
+            finally:
+                # Entries cached under the long TTL can no longer be trusted
+                self.cache_ttl = self.ttl_only_cache_ttl
+                self.endpoint_cache.clear()
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+            await asyncio.sleep(1)
+
+    async def _report_stats(self):
+        """Log the counters periodically. Expiry itself happens on read."""
+        while self.running:
+            await asyncio.sleep(self.stats_interval)
+            logger.info("Endpoint cache stats", **self.stats_snapshot())
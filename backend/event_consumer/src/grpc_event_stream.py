@@ -0,0 +1,124 @@
+import asyncio
+from collections import OrderedDict
+
+import grpc
+import structlog
+from libs.event import event_pb2_grpc
+from libs.event.event_pb2 import EventBatch as ProtobufEventBatch
+from libs.event.forwarding import RawEventBatch
+
+logger = structlog.get_logger(__name__)
+
+
+class StreamingUnsupported(Exception):
+    """The gateway does not serve StreamEvents yet; use SendEvents."""
+
+
+class EventStream:
+    """
+    One long-lived `StreamEvents` call to a gateway, shared by every shard
+    worker that delivers there.
+
+    Each batch is written under the next sequence number and waits for the
+    gateway's cumulative ack to cover it. The call is opened on first use. A
+    broken call fails every batch still waiting for its ack — those are left
+    unacked in Redis like any failed delivery — and the next send opens a new
+    one.
+    """
+
+    def __init__(self, endpoint: str, stub: event_pb2_grpc.EventServiceStub):
+        self.endpoint = endpoint
+        self.stub = stub
+        self._call = None
+        self._reader: asyncio.Task | None = None
+        self._next_sequence = 1
+        # Sequence -> future resolved by the ack covering it, oldest first
+        self._unacked: OrderedDict[int, asyncio.Future] = OrderedDict()
+        # Writes on one call must not interleave
+        self._write_lock = asyncio.Lock()
+
+    async def send(self, batch: ProtobufEventBatch | RawEventBatch, timeout: float):
+        """Write a batch and wait until the gateway has delivered it."""
+        async with self._write_lock:
+            if self._call is None:
+                self._open()
+            call = self._call
+
+            sequence = self._next_sequence
+            self._next_sequence += 1
+            batch.sequence = sequence
+            acked = asyncio.get_running_loop().create_future()
+            # Failed by `_fail` even when no one is left waiting on it
+            acked.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._unacked[sequence] = acked
+
+            try:
+                await asyncio.wait_for(call.write(batch), timeout)
+            except grpc.aio.AioRpcError as e:
+                error = self._translate(e)
+                self._fail(call, error)
+                raise error from e
+            except Exception as e:
+                self._fail(call, e)
+                raise
+
+        try:
+            await asyncio.wait_for(asyncio.shield(acked), timeout)
+        except asyncio.TimeoutError:
+            # Acks are cumulative, so nothing behind this batch can be acked
+            # either; start over on a fresh call
+            self._fail(call, TimeoutError(f"No ack from {self.endpoint}"))
+            raise
+
+    async def close(self):
+        call, reader = self._call, self._reader
+        if call is not None:
+            self._fail(call, ConnectionError(f"Stream to {self.endpoint} closed"))
+        if reader is not None:
+            reader.cancel()
+
+    def _open(self):
+        self._call = self.stub.StreamEvents()
+        self._reader = asyncio.create_task(self._read_acks(self._call))
+        logger.debug("Opened event stream", endpoint=self.endpoint)
+
+    async def _read_acks(self, call):
+        try:
+            while True:
+                ack = await call.read()
+                if ack is grpc.aio.EOF:
+                    raise ConnectionError(f"{self.endpoint} ended the event stream")
+                while self._unacked and next(iter(self._unacked)) <= ack.sequence:
+                    _, acked = self._unacked.popitem(last=False)
+                    if not acked.done():
+                        acked.set_result(None)
+        except grpc.aio.AioRpcError as e:
+            self._fail(call, self._translate(e))
+        except asyncio.CancelledError:
+            self._fail(call, ConnectionError(f"Stream to {self.endpoint} closed"))
+            raise
+        except Exception as e:
+            self._fail(call, e)
+
+    def _fail(self, call, error: BaseException):
+        """Drop a broken call and fail everything still waiting on it."""
+        if self._call is not call:
+            return  # already replaced
+        self._call = None
+        call.cancel()
+        unacked, self._unacked = self._unacked, OrderedDict()
+        for acked in unacked.values():
+            if not acked.done():
+                acked.set_exception(error)
+        if unacked:
+            logger.warning(
+                "Event stream failed",
+                endpoint=self.endpoint,
+                unacked=len(unacked),
+                error=error,
+            )
+
+    def _translate(self, error: grpc.aio.AioRpcError) -> Exception:
+        if error.code() == grpc.StatusCode.UNIMPLEMENTED:
+            return StreamingUnsupported(self.endpoint)
+        return error
@@ -2,8 +2,10 @@ import asyncio
 from typing import List
 
 import structlog
+from libs import lease_scripts
 from libs.rediskeys import RediKeys
 from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
 from src.config import config
 
 logger = structlog.get_logger(__name__)
@@ -19,6 +21,16 @@ class RedisManager:
             try:
                 self.redis = Redis(host=host, port=port, db=db)
                 await self.redis.ping()
+                self._acquire_lease = self.redis.register_script(
+                    lease_scripts.ACQUIRE_LEASE
+                )
+                self._release_lease = self.redis.register_script(
+                    lease_scripts.RELEASE_LEASE
+                )
+                self._fenced_ack = self.redis.register_script(lease_scripts.FENCED_ACK)
+                self._fenced_dead_letter = self.redis.register_script(
+                    lease_scripts.FENCED_DEAD_LETTER
+                )
                 logger.info("Connected to Redis")
                 break
             except KeyboardInterrupt:
@@ -48,8 +60,20 @@ class RedisManager:
         await self.redis.srem(RediKeys.event_consumers(), consumer_id)
         logger.info("Consumer unregistered", consumer_id=consumer_id)
 
-    async def send_heartbeat(self, consumer_id: str, ttl: int = config.heartbeat_ttl):
-        await self.redis.set(RediKeys.heartbeat(consumer_id), "alive", ex=ttl)
+    async def send_heartbeat(
+        self,
+        consumer_id: str,
+        ttl: int = config.heartbeat_ttl,
+        stats: dict[str, int] | None = None,
+    ):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(RediKeys.heartbeat(consumer_id), "alive", ex=ttl)
+        if stats:
+            # Scrapeable from Redis; expires with the heartbeat
+            stats_key = RediKeys.consumer_stats(consumer_id)
+            pipe.hset(stats_key, mapping=stats)
+            pipe.expire(stats_key, ttl)
+        await pipe.execute()
 
     async def fetch_leased_shards(self, consumer_id: str) -> List[str]:
         leases = await self.redis.hgetall(RediKeys.leases())
@@ -59,6 +83,27 @@ class RedisManager:
             if assigned_consumer.decode("utf-8") == str(consumer_id)
         ]
 
+    async def acquire_lease(self, shard: str, consumer_id: str) -> int:
+        """
+        Take a shard leased to us. Returns its fencing epoch, or 0 while the
+        previous holder still has it (-1 if it is not leased to us at all).
+        """
+        return await self._acquire_lease(
+            keys=[RediKeys.leases(), RediKeys.lease_holders(), RediKeys.lease_epochs()],
+            args=[shard, consumer_id],
+        )
+
+    async def release_lease(self, shard: str, consumer_id: str) -> bool:
+        released = await self._release_lease(
+            keys=[RediKeys.lease_holders(), RediKeys.lease_changes()],
+            args=[shard, consumer_id],
+        )
+        return released == 1
+
+    async def fetch_leases_version(self) -> int | None:
+        version = await self.redis.get(RediKeys.leases_version())
+        return int(version) if version is not None else None
+
     async def read_stream(
         self, consumer_id: str, stream_name: str, consumer_group: str
     ):
@@ -88,11 +133,115 @@ class RedisManager:
             return [endpoint.decode()]
         return None
 
-    async def batch_ack_messages(
-        self, stream_name: str, consumer_group: str, message_ids: List[str]
+    async def get_grpc_endpoints_bulk(
+        self, user_ids: List[str], channel_ids: List[str]
+    ) -> tuple[dict[str, List[str]], dict[str, List[str]]]:
+        """
+        Resolve many receivers in one round trip. Returns the endpoints per
+        user id and per channel id; nobody connected is an empty list.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.get(RediKeys.user_grpc_endpoint(user_id))
+        for channel_id in channel_ids:
+            pipe.smembers(RediKeys.channel_grpc_endpoints(channel_id))
+        results = await pipe.execute()
+
+        user_endpoints = {
+            user_id: [endpoint.decode()] if endpoint else []
+            for user_id, endpoint in zip(user_ids, results)
+        }
+        channel_endpoints = {
+            channel_id: [m.decode() for m in members]
+            for channel_id, members in zip(channel_ids, results[len(user_ids) :])
+        }
+        logger.debug(
+            "Fetched instances in bulk",
+            users=len(user_ids),
+            channels=len(channel_ids),
+        )
+        return user_endpoints, channel_endpoints
+
+    async def subscribe_endpoint_changes(self) -> PubSub:
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(RediKeys.grpc_endpoint_changes())
+        return pubsub
+
+    async def pending_entries(
+        self,
+        stream_name: str,
+        consumer_group: str,
+        min_idle_ms: int,
+        count: int,
+        start: bytes | str = "-",
+    ) -> List[dict]:
+        """
+        Pending entries of any consumer that have been idle for a while, from
+        `start` on; `(<id>` starts right after that id.
+        """
+        return await self.redis.xpending_range(
+            stream_name,
+            consumer_group,
+            min=start,
+            max="+",
+            count=count,
+            idle=min_idle_ms,
+        )
+
+    async def claim_messages(
+        self,
+        stream_name: str,
+        consumer_group: str,
+        consumer_id: str,
+        min_idle_ms: int,
+        message_ids: List[bytes],
     ):
-        """Batch acknowledge multiple messages."""
-        pipe = self.redis.pipeline()
-        for message_id in message_ids:
-            pipe.xack(stream_name, consumer_group, message_id)
-        await pipe.execute()
+        """
+        Take pending entries over, counting a new delivery. Entries another
+        consumer touched since are skipped by the idle check.
+        """
+        return await self.redis.xclaim(
+            stream_name, consumer_group, consumer_id, min_idle_ms, message_ids
+        )
+
+    async def dead_letter_messages(
+        self, stream_name: str, consumer_group: str, entries: List[tuple], epoch: int
+    ) -> bool:
+        """
+        Move `(message_id, fields)` entries to the dead-letter stream, in one
+        script so an entry is never both acked and missing from the DLQ.
+        The DLQ is trimmed to about `dead_letter_max_len` entries, oldest
+        first. False, and nothing moved, once the shard's epoch has moved on.
+        """
+        args = [stream_name, epoch, consumer_group, config.dead_letter_max_len]
+        for message_id, fields in entries:
+            args += [message_id, len(fields)]
+            for field, value in fields.items():
+                args += [field, value]
+        moved = await self._fenced_dead_letter(
+            keys=[
+                RediKeys.lease_epochs(),
+                stream_name,
+                RediKeys.dead_letter_stream(stream_name),
+            ],
+            args=args,
+        )
+        return moved != -1
+
+    async def subscribe_lease_changes(self) -> PubSub:
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(RediKeys.lease_changes())
+        return pubsub
+
+    async def batch_ack_messages(
+        self, stream_name: str, consumer_group: str, message_ids: List[str], epoch: int
+    ) -> bool:
+        """
+        Batch acknowledge multiple messages. False, and nothing acked, once
+        another consumer has taken the shard.
+        """
+        acked = await self._fenced_ack(
+            keys=[RediKeys.lease_epochs(), stream_name],
+            args=[stream_name, epoch, consumer_group, *message_ids],
+        )
+        return acked != -1
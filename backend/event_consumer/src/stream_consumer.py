@@ -21,12 +21,21 @@ class RedisStreamConsumer:
         self.redis_manager: RedisManager | None = None
         self.consumer_id = consumer_id
         self.fetched_shards: list[str] = []
+        # `leases` version fetched_shards was read at
+        self.leases_version: int | None = None
         self.consumer_group = "grpc_group"
         self.running = True
         self.connection_pool = GrpcConnectionPool(
             max_connections=config.max_grpc_connections,
         )
         self.shard_workers: dict[str, StreamWorker] = {}
+        # Shards being drained before their lease is released
+        self.handovers: dict[str, asyncio.Task] = {}
+        # Set by pushed lease changes; the consume loop waits on it
+        self.leases_changed = asyncio.Event()
+        # Seconds between lease polls: long while changes are pushed to us
+        self.lease_poll_interval = 1.0
+        self.lease_watch_task: asyncio.Task | None = None
         self.grpc_endpoint_cache = GrpcEndpointCache()
 
     def set_redis_manager(self, redis_manager: RedisManager):
@@ -39,6 +48,7 @@ class RedisStreamConsumer:
             await self.register()
             await self.grpc_endpoint_cache.set_redis_manager(self.redis_manager)
             await self.grpc_endpoint_cache.start()
+            self.lease_watch_task = asyncio.create_task(self.watch_lease_changes())
 
         except Exception as e:
             logger.critical(
@@ -49,9 +59,14 @@ class RedisStreamConsumer:
     async def stop(self):
         """Stop the consumer and cleanup connections."""
         self.running = False
-        for worker in self.shard_workers.values():
-            await worker.stop()
+        if self.lease_watch_task:
+            self.lease_watch_task.cancel()
+        # Drain and release every shard, so their next owners need not wait
+        # for our heartbeat to expire
+        for shard, worker in self.shard_workers.items():
+            self.hand_over(shard, worker)
         self.shard_workers.clear()
+        await asyncio.gather(*self.handovers.values(), return_exceptions=True)
         await self.connection_pool.stop()
         await self.grpc_endpoint_cache.stop()
 
@@ -71,18 +86,105 @@ class RedisStreamConsumer:
         next_heartbeat = time.monotonic()
         while self.running:
             # Send heartbeat
-            await self.redis_manager.send_heartbeat(self.consumer_id, ttl=15)
+            await self.redis_manager.send_heartbeat(
+                self.consumer_id, ttl=15, stats=self.collect_stats()
+            )
             # Avoid drift
             next_heartbeat += 5
             sleep_duration = max(0, next_heartbeat - time.monotonic())
             await asyncio.sleep(sleep_duration)
 
+    def collect_stats(self) -> dict[str, int]:
+        return {
+            **{
+                f"endpoint_cache_{name}": value
+                for name, value in self.grpc_endpoint_cache.stats_snapshot().items()
+            },
+            **{
+                f"grpc_{name}": value
+                for name, value in self.connection_pool.health_stats().items()
+            },
+        }
+
+    async def fetch_leased_shards_if_changed(self) -> list[str]:
+        """
+        Re-read the leases only when lease_manager has bumped their version.
+        Without a version (an older lease_manager) they are read every time.
+        """
+        version = await self.redis_manager.fetch_leases_version()
+        if version is not None and version == self.leases_version:
+            return self.fetched_shards
+        shards = await self.redis_manager.fetch_leased_shards(self.consumer_id)
+        self.leases_version = version
+        return shards
+
+    def hand_over(self, shard: str, worker: StreamWorker):
+        """Drain a shard that moved away, then release its lease."""
+        task = asyncio.create_task(self._hand_over(shard, worker))
+        self.handovers[shard] = task
+        task.add_done_callback(lambda _: self._handover_done(shard))
+
+    def _handover_done(self, shard: str):
+        self.handovers.pop(shard, None)
+        # The shard may have been leased back to us meanwhile
+        self.leases_changed.set()
+
+    async def _hand_over(self, shard: str, worker: StreamWorker):
+        try:
+            await worker.drain(config.lease_drain_timeout)
+        finally:
+            await self.redis_manager.release_lease(shard, self.consumer_id)
+            logger.debug("Released shard", shard=shard)
+
+    async def wait_for_lease_change(self):
+        try:
+            await asyncio.wait_for(
+                self.leases_changed.wait(), timeout=self.lease_poll_interval
+            )
+        except asyncio.TimeoutError:
+            pass  # safety-net poll
+        self.leases_changed.clear()
+
+    async def watch_lease_changes(self):
+        """
+        Wake the consume loop on every lease reassignment or release, falling
+        back to fast polling whenever the subscription is down.
+        """
+        while self.running:
+            pubsub = None
+            try:
+                pubsub = await self.redis_manager.subscribe_lease_changes()
+                self.lease_poll_interval = config.lease_poll_interval
+                # Changes published before the subscription existed were missed
+                self.leases_changed.set()
+                logger.info("Following pushed lease changes")
+
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.leases_changed.set()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    "Lease change subscription lost, polling leases", error=e
+                )
+            finally:
+                self.lease_poll_interval = 1.0
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+            await asyncio.sleep(1)
+
     async def consume_loop(self):
         while self.running:
             try:
                 # Add timeout to prevent blocking indefinitely
                 current_fetched_shards = await asyncio.wait_for(
-                    self.redis_manager.fetch_leased_shards(self.consumer_id),
+                    self.fetch_leased_shards_if_changed(),
                     timeout=5.0,  # 5 second timeout
                 )
 
@@ -94,30 +196,43 @@ class RedisStreamConsumer:
 
                 # Create workers to read from each stream. Update on each lease call.
                 for shard in self.fetched_shards:
-                    if shard in self.shard_workers:
+                    if shard in self.shard_workers or shard in self.handovers:
                         continue
                     try:
+                        epoch = await self.redis_manager.acquire_lease(
+                            shard, self.consumer_id
+                        )
+                        if epoch <= 0:
+                            # The previous owner is still draining it; it is
+                            # ours once released or its heartbeat expires
+                            continue
                         self.shard_workers[shard] = StreamWorker(
                             shard,
                             self.consumer_id,
                             self.connection_pool,
                             self.grpc_endpoint_cache,
                             self.redis_manager,
+                            epoch,
                         )
                         self.shard_workers[shard].start()
+                        logger.debug(
+                            "Launched worker for shard", shard=shard, epoch=epoch
+                        )
                     except Exception as e:
                         logger.error("Error launching worker for shard", shard=shard)
                         await asyncio.sleep(1)
-                    logger.debug("Launched worker for shard", shard=shard)
 
                 # Cleanup tasks that are not in the shards list
                 for shard in list(self.shard_workers.keys()):
-                    if shard not in self.fetched_shards:
-                        await self.shard_workers[shard].stop()
+                    worker = self.shard_workers[shard]
+                    if worker.fenced:
+                        # Taken by another consumer; nothing left to release
+                        del self.shard_workers[shard]
+                    elif shard not in self.fetched_shards:
                         del self.shard_workers[shard]
-                        logger.debug("Stopped worker for shard", shard=shard)
+                        self.hand_over(shard, worker)
 
-                await asyncio.sleep(0.1)
+                await self.wait_for_lease_change()
 
             except asyncio.TimeoutError:
                 logger.warning("Timeout fetching leased shards, retrying...")
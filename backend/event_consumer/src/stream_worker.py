@@ -1,18 +1,45 @@
 import asyncio
+import time
 from collections import defaultdict
 
 import structlog
 from libs.event.codec import EventCodec
-from libs.event.event_pb2 import EventBatch as ProtobufEventBatch
+from libs.event.forwarding import RawEventBatch
 from src.config import config
-from src.grpc_connection_pool import GrpcConnectionPool
+from src.grpc_connection_pool import CircuitOpen, GrpcConnectionPool
 from src.grpc_endpoint_cache import GrpcEndpointCache
+from src.grpc_event_stream import StreamingUnsupported
 from src.redis_manager import RedisManager
 
 logger = structlog.get_logger(__name__)
 
 
 class StreamWorker:
+    """
+    Reads one stream shard and delivers its events to the gateways.
+
+    Batches are pipelined: while one batch is in flight to the gateways the
+    next one is already being read and routed. Two rules keep that safe:
+
+    - At most `max_inflight_batches` batches are between XREADGROUP and XACK.
+      A full window stops the reads, so a lagging gateway slows the shard
+      down instead of piling batches up in memory.
+    - Transmissions to one gateway go out in stream order — a batch waits for
+      the previous batch to that gateway to finish. Every event for a receiver
+      goes to the same gateways, so per-receiver order is kept too.
+
+    An entry is acked once every gateway it was sent to has it. One that
+    failed stays pending and remembers which gateways still owe it; the
+    recovery loop retries it, to those gateways only, with exponential
+    backoff, and moves it to the dead-letter stream after
+    `config.max_deliveries`. The same loop claims entries left pending by a
+    crashed consumer or a former lease holder.
+
+    Acks and dead-letter moves are fenced by `epoch`, the token the shard's
+    lease was taken with. Once another consumer has taken the shard they are
+    refused, and the worker stops.
+    """
+
     def __init__(
         self,
         stream_name,
@@ -20,38 +47,95 @@ class StreamWorker:
         connection_pool: GrpcConnectionPool,
         grpc_endpoint_cache: GrpcEndpointCache,
         redis_manager: RedisManager,
+        epoch: int,
+        max_inflight_batches: int = config.max_inflight_batches,
     ):
         self.redis_manager = redis_manager
+        self.epoch = epoch
+        # Set once an ack was refused: the shard belongs to someone else now
+        self.fenced = False
         self.consumer_id = consumer_id
         self.consumer_group = "grpc_group"
         self.stream_name = stream_name
         self.running = True
         self.connection_pool = connection_pool
         self.grpc_endpoint_cache = grpc_endpoint_cache
-        self.event_loop = asyncio.get_running_loop()
         self.task = None
+        self.recovery_task = None
+        self.recovery_interval = 1
+        # Pages of the PEL one recovery pass reads at most
+        self.recovery_pages = 10
+        # Where the next pass resumes reading the PEL
+        self._pending_cursor: bytes = b"-"
+        self.inflight = asyncio.Semaphore(max_inflight_batches)
+        # Last transmission queued per gateway; the next one chains onto it
+        self._endpoint_tails: dict[str, asyncio.Task] = {}
+        # Held so in-flight batches are not garbage collected mid-delivery
+        self._batch_tasks: set[asyncio.Task] = set()
+        # Entries in the window; the recovery loop leaves them alone
+        self._inflight_ids: set[bytes] = set()
+        # Pending entry -> the gateways that have not received it yet
+        self._failed_endpoints: dict[bytes, set[str]] = {}
 
     def start(self):
         self.task = asyncio.create_task(self._read_and_process_stream())
+        self.recovery_task = asyncio.create_task(self._recover_pending())
 
     async def stop(self):
         self.running = False
-        if self.task:
-            self.task.cancel()
+        for task in (self.task, self.recovery_task):
+            if task:
+                task.cancel()
+
+    async def drain(self, timeout: float):
+        """
+        Stop reading and wait for the batches in flight to be delivered and
+        acked, so the next owner of the shard starts where this one stopped.
+        """
+        await self.stop()
+        if self._batch_tasks:
+            _, unfinished = await asyncio.wait(self._batch_tasks, timeout=timeout)
+            if unfinished:
+                # Left pending; the next owner's recovery loop picks them up
+                logger.warning(
+                    "Shard drain timed out",
+                    stream_name=self.stream_name,
+                    batches=len(unfinished),
+                )
+
+    def _fence(self):
+        if self.fenced:
+            return
+        self.fenced = True
+        self.running = False
+        logger.warning(
+            "Shard was taken over, stopping its worker",
+            stream_name=self.stream_name,
+            epoch=self.epoch,
+        )
+        for task in (self.task, self.recovery_task):
+            if task:
+                task.cancel()
 
     async def _read_and_process_stream(self):
         while self.running:
+            # Backpressure: no new read until a slot in the window frees up
+            await self.inflight.acquire()
             try:
                 event_batch = await self.redis_manager.read_stream(
                     self.consumer_id, self.stream_name, self.consumer_group
                 )
 
                 if event_batch:
-                    # Run in background
-                    self.event_loop.create_task(self._process_batch(event_batch))
+                    await self._process_batch(event_batch)
                 else:
+                    self.inflight.release()
                     await asyncio.sleep(0.01)
+            except asyncio.CancelledError:
+                self.inflight.release()
+                raise
             except Exception as e:
+                self.inflight.release()
                 logger.error(
                     "Error reading from stream", stream_name=self.stream_name, error=e
                 )
@@ -59,51 +143,310 @@ class StreamWorker:
 
     async def _process_batch(self, event_batch):
         """
-        Process events from the Redis stream concurrently
+        Route a batch and queue its delivery. Returns once the transmissions
+        are queued; the batch holds its window slot until it is acked.
         """
-
-        gateway_batches = defaultdict(list)
         stream_name_str = event_batch[0][0].decode("utf-8")
-        message_ids = []
+        # Marked before routing awaits the endpoint lookup, or the recovery
+        # loop could claim and deliver these a second time meanwhile
+        message_ids = {
+            message_id for _, messages in event_batch for message_id, _ in messages
+        }
+        self._inflight_ids.update(message_ids)
+        try:
+            gateway_batches, message_endpoints = await self._route_batch(event_batch)
+        except BaseException:
+            self._inflight_ids.difference_update(message_ids)
+            raise
+        # Undecodable entries are not sent; they are the recovery loop's
+        self._inflight_ids.difference_update(message_ids.difference(message_endpoints))
+
+        # Chained here, synchronously and in read order, so a later batch can
+        # never overtake an earlier one on the same gateway
+        transmissions = {}
+        for endpoint, events in gateway_batches.items():
+            batch = RawEventBatch(events)
+            previous = self._endpoint_tails.get(endpoint)
+            transmission = asyncio.create_task(
+                self._transmit_in_order(previous, endpoint, batch)
+            )
+            transmission.add_done_callback(
+                lambda task, endpoint=endpoint: self._release_tail(endpoint, task)
+            )
+            self._endpoint_tails[endpoint] = transmission
+            transmissions[endpoint] = transmission
+
+        batch_task = asyncio.create_task(
+            self._complete_batch(stream_name_str, message_endpoints, transmissions)
+        )
+        self._batch_tasks.add(batch_task)
+        batch_task.add_done_callback(self._batch_tasks.discard)
+
+    async def _route_batch(self, event_batch):
+        """
+        Group a batch's events by the gateways that hold their receivers.
+        Also returns the gateways each entry is sent to, by message id.
+        """
+        events = []
+        message_endpoints: dict[bytes, set[str]] = {}
         for _, messages in event_batch:
 
             for message_id, message_data in messages:
-                message_ids.append(message_id)
-                decoded_data = {k.decode(): v.decode() for k, v in message_data.items()}
-                event = EventCodec.to_grpc(decoded_data)
-                endpoints = await self.grpc_endpoint_cache.get_cached_endpoints(
-                    event.receiver_id, event.event_type
-                )
-                if not endpoints:
-                    logger.warning(
-                        "No gRPC endpoints found for receiver",
-                        receiver_id=event.receiver_id,
-                    )
+                if not message_data:
+                    # Claimed after it was trimmed; nothing left to deliver
+                    message_endpoints[message_id] = set()
                     continue
-                for endpoint in endpoints:
-                    gateway_batches[endpoint].append(event)
+                try:
+                    # Forwarded as serialized; only the routing keys are read
+                    events.append(
+                        (message_id, *EventCodec.route_stream_entry(message_data))
+                    )
+                except Exception as e:
+                    # Left pending: retried, then dead-lettered like any
+                    # entry that cannot be delivered
+                    logger.error(
+                        "Undecodable stream entry",
+                        message_id=message_id,
+                        error=e,
+                    )
 
-        tasks = []
-        for endpoint, events in gateway_batches.items():
-            batch = ProtobufEventBatch(events=events)
-            tasks.append(self._transmit_batch(endpoint, batch))
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        for result in results:
-            if isinstance(result, Exception):
-                logger.error("Failed to send events to gRPC endpoint", error=result)
-                raise result
-
-        await self.redis_manager.batch_ack_messages(
-            stream_name_str,
-            self.consumer_group,
-            message_ids,
+        # One cache pass and at most one Redis round trip for the whole batch
+        endpoints_by_receiver = (
+            await self.grpc_endpoint_cache.get_cached_endpoints_many(
+                (receiver_id, event_type) for _, receiver_id, event_type, _ in events
+            )
         )
 
-    async def _transmit_batch(self, endpoint: str, batch: ProtobufEventBatch):
-        stub = await self.connection_pool.get_stub(endpoint)
+        gateway_batches = defaultdict(list)
+        for message_id, receiver_id, event_type, payload in events:
+            endpoints = endpoints_by_receiver[(receiver_id, event_type)]
+            owed = self._failed_endpoints.get(message_id)
+            if owed is not None:
+                # A retry goes only to the gateways that missed it. One that
+                # no longer holds the receiver is owed nothing.
+                endpoints = [endpoint for endpoint in endpoints if endpoint in owed]
+            elif not endpoints:
+                logger.warning(
+                    "No gRPC endpoints found for receiver",
+                    receiver_id=receiver_id,
+                )
+            message_endpoints[message_id] = set(endpoints)
+            for endpoint in endpoints:
+                gateway_batches[endpoint].append(payload)
+
+        return gateway_batches, message_endpoints
+
+    async def _complete_batch(
+        self,
+        stream_name: str,
+        message_endpoints: dict[bytes, set[str]],
+        transmissions: dict[str, asyncio.Task],
+    ):
+        try:
+            results = await asyncio.gather(
+                *transmissions.values(), return_exceptions=True
+            )
+            failures = {
+                endpoint: result
+                for endpoint, result in zip(transmissions, results)
+                if isinstance(result, Exception)
+            }
+            if failures:
+                logger.error(
+                    "Failed to send events to gRPC endpoint",
+                    stream_name=stream_name,
+                    failed=sorted(failures),
+                    error=next(iter(failures.values())),
+                )
+
+            delivered = []
+            for message_id, endpoints in message_endpoints.items():
+                owed = endpoints.intersection(failures)
+                if owed:
+                    # Stays pending until the recovery loop gets it through
+                    self._failed_endpoints[message_id] = owed
+                else:
+                    self._failed_endpoints.pop(message_id, None)
+                    delivered.append(message_id)
+
+            if delivered and not await self.redis_manager.batch_ack_messages(
+                stream_name, self.consumer_group, delivered, self.epoch
+            ):
+                self._fence()
+        except Exception as e:
+            logger.error("Error completing batch", stream_name=stream_name, error=e)
+        finally:
+            self._inflight_ids.difference_update(message_endpoints)
+            self.inflight.release()
+
+    async def _recover_pending(self):
+        """
+        Retry the shard's pending entries that nobody is working on: this
+        worker's failed deliveries, and whatever a crashed consumer or the
+        previous lease holder left behind.
+        """
+        while self.running:
+            try:
+                await asyncio.sleep(self.recovery_interval)
+                await self._reclaim_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(
+                    "Error recovering pending entries",
+                    stream_name=self.stream_name,
+                    error=e,
+                )
+
+    async def _reclaim_due(self):
+        deliveries = await self._scan_due()
+        if not deliveries:
+            return
+
+        # Retries take a slot in the window like any other batch
+        await self.inflight.acquire()
         try:
-            # Without a deadline a dead gateway blocks this worker's shard
-            await stub.SendEvents(batch, timeout=config.grpc_timeout)
+            claimed = await self.redis_manager.claim_messages(
+                self.stream_name,
+                self.consumer_group,
+                self.consumer_id,
+                config.retry_base_ms,
+                list(deliveries),
+            )
+            exhausted = [
+                entry
+                for entry in claimed
+                if deliveries[entry[0]] >= config.max_deliveries
+            ]
+            retries = [
+                entry
+                for entry in claimed
+                if deliveries[entry[0]] < config.max_deliveries
+            ]
+            if exhausted:
+                await self._dead_letter(exhausted, deliveries)
+            if retries:
+                logger.info(
+                    "Retrying pending entries",
+                    stream_name=self.stream_name,
+                    count=len(retries),
+                )
+                await self._process_batch([(self.stream_name.encode(), retries)])
+            else:
+                self.inflight.release()
+        except BaseException:
+            self.inflight.release()
+            raise
+
+    async def _scan_due(self) -> dict[bytes, int]:
+        """
+        Up to a batch of pending entries due for a retry, with how often each
+        was delivered. Pages through the PEL from where the last pass stopped,
+        so entries at its head that are in flight or backing off do not hide
+        the ones behind them. A pass reads at most `recovery_pages` pages and
+        starts over from the head once it reaches the end.
+        """
+        deliveries = {}
+        for _ in range(self.recovery_pages):
+            pending = await self.redis_manager.pending_entries(
+                self.stream_name,
+                self.consumer_group,
+                min_idle_ms=config.retry_base_ms,
+                count=config.redis_xread_count,
+                start=self._pending_cursor,
+            )
+            for entry in pending:
+                if len(deliveries) == config.redis_xread_count:
+                    return deliveries
+                message_id = entry["message_id"]
+                self._pending_cursor = b"(" + message_id
+                times_delivered = entry["times_delivered"]
+                due = entry["time_since_delivered"] >= self._retry_delay_ms(
+                    times_delivered
+                )
+                if due and message_id not in self._inflight_ids:
+                    deliveries[message_id] = times_delivered
+            if len(pending) < config.redis_xread_count:
+                self._pending_cursor = b"-"
+                break
+        return deliveries
+
+    async def _dead_letter(self, entries: list, deliveries: dict[bytes, int]):
+        dead = []
+        for message_id, message_data in entries:
+            owed = self._failed_endpoints.pop(message_id, set())
+            fields = {
+                **(message_data or {}),
+                "dlq_message_id": message_id,
+                "dlq_deliveries": deliveries[message_id],
+                "dlq_failed_endpoints": ",".join(sorted(owed)),
+            }
+            dead.append((message_id, fields))
+
+        if not await self.redis_manager.dead_letter_messages(
+            self.stream_name, self.consumer_group, dead, self.epoch
+        ):
+            self._fence()
+            return
+        logger.error(
+            "Moved undeliverable entries to the dead-letter stream",
+            stream_name=self.stream_name,
+            count=len(dead),
+        )
+
+    @staticmethod
+    def _retry_delay_ms(deliveries: int) -> int:
+        return min(config.retry_base_ms * 2 ** (deliveries - 1), config.retry_max_ms)
+
+    async def _transmit_in_order(
+        self,
+        previous: asyncio.Task | None,
+        endpoint: str,
+        batch: RawEventBatch,
+    ):
+        if previous is not None:
+            # Wait for it to finish, not to succeed — its failure is its own
+            await asyncio.wait({previous})
+        await self._transmit_batch(endpoint, batch)
+
+    def _release_tail(self, endpoint: str, task: asyncio.Task):
+        if self._endpoint_tails.get(endpoint) is task:
+            del self._endpoint_tails[endpoint]
+
+    async def _transmit_batch(self, endpoint: str, batch: RawEventBatch):
+        health = self.connection_pool.health(endpoint)
+        if not health.allow_request():
+            # Fails at once so this gateway does not hold up the others; the
+            # entries stay pending and the recovery loop retries them
+            self.grpc_endpoint_cache.invalidate_endpoint(endpoint)
+            raise CircuitOpen(endpoint)
+
+        started = time.monotonic()
+        try:
+            await self._send(endpoint, batch)
+        except asyncio.CancelledError:
+            health.record_cancelled()
+            raise
         except Exception as e:
+            health.record_failure()
+            # Retries resolve the receivers again rather than trusting a
+            # cached route to a gateway that may be gone
+            self.grpc_endpoint_cache.invalidate_endpoint(endpoint)
             logger.error("Failed to send events to gRPC endpoint", error=e)
             raise e
+        health.record_success(time.monotonic() - started)
+
+    async def _send(self, endpoint: str, batch: RawEventBatch):
+        if config.grpc_delivery_mode == "stream":
+            stream = await self.connection_pool.get_stream(endpoint)
+            if stream is not None:
+                try:
+                    await stream.send(batch, timeout=config.grpc_timeout)
+                    return
+                except StreamingUnsupported:
+                    # An older gateway; nothing was delivered, go unary
+                    await self.connection_pool.mark_unary_only(endpoint)
+
+        stub = await self.connection_pool.get_stub(endpoint)
+        # Without a deadline a dead gateway blocks this worker's shard
+        await stub.SendEvents(batch, timeout=config.grpc_timeout)
@@ -0,0 +1,107 @@
+"""Connection pool and per-gateway circuit breaker.
+
+Same stdlib `unittest` setup as test_grpc_endpoint_cache.py.
+"""
+
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.grpc_connection_pool import (  # noqa: E402
+    CircuitState,
+    EndpointHealth,
+    GrpcConnectionPool,
+)
+
+
+class GrpcConnectionPoolTest(unittest.IsolatedAsyncioTestCase):
+    # Channels connect lazily; nothing listens on these ports
+    async def asyncSetUp(self):
+        self.pool = GrpcConnectionPool(max_connections=2)
+        self.addAsyncCleanup(self.pool.stop)
+
+    async def test_a_hit_returns_the_cached_stub(self):
+        stub = await self.pool.get_stub("localhost:1")
+        self.assertIs(await self.pool.get_stub("localhost:1"), stub)
+
+    async def test_concurrent_misses_create_one_channel(self):
+        stubs = await asyncio.gather(
+            *(self.pool.get_stub("localhost:1") for _ in range(10))
+        )
+        self.assertEqual(len({id(stub) for stub in stubs}), 1)
+        self.assertEqual(len(self.pool._channels), 1)
+
+    async def test_the_least_recently_used_channel_is_evicted(self):
+        await self.pool.get_stub("localhost:1")
+        await self.pool.get_stub("localhost:2")
+        await self.pool.get_stub("localhost:1")
+        await self.pool.get_stub("localhost:3")
+
+        self.assertFalse(self.pool.is_connected("localhost:2"))
+        self.assertEqual(list(self.pool._channels), ["localhost:1", "localhost:3"])
+        self.assertEqual(len(self.pool._closing), 1, "closed in the background")
+        await asyncio.gather(*self.pool._closing)
+
+
+class EndpointHealthTest(unittest.TestCase):
+    def setUp(self):
+        self.health = EndpointHealth(
+            "gateway-a:6000", failure_threshold=3, open_seconds=10
+        )
+
+    def fail(self, times):
+        for _ in range(times):
+            self.assertTrue(self.health.allow_request())
+            self.health.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.health.record_success(0.01)
+        self.fail(2)
+        self.assertEqual(
+            self.health.state, CircuitState.CLOSED, "a success resets the count"
+        )
+
+        self.fail(1)
+        self.assertEqual(self.health.state, CircuitState.OPEN)
+        self.assertFalse(self.health.allow_request())
+
+    def test_one_trial_after_the_open_period(self):
+        self.fail(3)
+        self.health.opened_at -= 10
+
+        self.assertTrue(self.health.allow_request())
+        self.assertEqual(self.health.state, CircuitState.HALF_OPEN)
+        self.assertFalse(self.health.allow_request(), "one trial at a time")
+
+        self.health.record_success(0.01)
+        self.assertEqual(self.health.state, CircuitState.CLOSED)
+        self.assertTrue(self.health.allow_request())
+
+    def test_a_failed_trial_opens_it_again(self):
+        self.fail(3)
+        self.health.opened_at -= 10
+        self.fail(1)
+
+        self.assertEqual(self.health.state, CircuitState.OPEN)
+        self.assertFalse(self.health.allow_request())
+
+    def test_an_abandoned_trial_frees_the_slot(self):
+        self.fail(3)
+        self.health.opened_at -= 10
+        self.assertTrue(self.health.allow_request())
+        self.health.record_cancelled()
+
+        self.assertTrue(self.health.allow_request())
+
+    def test_latency_is_smoothed(self):
+        self.health.record_success(0.1)
+        self.health.record_success(0.6)
+        self.assertAlmostEqual(self.health.latency_ewma, 0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -19,6 +19,7 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
+from libs.routing import EndpointChange, EndpointOp  # noqa: E402
 from src.grpc_endpoint_cache import GrpcEndpointCache  # noqa: E402
 
 
@@ -29,12 +30,34 @@ class FakeRedisManager:
         self.answers = list(answers)
         self.calls = 0
 
-    async def get_grpc_endpoints_for_channel(self, receiver_id):
-        self.calls += 1
-        return self.answers.pop(0) if self.answers else []
+    async def get_grpc_endpoints_bulk(self, user_ids, channel_ids):
+        answers = {}
+        for receiver_id in [*user_ids, *channel_ids]:
+            self.calls += 1
+            answers[receiver_id] = self.answers.pop(0) if self.answers else []
+        return (
+            {user_id: answers[user_id] for user_id in user_ids},
+            {channel_id: answers[channel_id] for channel_id in channel_ids},
+        )
+
 
-    async def get_grpc_endpoint_for_user(self, receiver_id):
-        return await self.get_grpc_endpoints_for_channel(receiver_id)
+class FakeBulkRedisManager:
+    """Answers bulk lookups from fixed tables and records every round trip."""
+
+    def __init__(self, users=None, channels=None):
+        self.users = users or {}
+        self.channels = channels or {}
+        self.round_trips = []
+
+    async def get_grpc_endpoints_bulk(self, user_ids, channel_ids):
+        self.round_trips.append((list(user_ids), list(channel_ids)))
+        return (
+            {user_id: self.users.get(user_id, []) for user_id in user_ids},
+            {
+                channel_id: self.channels.get(channel_id, [])
+                for channel_id in channel_ids
+            },
+        )
 
 
 class GrpcEndpointCacheTest(unittest.TestCase):
@@ -90,5 +113,290 @@ class GrpcEndpointCacheTest(unittest.TestCase):
         self.assertEqual(self.lookup("id-1", "notification"), ["gateway-b:6000"])
 
 
+class BulkResolutionTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = GrpcEndpointCache()
+
+    def resolve(self, receivers):
+        return asyncio.run(self.cache.get_cached_endpoints_many(receivers))
+
+    def test_a_cold_batch_is_one_round_trip(self):
+        self.cache.redis_manager = FakeBulkRedisManager(
+            users={"user-1": ["gateway-a:6000"]},
+            channels={"channel-1": ["gateway-a:6000", "gateway-b:6000"]},
+        )
+        receivers = [("channel-1", "message")] * 50 + [
+            ("user-1", "notification"),
+            ("channel-2", "message"),
+        ]
+
+        resolved = self.resolve(receivers)
+
+        self.assertEqual(
+            self.cache.redis_manager.round_trips,
+            [(["user-1"], ["channel-1", "channel-2"])],
+            "receivers are deduped and every miss goes in one pipeline",
+        )
+        self.assertEqual(
+            resolved[("channel-1", "message")], ["gateway-a:6000", "gateway-b:6000"]
+        )
+        self.assertEqual(resolved[("user-1", "notification")], ["gateway-a:6000"])
+        self.assertEqual(resolved[("channel-2", "message")], [])
+
+    def test_hits_are_not_fetched_again(self):
+        self.cache.redis_manager = FakeBulkRedisManager(
+            channels={"channel-1": ["gateway-a:6000"]}
+        )
+        self.resolve([("channel-1", "message")])
+        self.resolve([("channel-1", "voice_state"), ("channel-2", "message")])
+
+        self.assertEqual(
+            self.cache.redis_manager.round_trips,
+            [([], ["channel-1"]), ([], ["channel-2"])],
+            "a channel is one entry whatever the channel-addressed event type",
+        )
+
+
+class BoundedCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = GrpcEndpointCache(max_entries=2)
+        self.cache.redis_manager = FakeBulkRedisManager(
+            channels={
+                "channel-1": ["gateway-a:6000"],
+                "channel-2": ["gateway-a:6000"],
+                "channel-3": ["gateway-a:6000"],
+            }
+        )
+
+    def resolve(self, *channel_ids):
+        asyncio.run(
+            self.cache.get_cached_endpoints_many(
+                [(channel_id, "message") for channel_id in channel_ids]
+            )
+        )
+
+    def test_the_least_recently_used_entry_is_evicted(self):
+        self.resolve("channel-1", "channel-2")
+        self.resolve("channel-1")  # channel-2 is now the coldest
+        self.resolve("channel-3")
+
+        self.assertEqual(
+            list(self.cache.endpoint_cache),
+            ["channel:channel-1:grpc_endpoints", "channel:channel-3:grpc_endpoints"],
+        )
+        self.assertEqual(self.cache.stats.evictions, 1)
+
+    def test_counters(self):
+        self.resolve("channel-1", "channel-4")  # two misses, one nobody-connected
+        self.resolve("channel-1")  # a hit
+        self.cache.cache_ttl = 0
+        self.resolve("channel-1")  # expired
+
+        stats = self.cache.stats_snapshot()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 3)
+        self.assertEqual(stats["negative_lookups"], 1)
+        self.assertEqual(stats["expirations"], 1)
+        self.assertEqual(stats["size"], 1)
+
+
+class PushedChangesTest(unittest.TestCase):
+    KEY = "channel:channel-1:grpc_endpoints"
+
+    def setUp(self):
+        self.cache = GrpcEndpointCache()
+        self.cache.redis_manager = FakeBulkRedisManager(
+            channels={"channel-1": ["gateway-a:6000"]}
+        )
+
+    def resolve(self):
+        resolved = asyncio.run(
+            self.cache.get_cached_endpoints_many([("channel-1", "message")])
+        )
+        return resolved[("channel-1", "message")]
+
+    def test_changes_patch_the_cached_entry(self):
+        self.resolve()
+
+        self.cache.apply_change(
+            EndpointChange(key=self.KEY, op=EndpointOp.ADDED, endpoint="gateway-b:6000")
+        )
+        self.assertEqual(self.resolve(), ["gateway-a:6000", "gateway-b:6000"])
+
+        self.cache.apply_change(
+            EndpointChange(
+                key=self.KEY, op=EndpointOp.REMOVED, endpoint="gateway-a:6000"
+            )
+        )
+        self.assertEqual(self.resolve(), ["gateway-b:6000"])
+        self.assertEqual(
+            len(self.cache.redis_manager.round_trips), 1, "patched, not refetched"
+        )
+
+    def test_removing_the_last_gateway_drops_the_entry(self):
+        self.resolve()
+        self.cache.apply_change(
+            EndpointChange(
+                key=self.KEY, op=EndpointOp.REMOVED, endpoint="gateway-a:6000"
+            )
+        )
+        self.assertNotIn(self.KEY, self.cache.endpoint_cache)
+
+    def test_an_answer_overtaken_by_a_change_is_not_cached(self):
+        redis_manager = self.cache.redis_manager
+        real_fetch = redis_manager.get_grpc_endpoints_bulk
+
+        async def fetch_then_gateway_leaves(user_ids, channel_ids):
+            answer = await real_fetch(user_ids, channel_ids)
+            # The gateway unregisters while our reply is on its way back
+            self.cache.apply_change(
+                EndpointChange(
+                    key=self.KEY, op=EndpointOp.REMOVED, endpoint="gateway-a:6000"
+                )
+            )
+            return answer
+
+        redis_manager.get_grpc_endpoints_bulk = fetch_then_gateway_leaves
+        self.resolve()
+
+        self.assertNotIn(
+            self.KEY,
+            self.cache.endpoint_cache,
+            "a stale answer cached under the long TTL would route to a gone gateway",
+        )
+
+
+class FailingGatewayTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = GrpcEndpointCache()
+        self.cache.redis_manager = FakeBulkRedisManager(
+            channels={
+                "channel-1": ["gateway-a:6000", "gateway-b:6000"],
+                "channel-2": ["gateway-b:6000"],
+            },
+            users={"user-1": ["gateway-a:6000"]},
+        )
+
+    def resolve(self):
+        return asyncio.run(
+            self.cache.get_cached_endpoints_many(
+                [
+                    ("channel-1", "message"),
+                    ("channel-2", "message"),
+                    ("user-1", "friend_request"),
+                ]
+            )
+        )
+
+    def test_entries_naming_a_failed_gateway_are_dropped(self):
+        self.resolve()
+        self.cache.invalidate_endpoint("gateway-a:6000")
+
+        self.assertEqual(
+            list(self.cache.endpoint_cache), ["channel:channel-2:grpc_endpoints"]
+        )
+        self.assertEqual(self.cache.stats.invalidations, 2)
+
+        self.resolve()
+        self.assertEqual(
+            len(self.cache.redis_manager.round_trips), 2, "dropped entries refetch"
+        )
+
+    def test_repeated_failures_walk_the_cache_once_per_interval(self):
+        self.resolve()
+        self.cache.invalidate_endpoint("gateway-a:6000")
+        self.resolve()
+        self.cache.invalidate_endpoint("gateway-a:6000")
+        self.assertEqual(len(self.cache.endpoint_cache), 3)
+
+        self.cache.invalidate_interval = 0
+        self.cache.invalidate_endpoint("gateway-a:6000")
+        self.assertEqual(len(self.cache.endpoint_cache), 1)
+
+
+class SlowBulkRedisManager(FakeBulkRedisManager):
+    """Holds every round trip until `release` is set."""
+
+    def __init__(self, **tables):
+        super().__init__(**tables)
+        self.release = asyncio.Event()
+
+    async def get_grpc_endpoints_bulk(self, user_ids, channel_ids):
+        await self.release.wait()
+        return await super().get_grpc_endpoints_bulk(user_ids, channel_ids)
+
+
+class SharedFetchTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = GrpcEndpointCache()
+        self.cache.redis_manager = SlowBulkRedisManager(
+            channels={"channel-1": ["gateway-a:6000"]}
+        )
+
+    async def test_concurrent_misses_share_one_fetch(self):
+        lookups = [
+            asyncio.create_task(self.cache.get_cached_endpoints("channel-1", "message"))
+            for _ in range(10)
+        ]
+        await asyncio.sleep(0)
+        self.cache.redis_manager.release.set()
+
+        self.assertEqual(await asyncio.gather(*lookups), [["gateway-a:6000"]] * 10)
+        self.assertEqual(len(self.cache.redis_manager.round_trips), 1)
+        self.assertEqual(self.cache.stats.coalesced, 9)
+
+    async def test_a_failed_fetch_reaches_every_waiter_and_is_not_kept(self):
+        async def unreachable(user_ids, channel_ids):
+            await self.cache.redis_manager.release.wait()
+            raise ConnectionError("redis down")
+
+        self.cache.redis_manager.get_grpc_endpoints_bulk = unreachable
+        lookups = [
+            asyncio.create_task(self.cache.get_cached_endpoints("channel-1", "message"))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        self.cache.redis_manager.release.set()
+
+        results = await asyncio.gather(*lookups, return_exceptions=True)
+        self.assertTrue(all(isinstance(r, ConnectionError) for r in results))
+        self.assertEqual(self.cache._inflight, {}, "the next miss must retry")
+
+    async def test_a_stale_entry_is_served_while_it_refreshes(self):
+        self.cache.redis_manager.release.set()
+        await self.cache.get_cached_endpoints("channel-1", "message")
+
+        # Past the revalidate point, still inside the TTL; the gateway moved
+        key = "channel:channel-1:grpc_endpoints"
+        cached_time, endpoints = self.cache.endpoint_cache[key]
+        self.cache.endpoint_cache[key] = (
+            cached_time - 0.9 * self.cache.cache_ttl,
+            endpoints,
+        )
+        self.cache.redis_manager.channels["channel-1"] = ["gateway-b:6000"]
+        self.cache.redis_manager.release.clear()
+
+        self.assertEqual(
+            await self.cache.get_cached_endpoints("channel-1", "message"),
+            ["gateway-a:6000"],
+            "served without waiting for Redis",
+        )
+        self.assertEqual(
+            await self.cache.get_cached_endpoints("channel-1", "message"),
+            ["gateway-a:6000"],
+        )
+        self.assertEqual(self.cache.stats.stale_hits, 2)
+
+        self.cache.redis_manager.release.set()
+        await asyncio.gather(*self.cache._fetch_tasks)
+        self.assertEqual(
+            len(self.cache.redis_manager.round_trips), 2, "one refresh, not one per hit"
+        )
+        self.assertEqual(
+            await self.cache.get_cached_endpoints("channel-1", "message"),
+            ["gateway-b:6000"],
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
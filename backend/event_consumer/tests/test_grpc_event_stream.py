@@ -0,0 +1,147 @@
+"""Streaming delivery to one gateway, and the batches it carries.
+
+Same stdlib `unittest` setup as test_grpc_endpoint_cache.py.
+"""
+
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+import grpc
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from libs.event.event_pb2 import Event, EventBatch, StreamAck  # noqa: E402
+from libs.event.forwarding import RawEventBatch  # noqa: E402
+from src.grpc_event_stream import EventStream, StreamingUnsupported  # noqa: E402
+
+
+class FakeCall:
+    """A StreamEvents call; the test decides what the gateway answers."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.written = []
+        self.responses = asyncio.Queue()
+        self.cancelled = False
+
+    async def write(self, batch):
+        if self.error:
+            raise self.error
+        self.written.append(batch.sequence)
+
+    async def read(self):
+        response = await self.responses.get()
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def cancel(self):
+        self.cancelled = True
+        self.responses.put_nowait(asyncio.CancelledError())
+
+
+class FakeStub:
+    def __init__(self, *calls):
+        self.calls = list(calls)
+        self.opened = 0
+
+    def StreamEvents(self):
+        self.opened += 1
+        return self.calls.pop(0)
+
+
+async def until(predicate, timeout=1):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate() and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.001)
+
+
+class EventStreamTest(unittest.IsolatedAsyncioTestCase):
+    async def send_all(self, stream, count, timeout=1):
+        first = stream._next_sequence
+        sends = [
+            asyncio.create_task(stream.send(EventBatch(), timeout=timeout))
+            for _ in range(count)
+        ]
+        # Every batch written
+        await until(
+            lambda: stream._next_sequence == first + count
+            and not stream._write_lock.locked()
+        )
+        return sends
+
+    async def test_one_ack_covers_every_batch_before_it(self):
+        call = FakeCall()
+        stream = EventStream("gateway-a:6000", FakeStub(call))
+        self.addAsyncCleanup(stream.close)
+
+        sends = await self.send_all(stream, 3)
+        self.assertEqual(call.written, [1, 2, 3], "all three share one call")
+
+        call.responses.put_nowait(StreamAck(sequence=2))
+        await until(lambda: sends[1].done())
+        self.assertEqual([send.done() for send in sends], [True, True, False])
+
+        call.responses.put_nowait(StreamAck(sequence=3))
+        await asyncio.gather(*sends)
+
+    async def test_a_broken_stream_fails_unacked_batches_and_reopens(self):
+        broken, fresh = FakeCall(), FakeCall()
+        stub = FakeStub(broken, fresh)
+        stream = EventStream("gateway-a:6000", stub)
+        self.addAsyncCleanup(stream.close)
+
+        sends = await self.send_all(stream, 2)
+        broken.responses.put_nowait(StreamAck(sequence=1))
+        broken.responses.put_nowait(grpc.aio.EOF)
+
+        results = await asyncio.gather(*sends, return_exceptions=True)
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], ConnectionError)
+
+        retry = await self.send_all(stream, 1)
+        fresh.responses.put_nowait(StreamAck(sequence=fresh.written[-1]))
+        await asyncio.gather(*retry)
+        self.assertEqual(stub.opened, 2)
+
+    async def test_a_missing_ack_times_out_and_drops_the_call(self):
+        call = FakeCall()
+        stream = EventStream("gateway-a:6000", FakeStub(call))
+        self.addAsyncCleanup(stream.close)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await stream.send(EventBatch(), timeout=0.01)
+        self.assertTrue(call.cancelled)
+
+    async def test_an_older_gateway_is_reported_as_unsupported(self):
+        unimplemented = grpc.aio.AioRpcError(
+            grpc.StatusCode.UNIMPLEMENTED, grpc.aio.Metadata(), grpc.aio.Metadata()
+        )
+        stream = EventStream("gateway-a:6000", FakeStub(FakeCall(unimplemented)))
+        self.addAsyncCleanup(stream.close)
+
+        with self.assertRaises(StreamingUnsupported):
+            await stream.send(EventBatch(), timeout=1)
+
+
+class RawEventBatchTest(unittest.TestCase):
+    def test_frames_events_like_an_event_batch(self):
+        # 200 bytes of text makes a length that needs a two-byte varint
+        events = [
+            Event(event_id=str(i), text="x" * 200 * i).SerializeToString()
+            for i in range(3)
+        ]
+        for sequence in (0, 1, 300):
+            self.assertEqual(
+                RawEventBatch(events, sequence).SerializeToString(),
+                EventBatch(
+                    events=[Event.FromString(event) for event in events],
+                    sequence=sequence,
+                ).SerializeToString(),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,473 @@
+"""Pipelined shard worker.
+
+Same stdlib `unittest` setup as test_grpc_endpoint_cache.py.
+
+Before the in-flight window, every XREADGROUP result became a fire-and-forget
+task: a burst produced hundreds of overlapping batches per shard, and two
+batches for one channel could reach the gateway in either order.
+"""
+
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from libs.event.codec import STREAM_ENCODING_VERSION  # noqa: E402
+from libs.event.event_pb2 import Event, EventBatch  # noqa: E402
+from src.config import config  # noqa: E402
+from src.grpc_connection_pool import EndpointHealth  # noqa: E402
+from src.stream_worker import StreamWorker  # noqa: E402
+
+STREAM = b"stream_shard:0"
+CHANNEL = "4b7a9f5e-2c1d-4e8f-9a6b-3c2d1e0f9a8b"
+SENDER = "9d8c7b6a-5e4f-4a3b-8c2d-1e0f9a8b7c6d"
+
+
+def stream_entry(message_id: str, text: str):
+    event = Event(
+        event_id=message_id,
+        event_type="message",
+        sender_id=SENDER,
+        receiver_id=CHANNEL,
+        text=text,
+        metadata="{}",
+        timestamp="2025-01-01T00:00:00+00:00",
+    )
+    return (
+        message_id.encode(),
+        {
+            b"v": STREAM_ENCODING_VERSION,
+            b"receiver_id": CHANNEL.encode(),
+            b"event_type": b"message",
+            b"event": event.SerializeToString(),
+        },
+    )
+
+
+def legacy_stream_entry(message_id: str, text: str):
+    """One field per attribute, as written before the binary encoding."""
+    return (
+        message_id.encode(),
+        {
+            b"event_id": message_id.encode(),
+            b"event_type": b"message",
+            b"sender_id": SENDER.encode(),
+            b"receiver_id": CHANNEL.encode(),
+            b"text": text.encode(),
+            b"metadata": b"{}",
+            b"timestamp": b"2025-01-01T00:00:00+00:00",
+        },
+    )
+
+
+def stream_id(message_id: bytes) -> tuple[int, int]:
+    milliseconds, sequence = message_id.lstrip(b"(").split(b"-")
+    return int(milliseconds), int(sequence)
+
+
+class FakeRedisManager:
+    """Hands out queued XREADGROUP results, then nothing; records acks."""
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.reads = 0
+        self.acked = []
+        # The shard's current lease epoch; acks under any other are refused
+        self.epoch = 1
+
+    async def read_stream(self, consumer_id, stream_name, consumer_group):
+        if not self.batches:
+            await asyncio.sleep(0.01)
+            return []
+        self.reads += 1
+        return [(STREAM, self.batches.pop(0))]
+
+    async def batch_ack_messages(self, stream_name, consumer_group, message_ids, epoch):
+        if epoch != self.epoch:
+            return False
+        self.acked.extend(m.decode() for m in message_ids)
+        return True
+
+    async def pending_entries(
+        self, stream_name, consumer_group, min_idle_ms, count, start="-"
+    ):
+        return []
+
+
+class FakeRecoveringRedisManager(FakeRedisManager):
+    """A PEL holding `pending`: message id -> (times delivered, fields)."""
+
+    def __init__(self, batches, pending=None):
+        super().__init__(batches)
+        self.pending = pending or {}
+        # Message id -> idle time, for entries not idle long enough to retry
+        self.idle_ms = {}
+        self.pending_reads = 0
+        self.dead_lettered = []
+
+    async def batch_ack_messages(self, stream_name, consumer_group, message_ids, epoch):
+        if not await super().batch_ack_messages(
+            stream_name, consumer_group, message_ids, epoch
+        ):
+            return False
+        for message_id in message_ids:
+            self.pending.pop(message_id, None)
+        return True
+
+    async def pending_entries(
+        self, stream_name, consumer_group, min_idle_ms, count, start="-"
+    ):
+        self.pending_reads += 1
+        message_ids = sorted(self.pending, key=stream_id)
+        if start not in ("-", b"-"):
+            # Only ever exclusive, `(<id>`
+            message_ids = [m for m in message_ids if stream_id(m) > stream_id(start)]
+        return [
+            {
+                "message_id": message_id,
+                "consumer": b"consumer-0",
+                "time_since_delivered": self.idle_ms.get(message_id, 10**6),
+                "times_delivered": self.pending[message_id][0],
+            }
+            for message_id in message_ids[:count]
+        ]
+
+    async def claim_messages(
+        self, stream_name, consumer_group, consumer_id, min_idle_ms, message_ids
+    ):
+        claimed = []
+        for message_id in message_ids:
+            deliveries, fields = self.pending[message_id]
+            self.pending[message_id] = (deliveries + 1, fields)
+            claimed.append((message_id, fields))
+        return claimed
+
+    async def dead_letter_messages(self, stream_name, consumer_group, entries, epoch):
+        if epoch != self.epoch:
+            return False
+        for message_id, fields in entries:
+            self.dead_lettered.append(fields)
+            self.pending.pop(message_id, None)
+        return True
+
+
+class FakeEndpointCache:
+    def __init__(self, endpoints=("ws_gateway:6000",)):
+        self.endpoints = list(endpoints)
+        self.invalidated = []
+
+    async def get_cached_endpoints_many(self, receivers):
+        return {receiver: self.endpoints for receiver in receivers}
+
+    def invalidate_endpoint(self, endpoint):
+        self.invalidated.append(endpoint)
+
+
+class SlowEndpointCache(FakeEndpointCache):
+    """Holds every lookup until `release` is set."""
+
+    def __init__(self, endpoints=("ws_gateway:6000",)):
+        super().__init__(endpoints)
+        self.release = asyncio.Event()
+
+    async def get_cached_endpoints_many(self, receivers):
+        await self.release.wait()
+        return await super().get_cached_endpoints_many(receivers)
+
+
+class FakeStub:
+    """A gateway whose answer to each call is released by the test."""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.started = []
+        self.delivered = []
+        self.release = asyncio.Event()
+
+    async def SendEvents(self, batch, timeout=None):
+        # Parsed like the gateway does, from the framed bytes
+        events = EventBatch.FromString(batch.SerializeToString()).events
+        texts = [event.text for event in events]
+        self.started.append(texts)
+        await self.release.wait()
+        if self.fail:
+            raise ConnectionError("gateway down")
+        self.delivered.extend(texts)
+
+
+class FakeConnectionPool:
+    def __init__(self, stub, stubs=None):
+        self.stub = stub
+        self.stubs = stubs or {}
+        self.endpoint_health = {}
+
+    def health(self, endpoint):
+        return self.endpoint_health.setdefault(endpoint, EndpointHealth(endpoint))
+
+    async def get_stub(self, endpoint):
+        return self.stubs.get(endpoint, self.stub)
+
+    async def get_stream(self, endpoint):
+        return None  # a gateway that only serves the unary RPCs
+
+
+class StreamWorkerTest(unittest.IsolatedAsyncioTestCase):
+    def make_worker(
+        self,
+        redis_manager,
+        stub,
+        window=2,
+        endpoints=None,
+        stubs=None,
+        recovery_interval=0.01,
+    ):
+        worker = StreamWorker(
+            STREAM.decode(),
+            "consumer-1",
+            FakeConnectionPool(stub, stubs),
+            FakeEndpointCache(endpoints or ["ws_gateway:6000"]),
+            redis_manager,
+            epoch=1,
+            max_inflight_batches=window,
+        )
+        worker.recovery_interval = recovery_interval
+        worker.start()
+        self.addAsyncCleanup(worker.stop)
+        return worker
+
+    async def test_a_full_window_stops_reading(self):
+        batches = [[stream_entry(f"{i}-0", f"m{i}")] for i in range(1, 6)]
+        redis_manager = FakeRedisManager(batches)
+        stub = FakeStub()
+        self.make_worker(redis_manager, stub, window=2)
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(
+            redis_manager.reads, 2, "a stalled gateway must stop reads at the window"
+        )
+
+        stub.release.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(redis_manager.reads, 5)
+        self.assertEqual(redis_manager.acked, ["1-0", "2-0", "3-0", "4-0", "5-0"])
+
+    async def test_batches_reach_a_gateway_in_stream_order(self):
+        batches = [[stream_entry("1-0", "first")], [stream_entry("2-0", "second")]]
+        stub = FakeStub()
+        self.make_worker(FakeRedisManager(batches), stub, window=4)
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(
+            stub.started,
+            [["first"]],
+            "the second batch must wait for the first one to the same gateway",
+        )
+
+        stub.release.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(stub.delivered, ["first", "second"])
+
+    async def test_reads_both_entry_encodings(self):
+        undecodable = (b"4-0", {b"v": b"99", b"event": b""})
+        message_id, fields = stream_entry("3-0", "unrouted")
+        # Tagged, but written before the routing keys were copied out
+        unrouted = (message_id, {b"v": fields[b"v"], b"event": fields[b"event"]})
+        batch = [
+            legacy_stream_entry("1-0", "old"),
+            stream_entry("2-0", "new"),
+            unrouted,
+            undecodable,
+        ]
+        redis_manager = FakeRedisManager([batch])
+        stub = FakeStub()
+        stub.release.set()
+        self.make_worker(redis_manager, stub)
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(stub.delivered, ["old", "new", "unrouted"])
+        self.assertEqual(
+            redis_manager.acked, ["1-0", "2-0", "3-0"], "4-0 stays pending"
+        )
+
+    async def test_a_failed_delivery_is_not_acked(self):
+        redis_manager = FakeRedisManager([[stream_entry("1-0", "lost")]])
+        stub = FakeStub(fail=True)
+        stub.release.set()
+        worker = self.make_worker(redis_manager, stub)
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(redis_manager.acked, [])
+        self.assertEqual(
+            worker.grpc_endpoint_cache.invalidated,
+            ["ws_gateway:6000"],
+            "the retry must not reuse a cached route to the failed gateway",
+        )
+
+    async def test_an_open_circuit_does_not_hold_up_a_healthy_gateway(self):
+        redis_manager = FakeRedisManager([[stream_entry("1-0", "hello")]])
+        healthy, dead = FakeStub(), FakeStub()
+        healthy.release.set()  # `dead` never answers
+        worker = self.make_worker(
+            redis_manager,
+            healthy,
+            endpoints=["gateway-a:6000", "gateway-b:6000"],
+            stubs={"gateway-b:6000": dead},
+        )
+        health = worker.connection_pool.health("gateway-b:6000")
+        for _ in range(health.failure_threshold):
+            health.record_failure()
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(healthy.delivered, ["hello"])
+        self.assertEqual(dead.started, [], "skipped rather than awaited")
+        self.assertEqual(worker.grpc_endpoint_cache.invalidated, ["gateway-b:6000"])
+        self.assertEqual(worker._failed_endpoints, {b"1-0": {"gateway-b:6000"}})
+
+    async def test_drain_finishes_the_batches_in_flight(self):
+        redis_manager = FakeRedisManager([[stream_entry("1-0", "last")]])
+        stub = FakeStub()
+        worker = self.make_worker(redis_manager, stub)
+        await asyncio.sleep(0.05)
+
+        drain = asyncio.create_task(worker.drain(timeout=1))
+        await asyncio.sleep(0.01)
+        self.assertFalse(drain.done(), "waits for the gateway")
+        stub.release.set()
+        await drain
+
+        self.assertEqual(redis_manager.acked, ["1-0"])
+        self.assertTrue(worker.task.cancelled(), "no reads after the drain")
+
+    async def test_a_refused_ack_stops_the_worker(self):
+        redis_manager = FakeRedisManager(
+            [[stream_entry("1-0", "a")], [stream_entry("2-0", "b")]]
+        )
+        redis_manager.epoch = 2  # another consumer took the shard
+        stub = FakeStub()
+        stub.release.set()
+        worker = self.make_worker(redis_manager, stub, window=1)
+
+        await asyncio.sleep(0.05)
+        self.assertTrue(worker.fenced)
+        self.assertEqual(redis_manager.acked, [])
+        self.assertEqual(redis_manager.reads, 1, "stopped reading the shard")
+
+
+class RecoveryTest(unittest.IsolatedAsyncioTestCase):
+    make_worker = StreamWorkerTest.make_worker
+
+    def gateways(self, fail_b: bool):
+        gateway_a, gateway_b = FakeStub(), FakeStub(fail=fail_b)
+        gateway_a.release.set()
+        gateway_b.release.set()
+        return gateway_a, gateway_b
+
+    async def test_only_the_failed_gateway_gets_the_retry(self):
+        entry = stream_entry("1-0", "hello")
+        redis_manager = FakeRecoveringRedisManager(
+            [[entry]], pending={b"1-0": (1, entry[1])}
+        )
+        gateway_a, gateway_b = self.gateways(fail_b=True)
+        worker = self.make_worker(
+            redis_manager,
+            gateway_a,
+            endpoints=["gateway-a:6000", "gateway-b:6000"],
+            stubs={"gateway-b:6000": gateway_b},
+            recovery_interval=3600,  # retried when the test says so
+        )
+        await asyncio.sleep(0.05)
+        self.assertEqual(redis_manager.acked, [], "gateway-b still owes it")
+
+        gateway_b.fail = False
+        await worker._reclaim_due()
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(gateway_a.delivered, ["hello"], "not sent to gateway-a again")
+        self.assertEqual(gateway_b.delivered, ["hello"])
+        self.assertEqual(redis_manager.acked, ["1-0"])
+
+    async def test_entries_a_crashed_consumer_left_are_delivered(self):
+        _, fields = stream_entry("1-0", "orphan")
+        redis_manager = FakeRecoveringRedisManager([], pending={b"1-0": (1, fields)})
+        stub = FakeStub()
+        stub.release.set()
+        self.make_worker(redis_manager, stub)
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(stub.delivered, ["orphan"])
+        self.assertEqual(redis_manager.acked, ["1-0"])
+
+    async def test_an_entry_being_routed_is_not_claimed(self):
+        entry = stream_entry("1-0", "once")
+        # Read, so pending; old enough for a retry to be due
+        redis_manager = FakeRecoveringRedisManager(
+            [[entry]], pending={b"1-0": (1, entry[1])}
+        )
+        stub = FakeStub()
+        stub.release.set()
+        worker = self.make_worker(redis_manager, stub, recovery_interval=3600)
+        worker.grpc_endpoint_cache = SlowEndpointCache()
+
+        await asyncio.sleep(0.05)
+        # A claimed retry would be stuck behind the same lookup
+        await asyncio.wait_for(worker._reclaim_due(), timeout=1)
+        self.assertEqual(
+            redis_manager.pending[b"1-0"][0], 1, "claimed while its lookup ran"
+        )
+
+        worker.grpc_endpoint_cache.release.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(stub.delivered, ["once"])
+        self.assertEqual(worker._inflight_ids, set())
+
+    async def test_an_entry_out_of_attempts_is_dead_lettered(self):
+        _, fields = stream_entry("1-0", "doomed")
+        redis_manager = FakeRecoveringRedisManager(
+            [], pending={b"1-0": (config.max_deliveries, fields)}
+        )
+        stub = FakeStub(fail=True)
+        stub.release.set()
+        self.make_worker(redis_manager, stub)
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(stub.started, [], "not delivered again")
+        self.assertEqual(len(redis_manager.dead_lettered), 1)
+        self.assertEqual(redis_manager.dead_lettered[0]["dlq_message_id"], b"1-0")
+        self.assertEqual(redis_manager.pending, {})
+
+    async def test_entries_behind_a_page_not_due_are_retried(self):
+        page = config.redis_xread_count
+        total = page + 2
+        pending = {
+            f"{i}-0".encode(): (1, stream_entry(f"{i}-0", f"m{i}")[1])
+            for i in range(1, total + 1)
+        }
+        redis_manager = FakeRecoveringRedisManager([], pending=pending)
+        # A whole page at the head of the PEL is still backing off
+        for i in range(1, page + 1):
+            redis_manager.idle_ms[f"{i}-0".encode()] = 0
+        stub = FakeStub()
+        stub.release.set()
+        worker = self.make_worker(redis_manager, stub, recovery_interval=3600)
+
+        await worker._reclaim_due()
+        await asyncio.sleep(0.05)
+        self.assertEqual(stub.delivered, [f"m{i}" for i in range(page + 1, total + 1)])
+        self.assertEqual(redis_manager.pending_reads, 2)
+
+        # The next pass starts over from the head
+        redis_manager.idle_ms.clear()
+        await worker._reclaim_due()
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(stub.delivered), total)
+
+    def test_backoff_doubles_up_to_the_cap(self):
+        delays = [StreamWorker._retry_delay_ms(n) for n in range(1, 12)]
+        self.assertEqual(delays[:3], [config.retry_base_ms * f for f in (1, 2, 4)])
+        self.assertEqual(delays[-1], config.retry_max_ms)
+
+
+if __name__ == "__main__":
+    unittest.main()
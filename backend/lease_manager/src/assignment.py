@@ -0,0 +1,139 @@
+import hashlib
+from collections import defaultdict
+
+
+def rendezvous_weight(shard: str, consumer: str) -> int:
+    """How much `consumer` wants `shard`; the same on every run and host."""
+    digest = hashlib.blake2b(f"{shard}|{consumer}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def assign_shards(
+    shards: list[str], consumers: list[str], current: dict[str, str]
+) -> dict[str, str]:
+    """
+    Balanced shard -> consumer assignment that moves as few shards as it can.
+
+    Every consumer ends up with `len(shards) // len(consumers)` shards or one
+    more. A shard stays with its current owner while that owner is alive and
+    within its quota, and the extra shards go to the consumers already
+    holding the most, so only these shards move: those of a departed
+    consumer, and the surplus of an overloaded one when a consumer joins.
+    Shards that do move go to the consumer with room that ranks them highest
+    by rendezvous hash, which spreads them evenly and makes the result
+    independent of the order `consumers` comes in.
+    """
+    if not consumers:
+        return {}
+    consumers = sorted(set(consumers))
+    alive = set(consumers)
+
+    held = defaultdict(list)
+    for shard in shards:
+        owner = current.get(shard)
+        if owner in alive:
+            held[owner].append(shard)
+
+    base, extra = divmod(len(shards), len(consumers))
+    # The one-over quotas go to the biggest holders: fewer shards to take away
+    by_load = sorted(consumers, key=lambda consumer: -len(held[consumer]))
+    quota = {
+        consumer: base + (1 if rank < extra else 0)
+        for rank, consumer in enumerate(by_load)
+    }
+
+    assignment = {}
+    unassigned = []
+    for consumer in consumers:
+        # An overloaded consumer keeps the shards it ranks highest
+        kept = sorted(
+            held[consumer],
+            key=lambda shard: rendezvous_weight(shard, consumer),
+            reverse=True,
+        )
+        for shard in kept[: quota[consumer]]:
+            assignment[shard] = consumer
+        unassigned.extend(kept[quota[consumer] :])
+    unassigned.extend(shard for shard in shards if current.get(shard) not in alive)
+
+    room = {
+        consumer: quota[consumer] - len(held[consumer][: quota[consumer]])
+        for consumer in consumers
+    }
+    for shard in sorted(unassigned):
+        consumer = max(
+            (consumer for consumer in consumers if room[consumer] > 0),
+            key=lambda consumer: rendezvous_weight(shard, consumer),
+        )
+        assignment[shard] = consumer
+        room[consumer] -= 1
+
+    return assignment
+
+
+def assign_shards_by_load(
+    shards: list[str],
+    consumers: list[str],
+    current: dict[str, str],
+    weights: dict[str, float],
+    tolerance: float = 0.2,
+    max_moves: int = 1,
+    pinned: frozenset[str] = frozenset(),
+) -> dict[str, str]:
+    """
+    Sticky assignment that balances summed shard weight instead of count.
+
+    Shards of live owners stay put, and those of departed consumers go,
+    heaviest first, to whichever consumer carries the least. Then, while the
+    busiest consumer is more than `tolerance` above the mean, one shard moves
+    from the busiest to the idlest consumer: the one that brings the two
+    closest together. That happens at most `max_moves` times per call, never
+    to a `pinned` shard, and only when it lowers the busiest consumer's load,
+    so leases converge over several rounds instead of flapping.
+    """
+    if not consumers:
+        return {}
+    consumers = sorted(set(consumers))
+    alive = set(consumers)
+
+    assignment = {
+        shard: current[shard] for shard in shards if current.get(shard) in alive
+    }
+    load = {consumer: 0.0 for consumer in consumers}
+    for shard, consumer in assignment.items():
+        load[consumer] += weights.get(shard, 0.0)
+
+    orphans = [shard for shard in shards if shard not in assignment]
+    for shard in sorted(orphans, key=lambda shard: (-weights.get(shard, 0.0), shard)):
+        consumer = min(
+            consumers,
+            key=lambda consumer: (
+                load[consumer],
+                -rendezvous_weight(shard, consumer),
+            ),
+        )
+        assignment[shard] = consumer
+        load[consumer] += weights.get(shard, 0.0)
+
+    mean = sum(load.values()) / len(consumers)
+    for _ in range(max_moves):
+        busiest = max(consumers, key=lambda consumer: (load[consumer], consumer))
+        idlest = min(consumers, key=lambda consumer: (load[consumer], consumer))
+        gap = load[busiest] - load[idlest]
+        if load[busiest] <= mean * (1 + tolerance) or gap <= 0:
+            break
+        movable = [
+            shard
+            for shard, consumer in assignment.items()
+            if consumer == busiest
+            and shard not in pinned
+            and 0 < weights.get(shard, 0.0) < gap
+        ]
+        if not movable:
+            break
+        shard = min(movable, key=lambda shard: (abs(gap - 2 * weights[shard]), shard))
+        assignment[shard] = idlest
+        load[busiest] -= weights[shard]
+        load[idlest] += weights[shard]
+
+    return assignment
@@ -1,13 +1,47 @@
 import os
 from dataclasses import dataclass, fields
 
+from libs.shardmap import SHARD_HASHES
+
 
 @dataclass
 class Config:
     redis_host: str = os.getenv("REDIS_HOST")
     redis_port: int = int(os.getenv("REDIS_PORT"))
     redis_db: int = int(os.getenv("REDIS_DB"))
+    # Changing it reshards the streams online (see libs.shardmap)
     num_streams: int = int(os.getenv("NUM_STREAMS"))
+    # How receivers are hashed onto shards: "crc32", or "sha256" to keep the
+    # shards of streams written before it was configurable
+    shard_hash: str = os.getenv("SHARD_HASH", "crc32")
+    # Seconds between drain checks while resharding
+    reshard_check_interval: float = float(os.getenv("RESHARD_CHECK_INTERVAL", "0.5"))
+    # While resharding, an old stream's pending entry delivered this many
+    # times is dead-lettered so one gateway that keeps failing cannot hold
+    # back the new streams. The consumers' own MAX_DELIVERIES by default:
+    # fewer would give up on entries the consumers are still retrying
+    reshard_stuck_deliveries: int = int(
+        os.getenv("RESHARD_STUCK_DELIVERIES", os.getenv("MAX_DELIVERIES", "10"))
+    )
+    # Entries each shard's dead-letter stream keeps, approximately
+    dead_letter_max_len: int = int(os.getenv("DEAD_LETTER_MAX_LEN", "100000"))
+    # Approximate cap on a stream's length, applied by producers; 0 for none.
+    # A backstop: the trimmer keeps streams to what is still unacked.
+    stream_max_len: int = int(os.getenv("STREAM_MAX_LEN", "1000000"))
+    # Seconds between trims of the streams
+    stream_trim_interval: float = float(os.getenv("STREAM_TRIM_INTERVAL", "30"))
+    # Seconds entries are kept after being acked
+    stream_min_retention: float = float(os.getenv("STREAM_MIN_RETENTION", "0"))
+    # "load" balances shards by arrival rate and backlog, "count" by number
+    lease_balance: str = os.getenv("LEASE_BALANCE", "load")
+    # How far above the mean load a consumer may be before a shard moves
+    lease_load_tolerance: float = float(os.getenv("LEASE_LOAD_TOLERANCE", "0.2"))
+    # Shards moved per round to even out load
+    lease_max_moves: int = int(os.getenv("LEASE_MAX_MOVES", "2"))
+    # Seconds a moved shard stays put before load may move it again
+    lease_min_dwell: float = float(os.getenv("LEASE_MIN_DWELL", "60"))
+    # Seconds a shard's backlog should take to work off; sets its weight
+    lease_drain_horizon: float = float(os.getenv("LEASE_DRAIN_HORIZON", "30"))
 
     def __post_init__(self):
         missing_vars = []
@@ -17,6 +51,8 @@ class Config:
                 missing_vars.append(f.name.upper())
         if missing_vars:
             raise ValueError(f"Environment variables {missing_vars} are not set")
+        if self.shard_hash not in SHARD_HASHES:
+            raise ValueError(f"SHARD_HASH must be one of {SHARD_HASHES}")
 
 
 config = Config()
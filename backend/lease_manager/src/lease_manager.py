@@ -1,22 +1,42 @@
 import asyncio
+import dataclasses
 import time
 from typing import List
 
 import structlog
+from libs import lease_scripts
 from libs.rediskeys import RediKeys
+from libs.shardmap import INITIAL_VERSION, ShardMap
 from redis.asyncio import Redis
 from redis.exceptions import ResponseError
+from src.assignment import assign_shards, assign_shards_by_load
 from src.config import config
+from src.shard_stats import ShardLoadTracker
+from src.stream_trimmer import StreamTrimmer
 
 logger = structlog.get_logger(__name__)
 
+# Entries touched more recently than this are in a consumer's hands
+STUCK_CLAIM_MIN_IDLE_MS = 1000
+
 
 class LeaseManager:
     def __init__(self):
         self.redis: Redis | None = None
         self.num_streams = config.num_streams
+        self.shard_hash = config.shard_hash
+        self.stream_max_len = config.stream_max_len
+        self.shard_map: ShardMap | None = None
         self.running = True
         self.suspect_consumers = {}
+        self.shard_loads = ShardLoadTracker(drain_horizon=config.lease_drain_horizon)
+        # Shard -> when its lease last changed, to keep it from flapping
+        self.moved_at: dict[str, float] = {}
+        self.trimmer = StreamTrimmer(
+            min_retention=config.stream_min_retention,
+            stats_ttl=int(config.stream_trim_interval * 3),
+        )
+        self.trim_task: asyncio.Task | None = None
 
     async def connect(self, host: str, port: int, db: int):
         retries = 5
@@ -24,6 +44,9 @@ class LeaseManager:
             try:
                 self.redis = Redis(host=host, port=port, db=db)
                 await self.redis.ping()
+                self._release_lease = self.redis.register_script(
+                    lease_scripts.RELEASE_LEASE
+                )
                 logger.info("Connected to Redis")
                 break
             except Exception as e:
@@ -35,12 +58,11 @@ class LeaseManager:
     async def disconnect(self):
         await self.redis.aclose()
 
-    async def ensure_consumer_groups(self):
+    async def ensure_consumer_groups(self, streams: List[str]):
         """
         Ensure that the consumer groups exist for the given streams.
         """
-        for stream_id in range(self.num_streams):
-            stream_name = RediKeys.stream_shard(stream_id)
+        for stream_name in streams:
             try:
                 await self.redis.xgroup_create(
                     name=stream_name,
@@ -55,11 +77,185 @@ class LeaseManager:
                 if "BUSYGROUP" not in str(e):
                     raise
 
+    async def update_shard_map(self) -> ShardMap:
+        """
+        Keep the shard map in step with NUM_STREAMS and SHARD_HASH (see
+        libs.shardmap).
+
+        A changed NUM_STREAMS or SHARD_HASH starts a resharding onto a new
+        version of the streams; it finishes once the old version is drained.
+        Entries the old streams cannot get delivered are dead-lettered
+        meanwhile, see dead_letter_stuck.
+        """
+        shard_map = self.shard_map or await ShardMap.load(self.redis)
+        if shard_map is None:
+            # What producers have been writing without a map; SHARD_HASH, if
+            # it differs, is applied by resharding on the next round
+            shard_map = ShardMap(
+                version=INITIAL_VERSION,
+                num_shards=self.num_streams,
+                stream_max_len=self.stream_max_len,
+            )
+            await self.ensure_consumer_groups(shard_map.streams())
+            await self.write_shard_map(shard_map)
+
+        elif shard_map.migrating:
+            draining = shard_map.draining_streams()
+            if await self.drained(draining):
+                shard_map = ShardMap(
+                    shard_map.version,
+                    shard_map.num_shards,
+                    shard_hash=shard_map.shard_hash,
+                    stream_max_len=shard_map.stream_max_len,
+                )
+                await self.write_shard_map(shard_map)
+                logger.info(
+                    "Resharding finished",
+                    version=shard_map.version,
+                    num_shards=shard_map.num_shards,
+                )
+            else:
+                await self.dead_letter_stuck(draining)
+
+        elif (
+            shard_map.num_shards != self.num_streams
+            or shard_map.shard_hash != self.shard_hash
+        ):
+            shard_map = ShardMap(
+                version=shard_map.version + 1,
+                num_shards=self.num_streams,
+                draining_version=shard_map.version,
+                draining_num_shards=shard_map.num_shards,
+                shard_hash=self.shard_hash,
+                stream_max_len=shard_map.stream_max_len,
+            )
+            # Producers write to these from the moment the map says so
+            await self.ensure_consumer_groups(shard_map.streams())
+            await self.write_shard_map(shard_map)
+            logger.info(
+                "Resharding started",
+                version=shard_map.version,
+                num_shards=shard_map.num_shards,
+                draining_num_shards=shard_map.draining_num_shards,
+                shard_hash=shard_map.shard_hash,
+            )
+
+        if shard_map.stream_max_len != self.stream_max_len:
+            # Producers read it from the map on every write; no new version
+            shard_map = dataclasses.replace(
+                shard_map, stream_max_len=self.stream_max_len
+            )
+            await self.write_shard_map(shard_map)
+            logger.info("Stream length cap changed", stream_max_len=self.stream_max_len)
+
+        self.shard_map = shard_map
+        return shard_map
+
+    async def write_shard_map(self, shard_map: ShardMap):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(RediKeys.shard_map())
+        pipe.hset(RediKeys.shard_map(), mapping=shard_map.to_redis())
+        await pipe.execute()
+
+    async def drained(self, streams: List[str]) -> bool:
+        """Whether every entry of these streams was delivered and acked."""
+        pipe = self.redis.pipeline(transaction=False)
+        for stream_name in streams:
+            pipe.xinfo_stream(stream_name)
+            pipe.xinfo_groups(stream_name)
+        results = await pipe.execute(raise_on_error=False)
+        for i, stream_name in enumerate(streams):
+            info, groups = results[2 * i], results[2 * i + 1]
+            if isinstance(info, ResponseError):
+                continue  # no such stream, nothing to drain
+            if isinstance(info, Exception):
+                raise info
+            group = next(
+                (g for g in groups if g["name"] in (b"grpc_group", "grpc_group")),
+                None,
+            )
+            if (
+                group is None
+                or group["pending"]
+                or group["last-delivered-id"] != info["last-generated-id"]
+            ):
+                return False
+        return True
+
+    async def dead_letter_stuck(self, streams: List[str]):
+        """
+        Move the pending entries of draining streams that keep failing to
+        their dead-letter streams.
+
+        The new streams are not read until the old ones are drained. An entry
+        delivered `reshard_stuck_deliveries` times (the consumers' own
+        MAX_DELIVERIES) is one its consumer is about to dead-letter itself;
+        this only makes sure it does not hold the resharding up if that
+        consumer is gone. An entry merely idle is left alone: it may be
+        waiting out its retry backoff. It is claimed first, so an entry a
+        consumer is retrying this very moment is left for the next round.
+        """
+        for stream_name in streams:
+            stuck = {}
+            start = "-"
+            while True:
+                pending = await self.redis.xpending_range(
+                    stream_name, "grpc_group", min=start, max="+", count=100
+                )
+                for entry in pending:
+                    if entry["times_delivered"] >= config.reshard_stuck_deliveries:
+                        stuck[entry["message_id"]] = entry
+                if len(pending) < 100:
+                    break
+                start = b"(" + pending[-1]["message_id"]
+            if not stuck:
+                continue
+
+            claimed = await self.redis.xclaim(
+                stream_name,
+                "grpc_group",
+                "lease_manager",
+                STUCK_CLAIM_MIN_IDLE_MS,
+                list(stuck),
+            )
+            if not claimed:
+                continue
+            pipe = self.redis.pipeline(transaction=True)
+            for message_id, fields in claimed:
+                entry = stuck[message_id]
+                pipe.xadd(
+                    RediKeys.dead_letter_stream(stream_name),
+                    {
+                        # None once trimmed; the id is all there is left
+                        **(fields or {}),
+                        "dlq_message_id": message_id,
+                        "dlq_deliveries": entry["times_delivered"],
+                        "dlq_reason": "resharding",
+                    },
+                    maxlen=config.dead_letter_max_len,
+                    approximate=True,
+                )
+            pipe.xack(stream_name, "grpc_group", *(m for m, _ in claimed))
+            await pipe.execute()
+            logger.error(
+                "Dead-lettered entries holding up resharding",
+                stream_name=stream_name,
+                count=len(claimed),
+            )
+
     async def get_active_consumers(self) -> List[str]:
-        consumers = await self.redis.smembers(RediKeys.event_consumers())
+        consumers = [
+            cid.decode("utf-8")
+            for cid in await self.redis.smembers(RediKeys.event_consumers())
+        ]
+        # Every heartbeat in one round trip
+        pipe = self.redis.pipeline(transaction=False)
+        for cid in consumers:
+            pipe.ttl(RediKeys.heartbeat(cid))
+        ttls = await pipe.execute()
+
         active = []
-        for cid in [cid.decode("utf-8") for cid in consumers]:
-            ttl = await self.redis.ttl(RediKeys.heartbeat(cid))
+        for cid, ttl in zip(consumers, ttls):
             if ttl > 0:
                 logger.debug("Consumer heartbeat TTL", consumer_id=cid, ttl=ttl)
                 active.append(cid)
@@ -83,40 +279,141 @@ class LeaseManager:
         logger.info("Active consumers", active_consumers=active)
         return active
 
+    async def release_expired_holders(self, active_consumers: List[str]):
+        """
+        Free the shards of holders whose heartbeat expired, so their new
+        owners can take them. A live holder releases its own after draining.
+        """
+        holders = await self.redis.hgetall(RediKeys.lease_holders())
+        for stream_key, holder in holders.items():
+            holder = holder.decode("utf-8")
+            if holder in active_consumers:
+                continue
+            # Compare-and-delete: the shard may have changed hands meanwhile
+            if await self._release_lease(
+                keys=[RediKeys.lease_holders(), RediKeys.lease_changes()],
+                args=[stream_key, holder],
+            ):
+                logger.warning(
+                    "Released lease of expired consumer",
+                    stream_key=stream_key.decode("utf-8"),
+                    consumer_id=holder,
+                )
+
     async def assign_leases(self):
         consumers = await self.get_active_consumers()
+        await self.release_expired_holders(consumers)
         if not consumers:
             logger.info("No active consumers")
             return
 
-        leases_per_consumer = self.num_streams // len(consumers)
-        remainder = self.num_streams % len(consumers)
+        current = {
+            stream_key.decode("utf-8"): consumer.decode("utf-8")
+            for stream_key, consumer in (
+                await self.redis.hgetall(RediKeys.leases())
+            ).items()
+        }
+        shard_map = await self.update_shard_map()
+        # While resharding, only the old streams are read. The new ones are
+        # leased once those are drained, so no receiver's events overtake
+        # older ones; entries that keep failing are dead-lettered so the
+        # wait stays short (update_shard_map).
+        shards = shard_map.draining_streams() or shard_map.streams()
+        assignments = await self.balance(shards, consumers, current)
 
-        assignments = {}
-        stream_id = 0
+        # Only what changed is written, and only then is the version bumped
+        changed = {
+            stream_key: consumer
+            for stream_key, consumer in assignments.items()
+            if current.get(stream_key) != consumer
+        }
+        removed = [
+            stream_key for stream_key in current if stream_key not in assignments
+        ]
+        if not changed and not removed:
+            return
+
+        now = time.monotonic()
+        for stream_key in changed:
+            self.moved_at[stream_key] = now
+
+        pipe = self.redis.pipeline(transaction=True)
+        if changed:
+            pipe.hset(RediKeys.leases(), mapping=changed)
+        if removed:
+            pipe.hdel(RediKeys.leases(), *removed)
+        pipe.incr(RediKeys.leases_version())
+        # Consumers re-read the leases on this instead of polling them
+        pipe.publish(RediKeys.lease_changes(), "leases")
+        await pipe.execute()
+        logger.info(
+            "Assigned leases to consumers",
+            num_consumers=len(consumers),
+            moved=len(changed),
+            removed=len(removed),
+        )
 
-        for consumer in consumers:
-            count = leases_per_consumer + (1 if remainder > 0 else 0)
-            if remainder > 0:
-                remainder -= 1
+    async def balance(
+        self, shards: List[str], consumers: List[str], current: dict[str, str]
+    ) -> dict[str, str]:
+        if config.lease_balance == "count":
+            return assign_shards(shards, consumers, current)
 
-            for _ in range(count):
-                stream_key = RediKeys.stream_shard(stream_id)
-                assignments[stream_key] = consumer
-                stream_id += 1
+        await self.shard_loads.sample(self.redis, shards)
+        weights = self.shard_loads.weights(shards)
+        now = time.monotonic()
+        pinned = frozenset(
+            stream_key
+            for stream_key, moved_at in self.moved_at.items()
+            if now - moved_at < config.lease_min_dwell
+        )
+        assignments = assign_shards_by_load(
+            shards,
+            consumers,
+            current,
+            weights,
+            tolerance=config.lease_load_tolerance,
+            max_moves=config.lease_max_moves,
+            pinned=pinned,
+        )
 
-        await self.redis.hset(RediKeys.leases(), mapping=assignments)
-        logger.info("Assigned leases to consumers", num_consumers=len(consumers))
+        load = {consumer: 0.0 for consumer in consumers}
+        for stream_key, consumer in assignments.items():
+            load[consumer] += weights[stream_key]
+        logger.debug(
+            "Consumer load",
+            load=load,
+            ack_rates=self.shard_loads.consumer_rates(assignments),
+        )
+        return assignments
+
+    async def trim_loop(self):
+        while self.running:
+            await asyncio.sleep(config.stream_trim_interval)
+            try:
+                shard_map = self.shard_map
+                await self.trimmer.trim(
+                    self.redis, shard_map.streams() + shard_map.draining_streams()
+                )
+            except Exception as e:
+                logger.error("Error trimming streams", error=e)
 
     async def run(self):
         logger.info("Running...")
-        await self.ensure_consumer_groups()
+        shard_map = await self.update_shard_map()
+        await self.ensure_consumer_groups(
+            shard_map.streams() + shard_map.draining_streams()
+        )
+        self.trim_task = asyncio.create_task(self.trim_loop())
         next_lease = time.monotonic()
         while self.running:
             try:
                 await self.assign_leases()
-                # Avoid drift
-                next_lease += 5
+                # Avoid drift. A resharding holds back the new streams until
+                # the old ones are drained, so check on those more often.
+                next_lease += (
+                    config.reshard_check_interval if self.shard_map.migrating else 5
+                )
                 sleep_duration = max(0, next_lease - time.monotonic())
                 await asyncio.sleep(sleep_duration)
             except Exception as e:
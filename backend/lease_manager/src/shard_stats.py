@@ -0,0 +1,122 @@
+import time
+from dataclasses import dataclass
+
+from redis.asyncio import Redis
+
+
+@dataclass
+class ShardLoad:
+    # Entries/s appended to the stream, smoothed
+    arrival_rate: float = 0.0
+    # Entries/s the consumer group acked, smoothed
+    ack_rate: float = 0.0
+    # Entries not yet acked: undelivered (lag) plus pending
+    backlog: int = 0
+    # Raw counters from the previous sample, for the rates
+    entries_added: int | None = None
+    entries_acked: int | None = None
+    sampled_at: float | None = None
+
+
+class ShardLoadTracker:
+    """
+    Per-shard load, sampled from `XINFO STREAM` / `XINFO GROUPS` once per
+    assignment round.
+
+    A shard weighs its arrival rate plus the backlog it has to work off within
+    `drain_horizon` seconds, so a shard that falls behind on a slow consumer
+    gets heavier and is moved to a less busy one. Rates are smoothed over
+    rounds; one burst does not move a lease.
+    """
+
+    RATE_ALPHA = 0.3
+    # An idle shard still counts, so idle shards are spread by count
+    IDLE_WEIGHT = 1.0
+
+    def __init__(self, consumer_group: str = "grpc_group", drain_horizon=30.0):
+        self.consumer_group = consumer_group
+        self.drain_horizon = drain_horizon
+        self.loads: dict[str, ShardLoad] = {}
+
+    async def sample(self, redis: Redis, shards: list[str]):
+        """Refresh every shard's load in one round trip."""
+        pipe = redis.pipeline(transaction=False)
+        for shard in shards:
+            pipe.xinfo_stream(shard)
+            pipe.xinfo_groups(shard)
+        # A stream not created yet answers with an error; it just has no load
+        results = await pipe.execute(raise_on_error=False)
+        now = time.monotonic()
+        for i, shard in enumerate(shards):
+            info, groups = results[2 * i], results[2 * i + 1]
+            if isinstance(info, Exception) or isinstance(groups, Exception):
+                continue
+            self.update(shard, info, groups, now)
+        for shard in set(self.loads) - set(shards):
+            del self.loads[shard]
+
+    def update(self, shard: str, info: dict, groups: list[dict], now: float):
+        load = self.loads.setdefault(shard, ShardLoad())
+        group = next(
+            (g for g in groups if _decode(g["name"]) == self.consumer_group), None
+        )
+        if group is None:
+            return
+
+        pending = group.get("pending") or 0
+        # `lag` is unknown (None) while the group cannot compute it; fall
+        # back to the stream length as an upper bound
+        lag = group.get("lag")
+        if lag is None:
+            lag = max(info.get("length", 0) - pending, 0)
+        load.backlog = lag + pending
+
+        entries_added = info.get("entries-added")
+        # Everything ever added is either acked or still in the backlog
+        entries_acked = (
+            entries_added - load.backlog if entries_added is not None else None
+        )
+
+        if load.sampled_at is not None and now > load.sampled_at:
+            elapsed = now - load.sampled_at
+            load.arrival_rate = self._smooth(
+                load.arrival_rate, load.entries_added, entries_added, elapsed
+            )
+            load.ack_rate = self._smooth(
+                load.ack_rate, load.entries_acked, entries_acked, elapsed
+            )
+        load.entries_added = entries_added
+        load.entries_acked = entries_acked
+        load.sampled_at = now
+
+    def _smooth(self, rate: float, before, after, elapsed: float) -> float:
+        if before is None or after is None:
+            return rate
+        # Counters only go down when the stream was recreated
+        sample = max(after - before, 0) / elapsed
+        return rate + self.RATE_ALPHA * (sample - rate)
+
+    def weight(self, shard: str) -> float:
+        load = self.loads.get(shard)
+        if load is None:
+            return self.IDLE_WEIGHT
+        return max(
+            load.arrival_rate + load.backlog / self.drain_horizon, self.IDLE_WEIGHT
+        )
+
+    def weights(self, shards: list[str]) -> dict[str, float]:
+        return {shard: self.weight(shard) for shard in shards}
+
+    def consumer_rates(self, assignment: dict[str, str]) -> dict[str, float]:
+        """Entries/s each consumer acks across the shards it holds."""
+        rates: dict[str, float] = {}
+        for shard, consumer in assignment.items():
+            load = self.loads.get(shard)
+            rates[consumer] = rates.get(consumer, 0.0) + (
+                load.ack_rate if load else 0.0
+            )
+        return rates
+
+
+def _decode(value) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
@@ -0,0 +1,141 @@
+import time
+
+import structlog
+from libs.rediskeys import RediKeys
+from redis.asyncio import Redis
+
+logger = structlog.get_logger(__name__)
+
+
+def parse_stream_id(stream_id: bytes | str) -> tuple[int, int]:
+    if isinstance(stream_id, bytes):
+        stream_id = stream_id.decode("utf-8")
+    ms, _, seq = stream_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def trim_point(
+    last_delivered_id: bytes | str,
+    oldest_pending_id: bytes | str | None,
+    retain_after_ms: int | None = None,
+) -> tuple[int, int]:
+    """
+    The lowest id a stream must keep: its oldest unacked entry, or, with
+    none pending, the last one delivered. Anything newer than
+    `retain_after_ms` is kept as well.
+    """
+    keep = parse_stream_id(last_delivered_id)
+    if oldest_pending_id is not None:
+        keep = min(keep, parse_stream_id(oldest_pending_id))
+    if retain_after_ms is not None:
+        keep = min(keep, (retain_after_ms, 0))
+    return keep
+
+
+class StreamTrimmer:
+    """
+    Trims the shard streams to what the consumer group still needs.
+
+    Entries are deleted up to the oldest one still pending, or up to the last
+    one delivered if none is, so nothing that has yet to reach a gateway is
+    lost. Entries younger than `min_retention` seconds are kept regardless.
+    Trimming is approximate (whole radix tree nodes), like the MAXLEN cap
+    producers apply: cheap for Redis, and a few entries more are kept.
+
+    Each round also records every stream's length and memory footprint in
+    `RediKeys.stream_stats()`, for sizing Redis.
+    """
+
+    def __init__(
+        self,
+        consumer_group: str = "grpc_group",
+        min_retention: float = 0,
+        stats_ttl: int = 300,
+    ):
+        self.consumer_group = consumer_group
+        self.min_retention = min_retention
+        self.stats_ttl = stats_ttl
+
+    async def trim(self, redis: Redis, streams: list[str]) -> dict[str, dict]:
+        """Trim every stream and return their length, memory and entries trimmed."""
+        pipe = redis.pipeline(transaction=False)
+        for stream_name in streams:
+            pipe.xinfo_groups(stream_name)
+            pipe.xpending(stream_name, self.consumer_group)
+        results = await pipe.execute(raise_on_error=False)
+
+        retain_after_ms = (
+            int((time.time() - self.min_retention) * 1000)
+            if self.min_retention > 0
+            else None
+        )
+        pipe = redis.pipeline(transaction=False)
+        trimmed = []
+        for i, stream_name in enumerate(streams):
+            groups, pending = results[2 * i], results[2 * i + 1]
+            if isinstance(groups, Exception) or isinstance(pending, Exception):
+                continue  # not created yet, or no group to trim for
+            group = next(
+                (
+                    g
+                    for g in groups
+                    if g["name"] in (self.consumer_group, self.consumer_group.encode())
+                ),
+                None,
+            )
+            if group is None:
+                continue
+            ms, seq = trim_point(
+                group["last-delivered-id"],
+                pending["min"] if pending["pending"] else None,
+                retain_after_ms,
+            )
+            pipe.xtrim(stream_name, minid=f"{ms}-{seq}", approximate=True)
+            trimmed.append(stream_name)
+        for stream_name in streams:
+            pipe.xlen(stream_name)
+            pipe.memory_usage(stream_name)
+        results = await pipe.execute(raise_on_error=False)
+
+        removed = {}
+        for stream_name, result in zip(trimmed, results[: len(trimmed)]):
+            if isinstance(result, Exception):
+                # Deleted or recreated since it was read; retried next round
+                logger.warning(
+                    "Trimming stream failed", stream_name=stream_name, error=str(result)
+                )
+                result = 0
+            removed[stream_name] = result
+        sizes = results[len(trimmed) :]
+        stats = {}
+        for i, stream_name in enumerate(streams):
+            length, memory = sizes[2 * i], sizes[2 * i + 1]
+            if isinstance(length, Exception):
+                continue
+            stats[stream_name] = {
+                "length": length,
+                "trimmed": removed.get(stream_name, 0),
+            }
+            # MEMORY USAGE may be disabled (renamed) on managed Redis
+            if not isinstance(memory, Exception):
+                stats[stream_name]["memory_bytes"] = memory or 0
+        await self.publish_stats(redis, stats)
+
+        logger.info(
+            "Trimmed streams",
+            trimmed=sum(s["trimmed"] for s in stats.values()),
+            length=sum(s["length"] for s in stats.values()),
+            memory_bytes=sum(s.get("memory_bytes", 0) for s in stats.values()),
+        )
+        return stats
+
+    async def publish_stats(self, redis: Redis, stats: dict[str, dict]):
+        if not stats:
+            return
+        pipe = redis.pipeline(transaction=False)
+        for stream_name, stream_stats in stats.items():
+            key = RediKeys.stream_stats(stream_name)
+            pipe.hset(key, mapping=stream_stats)
+            # Gone once the stream is no longer in the shard map
+            pipe.expire(key, self.stats_ttl)
+        await pipe.execute()
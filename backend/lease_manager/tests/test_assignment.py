@@ -0,0 +1,166 @@
+"""Lease assignment.
+
+Stdlib `unittest`, like event_consumer's tests:
+
+    docker compose run --rm --no-deps lease_manager python -m unittest discover -s tests
+
+Every shard that changes hands tears down a StreamWorker and starts its
+replacement with a cold endpoint cache, so the assignment has to stay balanced
+while moving as little as possible.
+"""
+
+import sys
+import unittest
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.assignment import assign_shards, assign_shards_by_load  # noqa: E402
+from src.shard_stats import ShardLoadTracker  # noqa: E402
+
+SHARDS = [f"stream_shard:{i}" for i in range(16)]
+
+
+def moved(before, after):
+    return sum(1 for shard in SHARDS if before.get(shard) != after.get(shard))
+
+
+class AssignShardsTest(unittest.TestCase):
+    def assertBalanced(self, assignment, consumers):
+        self.assertEqual(sorted(assignment), sorted(SHARDS))
+        counts = Counter(assignment.values())
+        self.assertEqual(set(counts), set(consumers))
+        self.assertLessEqual(max(counts.values()) - min(counts.values()), 1)
+
+    def test_balanced_from_scratch(self):
+        assignment = assign_shards(SHARDS, ["c1", "c2", "c3"], {})
+        self.assertBalanced(assignment, ["c1", "c2", "c3"])
+
+    def test_does_not_depend_on_consumer_order(self):
+        # `smembers` order changes from call to call
+        self.assertEqual(
+            assign_shards(SHARDS, ["c1", "c2", "c3"], {}),
+            assign_shards(SHARDS, ["c3", "c1", "c2"], {}),
+        )
+
+    def test_a_stable_membership_moves_nothing(self):
+        before = assign_shards(SHARDS, ["c1", "c2", "c3"], {})
+        self.assertEqual(assign_shards(SHARDS, ["c2", "c3", "c1"], before), before)
+
+    def test_a_joining_consumer_takes_only_its_share(self):
+        before = assign_shards(SHARDS, ["c1", "c2"], {})
+        after = assign_shards(SHARDS, ["c1", "c2", "c3", "c4"], before)
+
+        self.assertBalanced(after, ["c1", "c2", "c3", "c4"])
+        self.assertEqual(moved(before, after), 8, "exactly the shards c3 and c4 get")
+
+    def test_a_leaving_consumer_moves_only_its_own_shards(self):
+        before = assign_shards(SHARDS, ["c1", "c2", "c3"], {})
+        after = assign_shards(SHARDS, ["c1", "c2"], before)
+
+        self.assertBalanced(after, ["c1", "c2"])
+        lost = [shard for shard, owner in before.items() if owner == "c3"]
+        self.assertEqual(moved(before, after), len(lost))
+
+    def test_no_consumers_no_leases(self):
+        self.assertEqual(assign_shards(SHARDS, [], {"stream_shard:0": "c1"}), {})
+
+
+def loads(assignment, weights):
+    totals = Counter()
+    for shard, consumer in assignment.items():
+        totals[consumer] += weights[shard]
+    return totals
+
+
+class AssignShardsByLoadTest(unittest.TestCase):
+    def setUp(self):
+        # One hot shard, as when a huge guild's channel hashes to it
+        self.weights = {shard: 1.0 for shard in SHARDS}
+        self.weights["stream_shard:0"] = 12.0
+
+    def test_places_orphans_by_weight(self):
+        assignment = assign_shards_by_load(SHARDS, ["c1", "c2"], {}, self.weights)
+
+        self.assertEqual(sorted(assignment), sorted(SHARDS))
+        hot = assignment["stream_shard:0"]
+        counts = Counter(assignment.values())
+        self.assertLess(counts[hot], counts[next(iter({"c1", "c2"} - {hot}))])
+        totals = loads(assignment, self.weights)
+        self.assertLessEqual(abs(totals["c1"] - totals["c2"]), 1.0)
+
+    def test_moves_at_most_max_moves_from_the_busiest(self):
+        before = assign_shards(SHARDS, ["c1", "c2"], {})
+        after = assign_shards_by_load(
+            SHARDS, ["c1", "c2"], before, self.weights, max_moves=1
+        )
+
+        self.assertEqual(moved(before, after), 1)
+        busiest = before["stream_shard:0"]
+        (shard,) = [s for s in SHARDS if before[s] != after[s]]
+        self.assertEqual(before[shard], busiest)
+
+    def test_converges_and_then_stays_put(self):
+        assignment = assign_shards(SHARDS, ["c1", "c2"], {})
+        for _ in range(len(SHARDS)):
+            assignment = assign_shards_by_load(
+                SHARDS, ["c1", "c2"], assignment, self.weights
+            )
+        totals = loads(assignment, self.weights)
+        self.assertLessEqual(max(totals.values()), 14 * 1.2)
+
+        again = assign_shards_by_load(SHARDS, ["c1", "c2"], assignment, self.weights)
+        self.assertEqual(again, assignment)
+
+    def test_within_tolerance_nothing_moves(self):
+        before = assign_shards(SHARDS, ["c1", "c2"], {})
+        uniform = {shard: 1.0 for shard in SHARDS}
+        self.assertEqual(
+            assign_shards_by_load(SHARDS, ["c1", "c2"], before, uniform), before
+        )
+
+    def test_pinned_shards_do_not_move(self):
+        before = assign_shards(SHARDS, ["c1", "c2"], {})
+        busiest = before["stream_shard:0"]
+        pinned = frozenset(s for s, owner in before.items() if owner == busiest)
+        after = assign_shards_by_load(
+            SHARDS, ["c1", "c2"], before, self.weights, pinned=pinned
+        )
+        self.assertEqual(after, before)
+
+    def test_a_leaving_consumers_shards_are_placed_anyway(self):
+        before = assign_shards(SHARDS, ["c1", "c2", "c3"], {})
+        pinned = frozenset(SHARDS)
+        after = assign_shards_by_load(
+            SHARDS, ["c1", "c2"], before, self.weights, pinned=pinned
+        )
+        self.assertEqual(sorted(after), sorted(SHARDS))
+        self.assertNotIn("c3", after.values())
+
+
+class ShardLoadTrackerTest(unittest.TestCase):
+    def sample(self, tracker, now, added, lag, pending):
+        info = {"length": lag + pending, "entries-added": added}
+        groups = [{"name": b"grpc_group", "lag": lag, "pending": pending}]
+        tracker.update("stream_shard:0", info, groups, now)
+
+    def test_weight_grows_with_arrival_rate_and_backlog(self):
+        tracker = ShardLoadTracker(drain_horizon=10)
+        self.assertEqual(tracker.weight("stream_shard:0"), tracker.IDLE_WEIGHT)
+
+        self.sample(tracker, 0, added=0, lag=0, pending=0)
+        self.sample(tracker, 10, added=1000, lag=400, pending=100)
+        load = tracker.loads["stream_shard:0"]
+
+        self.assertEqual(load.backlog, 500)
+        self.assertAlmostEqual(load.arrival_rate, 0.3 * 100)
+        self.assertAlmostEqual(load.ack_rate, 0.3 * 50)
+        self.assertAlmostEqual(tracker.weight("stream_shard:0"), 30 + 50)
+        self.assertEqual(
+            tracker.consumer_rates({"stream_shard:0": "c1"}), {"c1": 0.3 * 50}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
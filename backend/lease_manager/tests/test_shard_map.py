@@ -0,0 +1,209 @@
+"""Online resharding, as driven by LeaseManager.update_shard_map.
+
+Redis is replaced by recording what would have been written; see
+libs.shardmap for the protocol itself.
+"""
+
+import hashlib
+import sys
+import unittest
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from libs.rediskeys import RediKeys  # noqa: E402
+from libs.shardmap import CRC32, SHA256, ShardMap, compute_shard_id  # noqa: E402
+from src.config import config  # noqa: E402
+from src.lease_manager import LeaseManager  # noqa: E402
+
+
+class FakeLeaseManager(LeaseManager):
+    def __init__(self, shard_map, num_streams):
+        super().__init__()
+        self.shard_map = shard_map
+        self.num_streams = num_streams
+        self.shard_hash = SHA256
+        self.stream_max_len = 0
+        self.is_drained = False
+        self.written = []
+        self.groups = []
+        self.dead_lettered_from = []
+
+    async def ensure_consumer_groups(self, streams):
+        self.groups.extend(streams)
+
+    async def write_shard_map(self, shard_map):
+        self.written.append(shard_map)
+
+    async def drained(self, streams):
+        return self.is_drained
+
+    async def dead_letter_stuck(self, streams):
+        self.dead_lettered_from.append(streams)
+
+
+class UpdateShardMapTest(unittest.IsolatedAsyncioTestCase):
+    async def test_unchanged_num_streams_writes_nothing(self):
+        manager = FakeLeaseManager(ShardMap(1, 2), num_streams=2)
+        self.assertEqual(await manager.update_shard_map(), ShardMap(1, 2))
+        self.assertEqual(manager.written, [])
+
+    async def test_reshards_onto_new_streams_and_drains_the_old(self):
+        manager = FakeLeaseManager(ShardMap(1, 2), num_streams=4)
+
+        migrating = await manager.update_shard_map()
+        self.assertEqual(migrating, ShardMap(2, 4, 1, 2))
+        self.assertEqual(
+            migrating.draining_streams(), ["stream_shard:0", "stream_shard:1"]
+        )
+        # Readable before producers are told to write to them
+        self.assertEqual(manager.groups, migrating.streams())
+        self.assertEqual(manager.groups[0], "stream_shard:v2:0")
+
+        # Nothing changes until every old stream is drained, but what keeps
+        # failing there is given up on
+        self.assertEqual(await manager.update_shard_map(), migrating)
+        self.assertEqual(manager.dead_lettered_from, [migrating.draining_streams()])
+        manager.is_drained = True
+        self.assertEqual(await manager.update_shard_map(), ShardMap(2, 4))
+        self.assertEqual(manager.written, [migrating, ShardMap(2, 4)])
+        self.assertEqual(len(manager.dead_lettered_from), 1)
+
+    async def test_a_new_shard_hash_reshards_too(self):
+        manager = FakeLeaseManager(ShardMap(1, 2), num_streams=2)
+        manager.shard_hash = CRC32
+
+        migrating = await manager.update_shard_map()
+        self.assertEqual(migrating, ShardMap(2, 2, 1, 2, shard_hash=CRC32))
+        manager.is_drained = True
+        self.assertEqual(
+            await manager.update_shard_map(), ShardMap(2, 2, shard_hash=CRC32)
+        )
+
+    async def test_a_new_length_cap_keeps_the_version(self):
+        manager = FakeLeaseManager(ShardMap(1, 2), num_streams=2)
+        manager.stream_max_len = 1000
+        self.assertEqual(
+            await manager.update_shard_map(), ShardMap(1, 2, stream_max_len=1000)
+        )
+        self.assertEqual(manager.groups, [])
+
+    async def test_a_second_change_waits_for_the_first(self):
+        manager = FakeLeaseManager(ShardMap(2, 4, 1, 2), num_streams=8)
+        self.assertEqual(await manager.update_shard_map(), ShardMap(2, 4, 1, 2))
+
+    def test_round_trips_through_redis_fields(self):
+        for shard_map in (ShardMap(1, 2), ShardMap(3, 8, 2, 4, shard_hash=CRC32)):
+            fields = {
+                k.encode(): str(v).encode() for k, v in shard_map.to_redis().items()
+            }
+            self.assertEqual(ShardMap.from_redis(fields), shard_map)
+        self.assertIsNone(ShardMap.from_redis({}))
+        # Written before the map named its hash
+        self.assertEqual(
+            ShardMap.from_redis({b"version": b"1", b"num_shards": b"2"}).shard_hash,
+            SHA256,
+        )
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+
+    def xadd(self, name, fields, **kwargs):
+        self.redis.dead_letters.append((name, fields))
+
+    def xack(self, name, group, *message_ids):
+        for message_id in message_ids:
+            del self.redis.pending[message_id]
+
+    async def execute(self):
+        pass
+
+
+class FakeStreamRedis:
+    """A PEL of message id -> (times delivered, idle ms, fields)."""
+
+    def __init__(self, pending):
+        self.pending = pending
+        self.dead_letters = []
+
+    async def xpending_range(self, name, groupname, min, max, count):
+        message_ids = sorted(self.pending)
+        if min != "-":
+            message_ids = [m for m in message_ids if m > min.lstrip(b"(")]
+        return [
+            {
+                "message_id": message_id,
+                "times_delivered": self.pending[message_id][0],
+                "time_since_delivered": self.pending[message_id][1],
+            }
+            for message_id in message_ids[:count]
+        ]
+
+    async def xclaim(self, name, groupname, consumername, min_idle_time, message_ids):
+        return [
+            (message_id, self.pending[message_id][2])
+            for message_id in message_ids
+            if self.pending[message_id][1] >= min_idle_time
+        ]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class DeadLetterStuckTest(unittest.IsolatedAsyncioTestCase):
+    async def test_only_entries_that_keep_failing_are_moved(self):
+        manager = LeaseManager()
+        manager.redis = FakeStreamRedis(
+            {
+                b"1-0": (config.reshard_stuck_deliveries, 5000, {b"v": b"1"}),
+                b"2-0": (config.reshard_stuck_deliveries + 1, 5000, {b"v": b"2"}),
+                # Idle for long, but waiting out its retry backoff
+                b"5-0": (2, 600_000, {b"v": b"5"}),
+                # Out of attempts, but being retried right now
+                b"3-0": (config.reshard_stuck_deliveries, 0, {b"v": b"3"}),
+                b"4-0": (1, 5000, {b"v": b"4"}),
+            }
+        )
+
+        await manager.dead_letter_stuck(["stream_shard:0"])
+
+        self.assertEqual(
+            [fields[b"v"] for _, fields in manager.redis.dead_letters], [b"1", b"2"]
+        )
+        self.assertEqual(
+            manager.redis.dead_letters[0][0],
+            RediKeys.dead_letter_stream("stream_shard:0"),
+        )
+        self.assertEqual(sorted(manager.redis.pending), [b"3-0", b"4-0", b"5-0"])
+
+
+class ShardHashTest(unittest.TestCase):
+    def test_sha256_keeps_the_shards_producers_used_before(self):
+        receiver_id = str(uuid.uuid4())
+        digest = int(hashlib.sha256(receiver_id.encode()).hexdigest(), 16)
+        self.assertEqual(compute_shard_id(receiver_id, 16), str(digest % 16))
+
+    def test_crc32_spreads_receivers_evenly(self):
+        counts = [0] * 8
+        for _ in range(8000):
+            counts[int(compute_shard_id(str(uuid.uuid4()), 8, CRC32))] += 1
+        self.assertLess(max(counts) - min(counts), 250)
+
+    def test_stream_for_follows_the_map(self):
+        receiver_id = str(uuid.uuid4())
+        shard = compute_shard_id(receiver_id, 4, CRC32)
+        self.assertEqual(
+            ShardMap(2, 4, shard_hash=CRC32).stream_for(receiver_id),
+            f"stream_shard:v2:{shard}",
+        )
+        self.assertEqual(
+            ShardMap(1, 16).stream_for(receiver_id),
+            f"stream_shard:{compute_shard_id(receiver_id, 16)}",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Where the trimmer cuts a stream, and what a round records.
+
+Trimming past an entry that has not reached its gateway loses it for good,
+so the cut is never later than the consumer group's oldest unacked entry.
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+from redis.exceptions import ResponseError
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.stream_trimmer import (  # noqa: E402
+    StreamTrimmer,
+    parse_stream_id,
+    trim_point,
+)
+
+
+class TrimPointTest(unittest.TestCase):
+    def test_up_to_the_last_delivered_entry_when_all_are_acked(self):
+        self.assertEqual(trim_point(b"1700-3", None), (1700, 3))
+
+    def test_keeps_the_oldest_pending_entry(self):
+        self.assertEqual(trim_point(b"1700-3", b"1650-0"), (1650, 0))
+
+    def test_keeps_entries_within_the_retention(self):
+        self.assertEqual(trim_point(b"1700-3", None, retain_after_ms=1600), (1600, 0))
+        self.assertEqual(trim_point(b"1700-3", None, retain_after_ms=1800), (1700, 3))
+
+    def test_nothing_delivered_trims_nothing(self):
+        self.assertEqual(trim_point("0-0", None), (0, 0))
+
+    def test_ids_compare_as_numbers(self):
+        self.assertLess(parse_stream_id(b"999-9"), parse_stream_id(b"1000-0"))
+
+
+class FakePipeline:
+    """Answers each queued command from `FakeRedis.replies`, by name."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+
+        return queue
+
+    async def execute(self, raise_on_error=True):
+        self.redis.executed += self.calls
+        return [self.redis.replies.get(name) for name, _, _ in self.calls]
+
+
+class FakeRedis:
+    def __init__(self, replies):
+        self.replies = replies
+        self.executed = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class TrimTest(unittest.IsolatedAsyncioTestCase):
+    async def test_a_failed_trim_counts_as_nothing_trimmed(self):
+        redis = FakeRedis(
+            {
+                "xinfo_groups": [
+                    {"name": b"grpc_group", "last-delivered-id": b"1700-3"}
+                ],
+                "xpending": {"pending": 0},
+                "xtrim": ResponseError("ERR no such key"),
+                "xlen": 12,
+                "memory_usage": 4096,
+            }
+        )
+        stats = await StreamTrimmer().trim(redis, ["stream_shard:0"])
+
+        self.assertEqual(
+            stats,
+            {"stream_shard:0": {"length": 12, "trimmed": 0, "memory_bytes": 4096}},
+        )
+        published = [kwargs for name, _, kwargs in redis.executed if name == "hset"]
+        self.assertEqual(published, [{"mapping": stats["stream_shard:0"]}])
+
+
+if __name__ == "__main__":
+    unittest.main()
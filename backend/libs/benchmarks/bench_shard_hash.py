@@ -0,0 +1,49 @@
+"""Per-event cost of picking a receiver's stream.
+
+    PYTHONPATH=. python benchmarks/bench_shard_hash.py
+
+Compares what EventPublisher did per event before the shard map (SHA-256,
+then `RediKeys.stream_shard`) with CRC32, and with the cached
+`ShardMap.stream_for` it uses now. Receivers are drawn from a fixed pool,
+as in a real fan-out where the same channels and users recur. Each case
+reports its best of five runs, so the cached one measures a warm cache.
+"""
+
+import random
+import timeit
+import uuid
+
+from libs.rediskeys import RediKeys
+from libs.shardmap import CRC32, SHA256, ShardMap, compute_shard_id
+
+NUM_SHARDS = 16
+RECEIVERS = [str(uuid.uuid4()) for _ in range(10_000)]
+EVENTS = [random.choice(RECEIVERS) for _ in range(100_000)]
+
+
+def sha256_uncached():
+    for receiver_id in EVENTS:
+        RediKeys.stream_shard(compute_shard_id(receiver_id, NUM_SHARDS, SHA256))
+
+
+def crc32_uncached():
+    for receiver_id in EVENTS:
+        RediKeys.stream_shard(compute_shard_id(receiver_id, NUM_SHARDS, CRC32))
+
+
+SHARD_MAP = ShardMap(2, NUM_SHARDS, shard_hash=CRC32)
+
+
+def crc32_cached():
+    for receiver_id in EVENTS:
+        SHARD_MAP.stream_for(receiver_id)
+
+
+def main():
+    for bench in (sha256_uncached, crc32_uncached, crc32_cached):
+        seconds = min(timeit.repeat(bench, number=1, repeat=5))
+        print(f"{bench.__name__:<16} {seconds / len(EVENTS) * 1e9:8.0f} ns/event")
+
+
+if __name__ == "__main__":
+    main()
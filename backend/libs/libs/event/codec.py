@@ -3,6 +3,12 @@ import json
 from . import event_pb2
 from .schema import Event
 
+# Tags a stream entry holding one serialized `event_pb2.Event` under
+# `event`, with the routing keys copied into `receiver_id` and `event_type`.
+# Entries without a tag are the older one-field-per-attribute dicts written by
+# `EventCodec.to_redis`.
+STREAM_ENCODING_VERSION = b"1"
+
 
 class EventCodec:
     """
@@ -11,6 +17,7 @@ class EventCodec:
     - Event (Pydantic)
     - dict (Redis)
     - Protobuf
+    - Stream entry (Redis, serialized protobuf)
     """
 
     @staticmethod
@@ -89,3 +96,40 @@ class EventCodec:
             }
         else:
             raise ValueError(f"Unsupported event type: {type(event)}")
+
+    @staticmethod
+    def to_stream(event: Event) -> dict[str, bytes | str]:
+        return {
+            "v": STREAM_ENCODING_VERSION,
+            # Routing keys, so the consumer need not parse the event
+            "receiver_id": event.receiver_id,
+            "event_type": event.event_type.value,
+            "event": EventCodec.to_grpc(event).SerializeToString(),
+        }
+
+    @staticmethod
+    def from_stream(fields: dict[bytes, bytes]) -> event_pb2.Event:
+        """Read a stream entry in either encoding."""
+        version = fields.get(b"v")
+        if version == STREAM_ENCODING_VERSION:
+            return event_pb2.Event.FromString(fields[b"event"])
+        if version is None:
+            return EventCodec.to_grpc(
+                {k.decode(): v.decode() for k, v in fields.items()}
+            )
+        raise ValueError(f"Unsupported stream encoding version: {version!r}")
+
+    @staticmethod
+    def route_stream_entry(fields: dict[bytes, bytes]) -> tuple[str, str, bytes]:
+        """
+        A stream entry's receiver_id, event_type and serialized event.
+        Tagged entries are not parsed; older ones are converted.
+        """
+        if fields.get(b"v") == STREAM_ENCODING_VERSION and b"receiver_id" in fields:
+            return (
+                fields[b"receiver_id"].decode(),
+                fields[b"event_type"].decode(),
+                fields[b"event"],
+            )
+        event = EventCodec.from_stream(fields)
+        return event.receiver_id, event.event_type, event.SerializeToString()
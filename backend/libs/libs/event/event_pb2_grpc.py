@@ -50,6 +50,12 @@ class EventServiceStub(object):
             response_deserializer=event__pb2.Ack.FromString,
             _registered_method=True,
         )
+        self.StreamEvents = channel.stream_stream(
+            "/event.EventService/StreamEvents",
+            request_serializer=event__pb2.EventBatch.SerializeToString,
+            response_deserializer=event__pb2.StreamAck.FromString,
+            _registered_method=True,
+        )
 
 
 class EventServiceServicer(object):
@@ -67,6 +73,12 @@ class EventServiceServicer(object):
         context.set_details("Method not implemented!")
         raise NotImplementedError("Method not implemented!")
 
+    def StreamEvents(self, request_iterator, context):
+        """One long-lived stream per consumer and gateway"""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
 
 def add_EventServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -80,6 +92,11 @@ def add_EventServiceServicer_to_server(servicer, server):
             request_deserializer=event__pb2.EventBatch.FromString,
             response_serializer=event__pb2.Ack.SerializeToString,
         ),
+        "StreamEvents": grpc.stream_stream_rpc_method_handler(
+            servicer.StreamEvents,
+            request_deserializer=event__pb2.EventBatch.FromString,
+            response_serializer=event__pb2.StreamAck.SerializeToString,
+        ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
         "event.EventService", rpc_method_handlers
@@ -151,3 +168,33 @@ class EventService(object):
             metadata,
             _registered_method=True,
         )
+
+    @staticmethod
+    def StreamEvents(
+        request_iterator,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            "/event.EventService/StreamEvents",
+            event__pb2.EventBatch.SerializeToString,
+            event__pb2.StreamAck.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
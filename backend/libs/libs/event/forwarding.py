@@ -0,0 +1,72 @@
+"""
+Forwarding events that are already serialized.
+
+Stream entries carry each event as a serialized `event_pb2.Event`, with its
+routing keys in separate fields. event_consumer routes on those keys and
+forwards the payload to the gateway as it is, so it never parses an event.
+`RawEventBatch` frames the payloads the way an `EventBatch` would be
+serialized, and `ForwardingEventServiceStub` sends it.
+"""
+
+import grpc
+
+from . import event_pb2, event_pb2_grpc
+
+# Wire-format tags of EventBatch's fields: (field number << 3) | wire type
+_EVENTS_TAG = b"\x0a"  # 1, length-delimited
+_SEQUENCE_TAG = b"\x10"  # 2, varint
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+class RawEventBatch:
+    """
+    An EventBatch of serialized events. It serializes to the same bytes as
+    `EventBatch(events=[Event.FromString(e) for e in events])`, and the gateway
+    parses it as one.
+    """
+
+    __slots__ = ("events", "sequence")
+
+    def __init__(self, events: list[bytes], sequence: int = 0):
+        self.events = events
+        self.sequence = sequence
+
+    def SerializeToString(self) -> bytes:
+        parts = []
+        for event in self.events:
+            parts.append(_EVENTS_TAG)
+            parts.append(_varint(len(event)))
+            parts.append(event)
+        if self.sequence:
+            parts.append(_SEQUENCE_TAG)
+            parts.append(_varint(self.sequence))
+        return b"".join(parts)
+
+
+def _serialize(batch: event_pb2.EventBatch | RawEventBatch) -> bytes:
+    return batch.SerializeToString()
+
+
+class ForwardingEventServiceStub(event_pb2_grpc.EventServiceStub):
+    """EventServiceStub whose batch RPCs also take a `RawEventBatch`."""
+
+    def __init__(self, channel: grpc.aio.Channel):
+        super().__init__(channel)
+        self.SendEvents = channel.unary_unary(
+            "/event.EventService/SendEvents",
+            request_serializer=_serialize,
+            response_deserializer=event_pb2.Ack.FromString,
+        )
+        self.StreamEvents = channel.stream_stream(
+            "/event.EventService/StreamEvents",
+            request_serializer=_serialize,
+            response_deserializer=event_pb2.StreamAck.FromString,
+        )
@@ -1,10 +1,11 @@
-import hashlib
 from typing import Iterable
 
 import structlog
 from redis.asyncio import Redis
 
+from libs.recent_events import RecentEvents
 from libs.rediskeys import RediKeys
+from libs.shardmap import INITIAL_VERSION, PUBLISH_EVENTS, ShardMap
 
 from .codec import EventCodec
 from .schema import Event
@@ -14,46 +15,84 @@ logger = structlog.get_logger()
 DEFAULT_NUM_SHARDS = 16
 
 
-def compute_shard_id(receiver_id: str, num_shards: int = DEFAULT_NUM_SHARDS) -> str:
-    """Pick the stream shard for a receiver.
-
-    Sharding by receiver keeps every event for one channel (or user) on one
-    stream, so a single consumer sees them in order.
-    """
-    hash_val = int(hashlib.sha256(str(receiver_id).encode()).hexdigest(), 16)
-    return str(hash_val % num_shards)
-
-
 class EventPublisher:
     """Writes events onto the sharded Redis streams that event_consumer reads.
 
     Every producer goes through this — ws_gateway for client-sent messages,
     rest_api for mutations that clients need to hear about — so the shard
-    function has exactly one implementation. `num_shards` must equal the
-    consumer/lease manager's NUM_STREAMS or events land on unread shards.
+    function has exactly one implementation. The shard count comes from the
+    shard map lease_manager keeps in Redis (see libs.shardmap); `num_shards`
+    is only used until lease_manager has written one.
+
+    Writes are checked against the map's version, so a publisher that missed
+    a resharding has its write refused, re-reads the map and writes again to
+    the new streams.
+
+    Each event is also added to its receiver's recent-event buffer, in the
+    same round trip, so a reconnecting client can catch up on it.
     """
 
-    def __init__(self, redis: Redis, num_shards: int = DEFAULT_NUM_SHARDS):
+    def __init__(
+        self,
+        redis: Redis,
+        num_shards: int = DEFAULT_NUM_SHARDS,
+        recent_events: RecentEvents | None = None,
+    ):
         self.redis = redis
         self.num_shards = num_shards
-
-    def shard_for(self, receiver_id: str) -> str:
-        return compute_shard_id(receiver_id, self.num_shards)
+        self.shard_map: ShardMap | None = None
+        self.recent_events = recent_events or RecentEvents()
+        self._publish_events = redis.register_script(PUBLISH_EVENTS)
 
     async def publish(self, event: Event) -> None:
-        key = RediKeys.stream_shard(self.shard_for(event.receiver_id))
-        await self.redis.xadd(key, EventCodec.to_redis(event))
+        await self._publish([event])
         logger.debug(
-            "Published event", event_type=event.event_type, receiver_id=event.receiver_id
+            "Published event",
+            event_type=event.event_type,
+            receiver_id=event.receiver_id,
         )
 
     async def publish_many(self, events: Iterable[Event]) -> None:
-        pipe = self.redis.pipeline()
-        count = 0
-        for event in events:
-            key = RediKeys.stream_shard(self.shard_for(event.receiver_id))
-            pipe.xadd(key, EventCodec.to_redis(event))
-            count += 1
-        if count:
-            await pipe.execute()
-            logger.debug("Published event batch", count=count)
+        events = list(events)
+        if events:
+            await self._publish(events)
+            logger.debug("Published event batch", count=len(events))
+
+    async def _publish(self, events: list[Event]) -> None:
+        if self.shard_map is None:
+            await self._load_shard_map()
+        entries = [EventCodec.to_stream(event) for event in events]
+        while True:
+            shard_map = self.shard_map
+            keys = [RediKeys.shard_map()]
+            args = [shard_map.version]
+            for event, entry in zip(events, entries):
+                keys.append(shard_map.stream_for(event.receiver_id))
+                args.append(len(entry))
+                for field, value in entry.items():
+                    args.extend((field, value))
+            pipe = self.redis.pipeline(transaction=False)
+            await self._publish_events(keys=keys, args=args, client=pipe)
+            # Buffering twice on a retry adds nothing: the members are the same
+            self.recent_events.add(
+                pipe,
+                ((event, entry["event"]) for event, entry in zip(events, entries)),
+            )
+            results = await pipe.execute()
+            if results[0] >= 0:
+                return
+            # Resharded since we last looked
+            previous = shard_map.version
+            await self._load_shard_map()
+            logger.info(
+                "Shard map changed",
+                previous_version=previous,
+                version=self.shard_map.version,
+                num_shards=self.shard_map.num_shards,
+            )
+
+    async def _load_shard_map(self):
+        self.shard_map = await ShardMap.load(self.redis) or ShardMap(
+            version=INITIAL_VERSION, num_shards=self.num_shards
+        )
+        self.num_shards = self.shard_map.num_shards
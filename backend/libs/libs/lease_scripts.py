@@ -0,0 +1,77 @@
+"""
+Lua scripts for fenced shard leases.
+
+`RediKeys.leases()` says who *should* read a shard; lease_manager writes it.
+`RediKeys.lease_holders()` says who *does*, and `RediKeys.lease_epochs()`
+counts how often a shard has been taken. A consumer takes a shard only when
+nobody holds it, and gets the new epoch as its fencing token. Acks and
+dead-letter moves carry that token and are refused once the shard has been
+taken again, so a consumer that lost its shard can never ack for the new
+holder.
+
+A holder is cleared when it releases the shard after draining, or by
+lease_manager once its heartbeat has expired. Either way the shard is
+published on `RediKeys.lease_changes()`, so its next owner takes it at once.
+"""
+
+# KEYS: leases, lease_holders, lease_epochs
+# ARGV: shard, consumer_id
+# Returns the new epoch; 0 while another consumer holds the shard; -1 when the
+# shard is not leased to this consumer.
+ACQUIRE_LEASE = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return -1
+end
+local holder = redis.call('HGET', KEYS[2], ARGV[1])
+if holder and holder ~= ARGV[2] then
+    return 0
+end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+return redis.call('HINCRBY', KEYS[3], ARGV[1], 1)
+"""
+
+# KEYS: lease_holders, lease_changes
+# ARGV: shard, consumer_id
+# Returns 1 if the consumer held the shard and no longer does.
+RELEASE_LEASE = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('PUBLISH', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# KEYS: lease_epochs, stream
+# ARGV: shard, epoch, consumer_group, message_id...
+# Returns the number acked, or -1 when the epoch is stale.
+FENCED_ACK = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return -1
+end
+return redis.call('XACK', KEYS[2], ARGV[3], unpack(ARGV, 4))
+"""
+
+# KEYS: lease_epochs, stream, dead-letter stream
+# ARGV: shard, epoch, consumer_group, dead-letter stream max length, then per
+#       entry: message_id, field count n, n field/value pairs
+# Returns the number of entries moved, or -1 when the epoch is stale.
+FENCED_DEAD_LETTER = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return -1
+end
+local i = 5
+local moved = 0
+while i <= #ARGV do
+    local message_id = ARGV[i]
+    local n = tonumber(ARGV[i + 1])
+    redis.call(
+        'XADD', KEYS[3], 'MAXLEN', '~', ARGV[4], '*',
+        unpack(ARGV, i + 2, i + 1 + 2 * n)
+    )
+    redis.call('XACK', KEYS[2], ARGV[3], message_id)
+    moved = moved + 1
+    i = i + 2 + 2 * n
+end
+return moved
+"""
@@ -0,0 +1,95 @@
+"""
+Per-receiver buffer of recent events, for clients catching up after a reconnect.
+
+Producers add every event they publish to `RediKeys.recent_events()` of its
+receiver (a user, or a channel), a sorted set of serialized `event_pb2.Event`
+scored by the event's timestamp in microseconds. Each buffer keeps at most
+`max_len` events and none older than `retention` seconds.
+
+A client reconnecting to ws_gateway names the timestamp of the last event it
+saw. The gateway replays what its user and channel buffers hold from it on, or,
+when the buffers may have lost some of that, tells the client to resync in
+full. Writers and the gateway must agree on the bounds for that check to
+hold, hence the defaults here rather than in each service's config.
+"""
+
+import time
+from datetime import datetime, timezone
+from typing import Iterable
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+from libs.event import event_pb2
+from libs.event.schema import Event
+from libs.rediskeys import RediKeys
+
+RECENT_EVENTS_MAX_LEN = 256
+RECENT_EVENTS_RETENTION = 3600
+
+
+def timestamp_score(timestamp: str) -> int:
+    """Microseconds since the epoch; exact as a sorted set score."""
+    moment = datetime.fromisoformat(timestamp)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp()) * 1_000_000 + moment.microsecond
+
+
+class ResyncRequired(Exception):
+    """The buffers may no longer hold every event from the cursor on."""
+
+
+class RecentEvents:
+    def __init__(
+        self,
+        max_len: int = RECENT_EVENTS_MAX_LEN,
+        retention: int = RECENT_EVENTS_RETENTION,
+    ):
+        self.max_len = max_len
+        self.retention = retention
+
+    def add(self, pipe: Pipeline, events: Iterable[tuple[Event, bytes]]):
+        """Queue buffering each (event, serialized event) on `pipe`."""
+        for event, serialized in events:
+            key = RediKeys.recent_events(event.receiver_id)
+            score = timestamp_score(event.timestamp)
+            pipe.zadd(key, {serialized: score})
+            pipe.zremrangebyscore(key, "-inf", f"({score - self.retention * 1_000_000}")
+            pipe.zremrangebyrank(key, 0, -self.max_len - 1)
+            # Everything in it is past retention by then anyway
+            pipe.expire(key, self.retention)
+
+    async def since(
+        self, redis: Redis, receiver_ids: Iterable[str], timestamp: str
+    ) -> list[event_pb2.Event]:
+        """
+        Every buffered event for `receiver_ids` from `timestamp` on, oldest
+        first. Events at `timestamp` itself are included: the client may have
+        seen only some of those, and it drops repeats by `event_id`.
+
+        Raises ResyncRequired when `timestamp` is past retention, or when a
+        buffer that is full does not start before it: events in between, or
+        at the cursor, may have been dropped.
+        """
+        cursor = timestamp_score(timestamp)
+        if cursor < (time.time() - self.retention) * 1_000_000:
+            raise ResyncRequired(timestamp)
+
+        receiver_ids = list(dict.fromkeys(receiver_ids))
+        pipe = redis.pipeline(transaction=False)
+        for receiver_id in receiver_ids:
+            key = RediKeys.recent_events(receiver_id)
+            pipe.zcard(key)
+            pipe.zrange(key, 0, 0, withscores=True)
+            pipe.zrangebyscore(key, cursor, "+inf", withscores=True)
+        results = await pipe.execute()
+
+        missed = []
+        for i in range(len(receiver_ids)):
+            size, oldest, entries = results[3 * i : 3 * i + 3]
+            if size >= self.max_len and oldest and oldest[0][1] >= cursor:
+                raise ResyncRequired(timestamp)
+            missed.extend(entries)
+        missed.sort(key=lambda entry: entry[1])
+        return [event_pb2.Event.FromString(serialized) for serialized, _ in missed]
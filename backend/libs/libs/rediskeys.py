@@ -11,6 +11,11 @@ class RediKeys:
     def channel_grpc_endpoints(channel_id: str) -> str:
         return f"channel:{channel_id}:grpc_endpoints"
 
+    @staticmethod
+    def grpc_endpoint_changes() -> str:
+        """Pub/sub channel carrying `libs.routing.EndpointChange` messages."""
+        return "grpc_endpoint_changes"
+
     @staticmethod
     def channel_voice_members(channel_id: str) -> str:
         """Users currently connected to a voice channel's SFU room.
@@ -22,13 +27,49 @@ class RediKeys:
         return f"channel:{channel_id}:voice_members"
 
     @staticmethod
-    def stream_shard(shard_id: str) -> str:
-        return f"stream_shard:{shard_id}"
+    def stream_shard(shard_id: str, version: int = 1) -> str:
+        """One shard of the event stream under shard map `version`.
+
+        Version 1 keeps the names from before the map was versioned.
+        """
+        if version == 1:
+            return f"stream_shard:{shard_id}"
+        return f"stream_shard:v{version}:{shard_id}"
+
+    @staticmethod
+    def stream_stats(stream_name: str) -> str:
+        """Length and memory of a stream, recorded by lease_manager's trimmer."""
+        return f"{stream_name}:stats"
+
+    @staticmethod
+    def shard_map() -> str:
+        """Shard count and stream version producers use (see libs.shardmap)."""
+        return "shard_map"
+
+    @staticmethod
+    def recent_events(receiver_id: str) -> str:
+        """A user's or channel's recent events, for replay (see libs.recent_events)."""
+        return f"recent_events:{receiver_id}"
+
+    @staticmethod
+    def persistence_stream() -> str:
+        """Events ws_gateway publishes before they are written to Postgres."""
+        return "persistence_stream"
+
+    @staticmethod
+    def dead_letter_stream(stream_name: str) -> str:
+        """Where a stream's undeliverable entries go: `stream_shard:{n}:dlq`."""
+        return f"{stream_name}:dlq"
 
     @staticmethod
     def heartbeat(consumer_id: str) -> str:
         return f"heartbeat:{consumer_id}"
 
+    @staticmethod
+    def consumer_stats(consumer_id: str) -> str:
+        """Counters an event_consumer publishes with each heartbeat."""
+        return f"consumer:{consumer_id}:stats"
+
     @staticmethod
     def event_consumers() -> str:
         return "event_consumers"
@@ -36,3 +77,23 @@ class RediKeys:
     @staticmethod
     def leases() -> str:
         return "leases"
+
+    @staticmethod
+    def lease_holders() -> str:
+        """Shard -> the consumer currently reading it (see libs.lease_scripts)."""
+        return "lease_holders"
+
+    @staticmethod
+    def lease_epochs() -> str:
+        """Shard -> fencing epoch, bumped each time a consumer takes it."""
+        return "lease_epochs"
+
+    @staticmethod
+    def lease_changes() -> str:
+        """Pub/sub channel poked whenever leases are reassigned or released."""
+        return "lease_changes"
+
+    @staticmethod
+    def leases_version() -> str:
+        """Bumped by lease_manager on every change to `leases`."""
+        return "leases:version"
@@ -0,0 +1,27 @@
+from enum import Enum
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class EndpointOp(str, Enum):
+    # `channel:{id}:grpc_endpoints` gained or lost one gateway
+    ADDED = "added"
+    REMOVED = "removed"
+    # `user:{id}:grpc_endpoint` was written or deleted
+    SET = "set"
+    DELETED = "deleted"
+
+
+class EndpointChange(BaseModel):
+    """A change to one of the gateway routing keys.
+
+    ws_gateway publishes these on `RediKeys.grpc_endpoint_changes()` next to
+    the write itself, and every event_consumer patches its endpoint cache
+    from them instead of waiting for the entry to expire. `key` is the Redis
+    key that changed, which is also what the consumer caches it under.
+    """
+
+    key: str
+    op: EndpointOp
+    endpoint: Optional[str] = None
@@ -0,0 +1,169 @@
+"""
+Versioned map of the event stream shards.
+
+`RediKeys.shard_map()` holds the shard count producers hash receivers over
+and the version of the streams they write, so NUM_STREAMS can change while
+everything runs. lease_manager is its only writer. Each version has its own
+streams (see `RediKeys.stream_shard`), so old and new entries never share a
+stream.
+
+Resharding is two-phase. lease_manager first creates the new version's
+streams and then switches the map to them, keeping the previous version as
+`draining`. Producers publish through `PUBLISH_EVENTS`, which refuses writes
+for any version but the current one. From the switch on, nothing more lands
+on the draining streams. Consumers keep reading them, and the new streams fill
+up meanwhile. Once every draining stream is read and acked, lease_manager drops
+`draining` and leases the new streams. A receiver's events before the switch
+are therefore all delivered before any after it.
+
+The map also names the hash receivers are sharded by. Changing it moves
+nearly every receiver, so it is a resharding like any other.
+"""
+
+import hashlib
+import zlib
+from dataclasses import dataclass
+from functools import lru_cache
+
+from redis.asyncio import Redis
+
+from libs.rediskeys import RediKeys
+
+# Streams before the map existed: `stream_shard:{n}`
+INITIAL_VERSION = 1
+
+# How receivers are hashed onto shards. "sha256" is what every producer used
+# before the map named it, so a map that names none means "sha256".
+SHA256 = "sha256"
+CRC32 = "crc32"
+SHARD_HASHES = (SHA256, CRC32)
+
+# Receivers whose stream each ShardMap remembers
+STREAM_CACHE_SIZE = 65536
+
+
+def compute_shard_id(
+    receiver_id: str, num_shards: int, shard_hash: str = SHA256
+) -> str:
+    """Pick the stream shard for a receiver.
+
+    Sharding by receiver keeps every event for one channel (or user) on one
+    stream, so a single consumer sees them in order. CRC32 spreads UUIDs just
+    as evenly at a fraction of the cost; SHA-256 is kept for streams written
+    before it, since switching moves nearly every receiver to another shard.
+    """
+    if shard_hash == CRC32:
+        return str(zlib.crc32(str(receiver_id).encode()) % num_shards)
+    hash_val = int(hashlib.sha256(str(receiver_id).encode()).hexdigest(), 16)
+    return str(hash_val % num_shards)
+
+
+@dataclass(frozen=True)
+class ShardMap:
+    version: int
+    num_shards: int
+    # Previous version, still being read, while a resharding is in progress
+    draining_version: int | None = None
+    draining_num_shards: int | None = None
+    shard_hash: str = SHA256
+    # Approximate cap on each stream's length, applied as producers write; 0
+    # for none. lease_manager's trimmer is what normally keeps them short.
+    stream_max_len: int = 0
+
+    def __post_init__(self):
+        # Receivers repeat a lot (busy channels, users in many chats). Keyed
+        # by receiver alone, per map, a hit costs well under the hash it saves.
+        cached = lru_cache(maxsize=STREAM_CACHE_SIZE)(self.stream_for)
+        object.__setattr__(self, "stream_for", cached)
+
+    @property
+    def migrating(self) -> bool:
+        return self.draining_version is not None
+
+    def stream_for(self, receiver_id: str) -> str:
+        """The stream a receiver's events go to under this map."""
+        return RediKeys.stream_shard(
+            compute_shard_id(receiver_id, self.num_shards, self.shard_hash),
+            self.version,
+        )
+
+    def streams(self) -> list[str]:
+        return [
+            RediKeys.stream_shard(str(shard), self.version)
+            for shard in range(self.num_shards)
+        ]
+
+    def draining_streams(self) -> list[str]:
+        if not self.migrating:
+            return []
+        return [
+            RediKeys.stream_shard(str(shard), self.draining_version)
+            for shard in range(self.draining_num_shards)
+        ]
+
+    def to_redis(self) -> dict[str, int | str]:
+        fields = {
+            "version": self.version,
+            "num_shards": self.num_shards,
+            "shard_hash": self.shard_hash,
+            "stream_max_len": self.stream_max_len,
+        }
+        if self.migrating:
+            fields["draining_version"] = self.draining_version
+            fields["draining_num_shards"] = self.draining_num_shards
+        return fields
+
+    @classmethod
+    def from_redis(cls, fields: dict) -> "ShardMap | None":
+        fields = {
+            (k.decode("utf-8") if isinstance(k, bytes) else k): (
+                v.decode("utf-8") if isinstance(v, bytes) else v
+            )
+            for k, v in fields.items()
+        }
+        if "version" not in fields:
+            return None
+        draining_version = fields.get("draining_version")
+        draining_num_shards = fields.get("draining_num_shards")
+        return cls(
+            version=int(fields["version"]),
+            num_shards=int(fields["num_shards"]),
+            draining_version=int(draining_version) if draining_version else None,
+            draining_num_shards=(
+                int(draining_num_shards) if draining_num_shards else None
+            ),
+            shard_hash=fields.get("shard_hash", SHA256),
+            stream_max_len=int(fields.get("stream_max_len", 0)),
+        )
+
+    @classmethod
+    async def load(cls, redis: Redis) -> "ShardMap | None":
+        """The current map, or None before lease_manager first wrote one."""
+        return cls.from_redis(await redis.hgetall(RediKeys.shard_map()))
+
+
+# KEYS: shard_map, then one stream per entry
+# ARGV: version, then per entry: field count n, n field/value pairs
+# Returns the number of entries added, or -1 when `version` is not current.
+# A missing map is version 1, so producers can start before lease_manager.
+PUBLISH_EVENTS = """
+local map = redis.call('HMGET', KEYS[1], 'version', 'stream_max_len')
+if (map[1] or '1') ~= ARGV[1] then
+    return -1
+end
+local max_len = tonumber(map[2] or '0')
+local i = 2
+for k = 2, #KEYS do
+    local n = tonumber(ARGV[i])
+    if max_len > 0 then
+        redis.call(
+            'XADD', KEYS[k], 'MAXLEN', '~', max_len, '*',
+            unpack(ARGV, i + 1, i + 2 * n)
+        )
+    else
+        redis.call('XADD', KEYS[k], '*', unpack(ARGV, i + 1, i + 2 * n))
+    end
+    i = i + 1 + 2 * n
+end
+return #KEYS - 1
+"""
@@ -27,8 +27,9 @@ class SettingsFactory(BaseSettings):
     SUPERUSER_PASSWORD: str
     DOCS: bool
 
-    # Realtime publishing. NUM_SHARDS must match the gateway's NUM_SHARDS and
-    # the consumer/lease manager's NUM_STREAMS.
+    # Realtime publishing. The shard count comes from the shard map the lease
+    # manager writes; NUM_SHARDS is only used before it has written one, so it
+    # should match the lease manager's NUM_STREAMS.
     REDIS_HOST: str = "redis"
     REDIS_PORT: int = 6379
     REDIS_DB: int = 0
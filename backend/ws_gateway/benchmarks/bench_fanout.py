@@ -0,0 +1,117 @@
+"""Cost of fanning one channel message out to every member on a gateway.
+
+    PYTHONPATH=../libs:. python benchmarks/bench_fanout.py
+
+Times what EventDispatcher.send_events_to_clients does per recipient, with
+sockets whose ASGI `send` does nothing, so only the gateway's own CPU work
+counts. Sending straight to the sockets:
+
+- per_socket: the event dumped to a dict once, JSON-encoded by send_json for
+  every socket
+- encoded_once: the event encoded once, the same text sent to every socket
+
+Queueing on each socket's SocketSender, whose writer does the sending:
+
+- grouped: channel members copied into a list, events grouped per user, each
+  user's senders copied into a list
+- prebuilt: the channel's senders walked as one prebuilt tuple
+"""
+
+import asyncio
+import time
+import uuid
+from collections import defaultdict
+
+from libs.event.schema import Event, EventType
+from src.websocket.sender import OverflowPolicy, SendQueueStats, SocketSender
+from starlette.websockets import WebSocket, WebSocketState
+
+MEMBERS = 5000
+
+
+async def discard(message):
+    pass
+
+
+def make_socket() -> WebSocket:
+    socket = WebSocket({"type": "websocket"}, receive=None, send=discard)
+    socket.application_state = WebSocketState.CONNECTED
+    return socket
+
+
+CHANNEL_ID = str(uuid.uuid4())
+USER_IDS = [str(uuid.uuid4()) for _ in range(MEMBERS)]
+CLIENTS = {user_id: {make_socket(): None} for user_id in USER_IDS}
+SOCKETS = [socket for sockets in CLIENTS.values() for socket in sockets]
+STATS = SendQueueStats()
+for sockets in CLIENTS.values():
+    for socket in sockets:
+        # Not started: the writers' sends are what encoded_once times
+        sockets[socket] = SocketSender(
+            socket, MEMBERS, OverflowPolicy.DROP_OLDEST, STATS
+        )
+CHANNEL_USER_IDS = {CHANNEL_ID: set(USER_IDS)}
+CHANNEL_SENDERS = {
+    CHANNEL_ID: tuple(
+        sender for sockets in CLIENTS.values() for sender in sockets.values()
+    )
+}
+EVENT = Event(
+    event_type=EventType.MESSAGE,
+    sender_id=USER_IDS[0],
+    receiver_id=CHANNEL_ID,
+    text="hello there " * 5,
+    metadata={"guild_id": str(uuid.uuid4()), "attachments": []},
+)
+
+
+async def per_socket():
+    event_json = EVENT.model_dump(mode="json")
+    await asyncio.gather(*(socket.send_json(event_json) for socket in SOCKETS))
+
+
+async def encoded_once():
+    event_text = EVENT.model_dump_json()
+    await asyncio.gather(*(socket.send_text(event_text) for socket in SOCKETS))
+
+
+async def grouped():
+    groups = defaultdict(list)
+    event_text = EVENT.model_dump_json()
+    for user_id in list(CHANNEL_USER_IDS.get(EVENT.receiver_id, [])):
+        groups[user_id].append(event_text)
+    for user_id in groups:
+        senders = list(CLIENTS.get(user_id, {}).values())
+        for event_text in groups[user_id]:
+            for sender in senders:
+                sender.enqueue(event_text)
+
+
+async def prebuilt():
+    event_text = EVENT.model_dump_json()
+    for sender in CHANNEL_SENDERS[EVENT.receiver_id]:
+        sender.enqueue(event_text)
+
+
+async def timed(bench, rounds: int = 20) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await bench()
+        best = min(best, time.perf_counter() - start)
+        for sender in CHANNEL_SENDERS[CHANNEL_ID]:
+            sender.queue.clear()
+    return best
+
+
+async def main():
+    for bench in (per_socket, encoded_once, grouped, prebuilt):
+        seconds = await timed(bench)
+        print(
+            f"{bench.__name__:<13} {seconds * 1e3:6.2f} ms per message"
+            f"  {seconds / MEMBERS * 1e9:6.0f} ns/socket"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
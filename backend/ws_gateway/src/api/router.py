@@ -12,9 +12,16 @@ router = APIRouter(tags=["websocket", "gateway"])
 
 
 @router.websocket("/")
-async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    token: str = Query(...),
+    # Timestamp of the last event a reconnecting client saw
+    since: str | None = Query(None),
+):
     current_user = await get_current_user_ws(token)
     await websocket_manager.add_client(current_user=current_user, websocket=websocket)
+    if since:
+        await websocket_manager.replay_missed_events(current_user.id, websocket, since)
 
     try:
         while True:
@@ -22,6 +29,8 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
             try:
                 event = Event(**orjson.loads(data), sender_id=current_user.id)
                 logger.debug(f"Received event: {event}")
+                # Waits while the queue is full; the client's sends back up
+                # in TCP until it has room again
                 await event_queue.enqueue_event(event)
             except Exception as e:
                 logger.error(f"Error processing event: {e}")
@@ -1,4 +1,5 @@
 import os
+from typing import Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -12,6 +13,31 @@ class Settings(BaseSettings):
     NUM_SHARDS: int
     BATCH_SIZE: int
     BATCH_INTERVAL_MS: int
+    # Events waiting for the next batch before websocket readers are held
+    # back; a batch being flushed does not count
+    EVENT_QUEUE_MAX_SIZE: int = 10000
+    # sync: client events are committed to Postgres before they are published.
+    # async: published at once, and written by the persistence worker in
+    # batches of up to PERSISTENCE_BATCH_SIZE (src.event.persistence_worker)
+    PERSISTENCE_MODE: Literal["sync", "async"] = "sync"
+    PERSISTENCE_BATCH_SIZE: int = 1000
+    # Attempts at an event that fails to write on its own before it is moved
+    # to `persistence_stream:dlq`, kept to about PERSISTENCE_DEAD_LETTER_MAX_LEN
+    PERSISTENCE_MAX_DELIVERIES: int = 10
+    PERSISTENCE_DEAD_LETTER_MAX_LEN: int = 100000
+    # Message batches at least this large are written with COPY. Below about
+    # 100 a plain INSERT is as fast or faster; from 250 COPY is 1.2-1.8x
+    # faster (benchmarks/bench_message_copy.py, Postgres 16)
+    MESSAGE_COPY_THRESHOLD: int = 250
+
+    # Frames queued per socket before a client counts as falling behind, and
+    # what happens then: disconnect (the client reconnects and replays what
+    # it missed), coalesce (into one resync_required) or drop_oldest, which
+    # loses events silently (see src.websocket.sender.OverflowPolicy)
+    SEND_QUEUE_MAX_SIZE: int = 1024
+    SEND_QUEUE_OVERFLOW_POLICY: Literal["drop_oldest", "coalesce", "disconnect"] = (
+        "disconnect"
+    )
 
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
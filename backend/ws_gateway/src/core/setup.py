@@ -9,6 +9,7 @@ from src.core.config import settings
 from src.database.config import engine
 from src.event.event_dispatcher import event_dispatcher
 from src.event.event_queue import event_queue
+from src.event.persistence_worker import persistence_worker
 from src.grpc.grpc_server import serve_grpc_server
 from src.redis.redis_manager import RedisManager
 from src.websocket.manager import websocket_manager
@@ -25,10 +26,14 @@ async def lifespan(app: FastAPI):
     websocket_manager.set_redis_manager(redis_manager)
     server_task = asyncio.create_task(serve_grpc_server(settings.GRPC_PORT))
     websocket_manager.set_grpc_endpoint(settings.GRPC_ENDPOINT)
+    websocket_manager.start()
     event_queue.set_event_dispatcher(event_dispatcher)
     event_dispatcher.set_redis_manager(redis_manager)
     event_dispatcher.set_websocket_manager(websocket_manager)
     await event_queue.start_batch_processor()
+    persistence_worker.set_redis_manager(redis_manager)
+    persistence_worker.set_event_dispatcher(event_dispatcher)
+    await persistence_worker.start()
     try:
         async with engine.connect() as conn:
             await conn.execute(text("SELECT 1"))
@@ -39,6 +44,8 @@ async def lifespan(app: FastAPI):
     yield
 
     server_task.cancel()
+    await persistence_worker.stop()
+    await websocket_manager.stop()
     await redis_manager.disconnect()
 
 
@@ -5,11 +5,14 @@ from typing import List
 import structlog
 from libs.event.schema import CHANNELS_CHANGED_FLAG, Event, EventType
 from libs.logging import bind_event_context
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
+from src.core.config import settings
 from src.database.config import AsyncSessionLocal
 from src.message.dispatcher import MessageEventDispatcher
 from src.redis.redis_manager import RedisManager
 from src.websocket.manager import WebsocketManager
+from src.websocket.sender import SocketSender
 
 logger = structlog.get_logger()
 
@@ -34,7 +37,81 @@ class EventDispatcher:
             logger.error("Redis manager not set")
             return
 
-        # Persist all events
+        all_events: List[Event] = []
+        for events in batch.values():
+            all_events.extend(events)
+
+        if settings.PERSISTENCE_MODE == "async":
+            # Handed to the persistence worker through Redis, so delivery does
+            # not wait on Postgres; a slow database only grows its backlog
+            try:
+                await self.redis_manager.queue_for_persistence(all_events)
+            except Exception:
+                logger.exception("Queueing events for persistence failed")
+                return
+        else:
+            failed = await self.persist_events(all_events)
+            if failed:
+                # Not committed, so not published either; the rest of the
+                # batch still is
+                logger.error(
+                    "Dropping events that could not be persisted",
+                    count=len(failed),
+                    event_ids=[event.event_id for event in failed],
+                )
+                failed_ids = {event.event_id for event in failed}
+                all_events = [e for e in all_events if e.event_id not in failed_ids]
+                if not all_events:
+                    return
+
+        # Push events to Redis streams
+        asyncio.create_task(self.redis_manager.batch_push_events_to_streams(all_events))
+
+    async def persist_events(self, events: List[Event]) -> List[Event]:
+        """
+        Write events, returning the ones that could not be written.
+
+        A batch that fails is split in two and each half written on its own,
+        down to single events, so that one bad row (a message to a channel
+        that does not exist) does not take the rest of the batch with it.
+        Nothing is split while the database cannot be reached at all.
+        """
+        if await self.persist_batch(self._by_type(events)):
+            return []
+        if len(events) == 1 or not await self._database_reachable():
+            return events
+        return await self._persist_halves(events)
+
+    async def _persist_halves(self, events: List[Event]) -> List[Event]:
+        middle = len(events) // 2
+        failed = []
+        for half in (events[:middle], events[middle:]):
+            if await self.persist_batch(self._by_type(half)):
+                continue
+            if len(half) == 1:
+                failed += half
+            else:
+                failed += await self._persist_halves(half)
+        return failed
+
+    async def _database_reachable(self) -> bool:
+        try:
+            async with self.session_factory() as session:
+                await session.execute(text("SELECT 1"))
+        except Exception:
+            logger.exception("Database unreachable")
+            return False
+        return True
+
+    @staticmethod
+    def _by_type(events: List[Event]) -> dict[str, list[Event]]:
+        batch = defaultdict(list)
+        for event in events:
+            batch[event.event_type].append(event)
+        return batch
+
+    async def persist_batch(self, batch: dict[str, list[Event]]) -> bool:
+        """Write a batch in one transaction. False if nothing was committed."""
         async with self.session_factory() as session:
             persist_tasks = [
                 self._persist_group(session, event_type, group)
@@ -42,23 +119,19 @@ class EventDispatcher:
             ]
             success = await asyncio.gather(*persist_tasks, return_exceptions=True)
             for task in success:
-                if isinstance(task, Exception):
+                if task is not True:
                     logger.exception("One or more persist tasks failed")
                     logger.debug(f"Details: {task}")
                     await session.rollback()
-                    return
+                    return False
             try:
                 await session.commit()
                 logger.debug("DB commit successful")
             except Exception:
                 logger.exception("DB commit failed")
                 await session.rollback()
-
-        # Push events to Redis streams
-        all_events: List[Event] = []
-        for events in batch.values():
-            all_events.extend(events)
-        asyncio.create_task(self.redis_manager.batch_push_events_to_streams(all_events))
+                return False
+        return True
 
     async def _persist_group(
         self, session: AsyncSession, event_type: str, events: List[Event]
@@ -76,49 +149,33 @@ class EventDispatcher:
 
     @bind_event_context(event_arg_name="event")
     async def send_events_to_clients(self, events: List[Event]):
-
-        # Group by user_id
-        groups = defaultdict(list)  # user_id -> list[event_json]
-        for event in events:
-            user_ids = self._resolve_recipients(event)
-            if not user_ids:
-                logger.debug(f"No user ids found for event: {event}")
-                continue
-            event_json = event.model_dump(mode="json")
-            for user_id in user_ids:
-                groups[user_id].append(event_json)
-
         await self._apply_side_effects(events)
 
-        tasks = []
-        for user_id in groups:
-            # The consumer fans out per gateway, but a user may have
+        queued = 0
+        for event in events:
+            # The consumer fans out per gateway, but recipients may have
             # disconnected in the meantime — skip them, do not fail the batch
-            client_sockets = self.websocket_manager.get_client_sockets(user_id)
-            if not client_sockets:
-                logger.debug(f"Client {user_id} is not on this instance, skipping")
+            senders = self._resolve_senders(event)
+            if not senders:
+                logger.debug(f"No recipients on this instance for event: {event}")
                 continue
-            for event_json in groups[user_id]:
-                # One user can hold several sockets (multiple tabs); each gets
-                # its own copy
-                for client_socket in client_sockets:
-                    tasks.append(client_socket.send_json(event_json))
-
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-
-        failures = [result for result in results if isinstance(result, Exception)]
-        if failures:
-            logger.warning(f"{len(failures)} / {len(tasks)} sends failed")
-        logger.debug(f"Sends {len(tasks) - len(failures)} / {len(tasks)} successful")
-
-    def _resolve_recipients(self, event: Event) -> List[str]:
+            # Encoded once here, not by send_json for every socket: a channel
+            # message goes out as many times as the channel has members here
+            event_text = event.model_dump_json()
+            # Queued, not sent: the sockets' own writers send it, and a slow
+            # one does not hold up the batch. A user with several sockets
+            # (multiple tabs) gets a copy on each
+            for sender in senders:
+                sender.enqueue(event_text)
+            queued += len(senders)
+        logger.debug(f"Queued {queued} sends")
+
+    def _resolve_senders(self, event: Event) -> tuple[SocketSender, ...]:
         """User-addressed events name their recipient directly; channel-addressed
         ones fan out to whichever members of that channel are on this gateway."""
         if EventType.is_user_addressed(event.event_type):
-            return [event.receiver_id]
-        return list(
-            self.websocket_manager.user_mapping.get_channel_user_ids(event.receiver_id)
-        )
+            return self.websocket_manager.get_client_senders(event.receiver_id)
+        return self.websocket_manager.get_channel_senders(event.receiver_id)
 
     async def _apply_side_effects(self, events: List[Event]):
         """Some events change what this gateway needs to know before it can
@@ -1,6 +1,6 @@
 import asyncio
+import time
 from collections import defaultdict
-from copy import deepcopy
 from typing import Dict, List
 
 import structlog
@@ -12,11 +12,33 @@ logger = structlog.get_logger()
 
 
 class EventQueue:
+    """
+    Batches client-sent events for EventDispatcher.dispatch_events.
+
+    A batch is flushed once it holds `BATCH_SIZE` events, or `BATCH_INTERVAL_MS`
+    after its first event, whichever comes first; with nothing queued the loop
+    sleeps until an event arrives. Flushing swaps in a fresh batch rather than
+    copying the old one.
+
+    While a flush is in progress the next batch fills up, but only to
+    `EVENT_QUEUE_MAX_SIZE`: past that `enqueue_event` waits, so a slow commit
+    stops the websocket readers from taking in more instead of growing memory.
+    """
+
     def __init__(self):
         self.batch: Dict[str, List[Event]] = defaultdict(list)
         self.batch_size = 0
+        # When the batch's first event was queued (monotonic)
+        self.batch_started = 0.0
+        self.max_size = settings.EVENT_QUEUE_MAX_SIZE
         self._batch_task: asyncio.Task | None = None
         self.event_dispatcher: EventDispatcher | None = None
+        # Set while the batch holds anything / has reached BATCH_SIZE
+        self._not_empty = asyncio.Event()
+        self._full = asyncio.Event()
+        # Set while the batch is below max_size
+        self._has_room = asyncio.Event()
+        self._has_room.set()
 
     def set_event_dispatcher(self, event_dispatcher: EventDispatcher):
         self.event_dispatcher = event_dispatcher
@@ -34,30 +56,43 @@ class EventQueue:
                 pass
 
     async def enqueue_event(self, event: Event):
+        while not self._has_room.is_set():
+            await self._has_room.wait()
+        if not self.batch_size:
+            self.batch_started = time.monotonic()
         self.batch[event.event_type].append(event)
         self.batch_size += 1
+        self._not_empty.set()
+        if self.batch_size >= settings.BATCH_SIZE:
+            self._full.set()
+        if self.batch_size >= self.max_size:
+            self._has_room.clear()
+            logger.warning("Event queue full", size=self.batch_size)
 
     async def _run_batch_loop(self):
+        interval = settings.BATCH_INTERVAL_MS / 1000.0
         while True:
-            start = asyncio.get_event_loop().time()
+            await self._not_empty.wait()
+            # The deadline runs from the batch's first event, which may have
+            # been queued while the previous batch was still flushing
+            remaining = self.batch_started + interval - time.monotonic()
+            if remaining > 0:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
 
-            # Wait for batch conditions
-            while True:
-                elapsed = asyncio.get_event_loop().time() - start
+            batch = self.batch
+            self.batch = defaultdict(list)
+            self.batch_size = 0
+            self._not_empty.clear()
+            self._full.clear()
+            self._has_room.set()
 
-                # Exit if we have enough events OR time limit reached
-                if self.batch_size >= settings.BATCH_SIZE:
-                    break
-                if elapsed >= (settings.BATCH_INTERVAL_MS / 1000.0):
-                    break
-
-                await asyncio.sleep(settings.BATCH_INTERVAL_MS / 1000.0)
-
-            # Process batches
-            if self.batch:
-                await self.event_dispatcher.dispatch_events(deepcopy(self.batch))
-                self.batch.clear()
-                self.batch_size = 0
+            try:
+                await self.event_dispatcher.dispatch_events(batch)
+            except Exception:
+                logger.exception("Dispatching event batch failed")
 
 
 event_queue = EventQueue()
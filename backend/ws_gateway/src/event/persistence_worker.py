@@ -0,0 +1,201 @@
+import asyncio
+import time
+from dataclasses import asdict, dataclass
+
+import structlog
+from libs.event.codec import EventCodec
+from libs.event.schema import Event
+from src.core.config import settings
+from src.event.event_dispatcher import EventDispatcher
+from src.redis.redis_manager import RedisManager
+
+logger = structlog.get_logger()
+
+
+@dataclass
+class PersistenceStats:
+    """Cumulative counters, plus how far behind the last batch was."""
+
+    persisted: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    # Entries that could not be decoded, dropped
+    dropped: int = 0
+    # Entries taken over from a failed attempt or a departed gateway
+    claimed: int = 0
+    # Entries that failed to write on every one of PERSISTENCE_MAX_DELIVERIES
+    # attempts, moved to the dead-letter stream
+    dead_lettered: int = 0
+    # How long the oldest event of the last batch waited to be committed
+    lag_ms: int = 0
+    max_lag_ms: int = 0
+
+
+class PersistenceWorker:
+    """
+    Writes the events queued on `RediKeys.persistence_stream()` to Postgres.
+
+    With PERSISTENCE_MODE=async, EventDispatcher publishes client events
+    straight away and queues them here instead of committing them first. Every
+    gateway runs a worker in one consumer group, and each reads batches of up
+    to PERSISTENCE_BATCH_SIZE and writes them in one transaction. An entry is
+    acked only once committed; entries left unacked (a failed commit, a
+    gateway that died mid-batch) are claimed again after `claim_after_ms`.
+    Writes are idempotent on the event id, so a batch written twice is
+    harmless.
+
+    A batch that fails is split until only the events that fail on their own
+    are left (EventDispatcher.persist_events); the rest is acked. Those stay
+    pending, and are moved to `persistence_stream:dlq` once they have been
+    tried PERSISTENCE_MAX_DELIVERIES times.
+
+    The worker also runs in sync mode, to drain what async mode left queued.
+    """
+
+    GROUP = "persistence_workers"
+
+    def __init__(self):
+        self.redis_manager: RedisManager | None = None
+        self.event_dispatcher: EventDispatcher | None = None
+        self.consumer_id = settings.GRPC_ENDPOINT
+        self.batch_size = settings.PERSISTENCE_BATCH_SIZE
+        self.block_ms = 1000
+        self.claim_after_ms = 30000
+        self.claim_interval = 10
+        self.stats = PersistenceStats()
+        self.stats_interval = 60
+        self._task: asyncio.Task | None = None
+        self._stats_task: asyncio.Task | None = None
+
+    def set_redis_manager(self, redis_manager: RedisManager):
+        self.redis_manager = redis_manager
+
+    def set_event_dispatcher(self, event_dispatcher: EventDispatcher):
+        self.event_dispatcher = event_dispatcher
+
+    async def start(self):
+        await self.redis_manager.ensure_persistence_group(self.GROUP)
+        self._task = asyncio.create_task(self._run())
+        self._stats_task = asyncio.create_task(self._report_stats())
+        logger.info("Persistence worker started", mode=settings.PERSISTENCE_MODE)
+
+    async def stop(self):
+        for task in (self._task, self._stats_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+    async def _run(self):
+        last_claim = 0.0
+        while True:
+            try:
+                entries = []
+                if time.monotonic() - last_claim >= self.claim_interval:
+                    last_claim = time.monotonic()
+                    entries = await self.redis_manager.claim_stale_persistence(
+                        self.GROUP,
+                        self.consumer_id,
+                        self.claim_after_ms,
+                        self.batch_size,
+                    )
+                    self.stats.claimed += len(entries)
+                if not entries:
+                    entries = await self.redis_manager.read_persistence_batch(
+                        self.GROUP, self.consumer_id, self.batch_size, self.block_ms
+                    )
+                if entries:
+                    await self._persist(entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Persistence worker failed")
+                await asyncio.sleep(1)
+
+    async def _persist(self, entries: list[tuple[bytes, dict]]):
+        events: list[tuple[bytes, Event]] = []
+        for message_id, fields in entries:
+            try:
+                event = EventCodec.to_pydantic(EventCodec.from_stream(fields))
+            except Exception:
+                # Would fail every retry too; acked with the rest
+                logger.exception("Dropping undecodable entry", message_id=message_id)
+                self.stats.dropped += 1
+                continue
+            events.append((message_id, event))
+
+        failed_ids = set()
+        if events:
+            failed = await self.event_dispatcher.persist_events(
+                [event for _, event in events]
+            )
+            if failed:
+                self.stats.failed_batches += 1
+                failed_event_ids = {event.event_id for event in failed}
+                failed_ids = {
+                    message_id
+                    for message_id, event in events
+                    if event.event_id in failed_event_ids
+                }
+
+        written = [
+            message_id for message_id, _ in entries if message_id not in failed_ids
+        ]
+        if written:
+            await self.redis_manager.ack_persisted(self.GROUP, written)
+
+            # Entry ids start with the milliseconds they were queued at
+            oldest_ms = min(int(message_id.split(b"-")[0]) for message_id in written)
+            self.stats.lag_ms = max(int(time.time() * 1000) - oldest_ms, 0)
+            self.stats.max_lag_ms = max(self.stats.max_lag_ms, self.stats.lag_ms)
+            self.stats.persisted += len(events) - len(failed_ids)
+            self.stats.batches += 1
+        if failed_ids:
+            await self._dead_letter_exhausted(
+                [entry for entry in entries if entry[0] in failed_ids]
+            )
+
+    async def _dead_letter_exhausted(self, entries: list[tuple[bytes, dict]]):
+        """Left pending, to be claimed again once idle for claim_after_ms,
+        unless already tried PERSISTENCE_MAX_DELIVERIES times."""
+        deliveries = await self.redis_manager.persistence_deliveries(
+            self.GROUP, [message_id for message_id, _ in entries]
+        )
+        exhausted = [
+            (
+                message_id,
+                {
+                    **fields,
+                    "dlq_message_id": message_id,
+                    "dlq_deliveries": deliveries[message_id],
+                },
+            )
+            for message_id, fields in entries
+            if deliveries.get(message_id, 0) >= settings.PERSISTENCE_MAX_DELIVERIES
+        ]
+        if not exhausted:
+            return
+        await self.redis_manager.dead_letter_persistence(self.GROUP, exhausted)
+        self.stats.dead_lettered += len(exhausted)
+        logger.error(
+            "Moved unwritable entries to the dead-letter stream", count=len(exhausted)
+        )
+
+    async def stats_snapshot(self) -> dict[str, int]:
+        return {
+            **asdict(self.stats),
+            "backlog": await self.redis_manager.persistence_backlog(self.GROUP),
+        }
+
+    async def _report_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            try:
+                logger.info("Persistence stats", **(await self.stats_snapshot()))
+            except Exception:
+                logger.exception("Reading persistence stats failed")
+
+
+persistence_worker = PersistenceWorker()
@@ -24,6 +24,14 @@ class EventService(event_pb2_grpc.EventServiceServicer):
         await event_dispatcher.send_events_to_clients(events)
         return event_pb2.Ack(success=True, message="Delivered")
 
+    async def StreamEvents(self, request_iterator, context):
+        # Batches are handled in the order they were written, so acking each
+        # one's sequence also covers everything before it
+        async for request in request_iterator:
+            events = [EventCodec.to_pydantic(event) for event in request.events]
+            await event_dispatcher.send_events_to_clients(events)
+            yield event_pb2.StreamAck(sequence=request.sequence)
+
 
 async def serve_grpc_server(port: int):
     try:
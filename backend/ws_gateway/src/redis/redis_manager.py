@@ -2,10 +2,15 @@ import asyncio
 from typing import List, Optional
 
 import structlog
+from libs.event import event_pb2
+from libs.event.codec import EventCodec
 from libs.event.publisher import EventPublisher
 from libs.event.schema import Event
+from libs.recent_events import RecentEvents
 from libs.rediskeys import RediKeys
+from libs.routing import EndpointChange, EndpointOp
 from redis.asyncio import Redis
+from redis.exceptions import ResponseError
 from sqlalchemy import text
 from src.core.config import settings
 from src.database.config import AsyncSessionLocal
@@ -17,6 +22,7 @@ class RedisManager:
     def __init__(self):
         self.redis: Redis | None = None
         self.publisher: EventPublisher | None = None
+        self.recent_events = RecentEvents()
 
     async def connect(self, host: str, port: int, db: int):
         retries = 5
@@ -24,7 +30,9 @@ class RedisManager:
             try:
                 self.redis = Redis(host=host, port=port, db=db)
                 await self.redis.ping()
-                self.publisher = EventPublisher(self.redis, settings.NUM_SHARDS)
+                self.publisher = EventPublisher(
+                    self.redis, settings.NUM_SHARDS, self.recent_events
+                )
                 logger.info("Connected to Redis")
                 break
             except Exception as e:
@@ -47,13 +55,21 @@ class RedisManager:
     async def set_user_grpc_endpoint(
         self, user_id: str, grpc_endpoint: str, ttl: int = settings.DEFAULT_TTL_SECONDS
     ):
-        await self.redis.setex(RediKeys.user_grpc_endpoint(user_id), ttl, grpc_endpoint)
+        key = RediKeys.user_grpc_endpoint(user_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.setex(key, ttl, grpc_endpoint)
+        self._publish_endpoint_change(pipe, key, EndpointOp.SET, grpc_endpoint)
+        await pipe.execute()
 
     async def get_user_grpc_endpoint(self, user_id: str) -> Optional[str]:
         return await self.redis.get(RediKeys.user_grpc_endpoint(user_id))
 
     async def delete_user_grpc_endpoint(self, user_id: str):
-        await self.redis.delete(RediKeys.user_grpc_endpoint(user_id))
+        key = RediKeys.user_grpc_endpoint(user_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(key)
+        self._publish_endpoint_change(pipe, key, EndpointOp.DELETED)
+        await pipe.execute()
 
     async def add_grpc_endpoint_to_channel(
         self,
@@ -61,16 +77,34 @@ class RedisManager:
         grpc_endpoint: str,
     ):
         key = RediKeys.channel_grpc_endpoints(channel_id)
-        await self.redis.sadd(key, grpc_endpoint)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.sadd(key, grpc_endpoint)
+        self._publish_endpoint_change(pipe, key, EndpointOp.ADDED, grpc_endpoint)
+        await pipe.execute()
 
     async def remove_grpc_endpoint_from_channel(
         self, channel_id: str, grpc_endpoint: str
     ):
         key = RediKeys.channel_grpc_endpoints(channel_id)
-        await self.redis.srem(key, grpc_endpoint)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.srem(key, grpc_endpoint)
+        self._publish_endpoint_change(pipe, key, EndpointOp.REMOVED, grpc_endpoint)
+        await pipe.execute()
         if await self.redis.scard(key) == 0:
             await self.redis.delete(key)
 
+    @staticmethod
+    def _publish_endpoint_change(
+        pipe, key: str, op: EndpointOp, endpoint: str | None = None
+    ):
+        """
+        Tell the consumers' endpoint caches, in the same round trip as the
+        write. Without it a consumer keeps routing to (or ignoring) this
+        gateway until its cached entry expires.
+        """
+        change = EndpointChange(key=key, op=op, endpoint=endpoint)
+        pipe.publish(RediKeys.grpc_endpoint_changes(), change.model_dump_json())
+
     async def add_channel_to_user(self, user_id: str, channel_id: str):
         key = RediKeys.user_channels(user_id)
         await self.redis.sadd(key, str(channel_id))
@@ -118,6 +152,109 @@ class RedisManager:
     async def batch_push_events_to_streams(self, batch: List[Event]):
         await self.publisher.publish_many(batch)
 
+    async def queue_for_persistence(self, batch: List[Event]):
+        pipe = self.redis.pipeline(transaction=False)
+        for event in batch:
+            pipe.xadd(RediKeys.persistence_stream(), EventCodec.to_stream(event))
+        await pipe.execute()
+
+    async def ensure_persistence_group(self, group: str):
+        try:
+            await self.redis.xgroup_create(
+                name=RediKeys.persistence_stream(),
+                groupname=group,
+                id="0",
+                mkstream=True,
+            )
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def read_persistence_batch(
+        self, group: str, consumer: str, count: int, block_ms: int
+    ) -> list[tuple[bytes, dict]]:
+        response = await self.redis.xreadgroup(
+            groupname=group,
+            consumername=consumer,
+            streams={RediKeys.persistence_stream(): ">"},
+            count=count,
+            block=block_ms,
+        )
+        return response[0][1] if response else []
+
+    async def claim_stale_persistence(
+        self, group: str, consumer: str, min_idle_ms: int, count: int
+    ) -> list[tuple[bytes, dict]]:
+        """Entries another worker (or an earlier failed attempt) left unacked."""
+        _, entries, _ = await self.redis.xautoclaim(
+            RediKeys.persistence_stream(),
+            group,
+            consumer,
+            min_idle_time=min_idle_ms,
+            count=count,
+        )
+        return entries
+
+    async def ack_persisted(self, group: str, message_ids: List[bytes]):
+        # Persisted events have no other reader; deleting them keeps the
+        # stream as short as the backlog
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xack(RediKeys.persistence_stream(), group, *message_ids)
+        pipe.xdel(RediKeys.persistence_stream(), *message_ids)
+        await pipe.execute()
+
+    async def persistence_deliveries(
+        self, group: str, message_ids: List[bytes]
+    ) -> dict[bytes, int]:
+        """How many times each pending entry has been read or claimed."""
+        pipe = self.redis.pipeline(transaction=False)
+        for message_id in message_ids:
+            pipe.xpending_range(
+                RediKeys.persistence_stream(),
+                group,
+                min=message_id,
+                max=message_id,
+                count=1,
+            )
+        deliveries = {}
+        for message_id, pending in zip(message_ids, await pipe.execute()):
+            if pending:
+                deliveries[message_id] = pending[0]["times_delivered"]
+        return deliveries
+
+    async def dead_letter_persistence(
+        self, group: str, entries: List[tuple[bytes, dict]]
+    ):
+        """Move `(message_id, fields)` entries to the dead-letter stream, and
+        ack and delete them in the same transaction."""
+        stream = RediKeys.persistence_stream()
+        pipe = self.redis.pipeline(transaction=True)
+        for _, fields in entries:
+            pipe.xadd(
+                RediKeys.dead_letter_stream(stream),
+                fields,
+                maxlen=settings.PERSISTENCE_DEAD_LETTER_MAX_LEN,
+                approximate=True,
+            )
+        message_ids = [message_id for message_id, _ in entries]
+        pipe.xack(stream, group, *message_ids)
+        pipe.xdel(stream, *message_ids)
+        await pipe.execute()
+
+    async def persistence_backlog(self, group: str) -> int:
+        """Events queued for persistence and not yet written."""
+        for info in await self.redis.xinfo_groups(RediKeys.persistence_stream()):
+            name = info["name"]
+            if (name.decode() if isinstance(name, bytes) else name) == group:
+                return (info.get("lag") or 0) + (info.get("pending") or 0)
+        return 0
+
+    async def get_recent_events(
+        self, receiver_ids: List[str], since: str
+    ) -> List[event_pb2.Event]:
+        """Raises `libs.recent_events.ResyncRequired` when some may be gone."""
+        return await self.recent_events.since(self.redis, receiver_ids, since)
+
     async def query_user_channels_from_db(self, user_id: str) -> List[str]:
         async with AsyncSessionLocal() as session:
             sql = text(
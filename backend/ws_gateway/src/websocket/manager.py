@@ -1,10 +1,22 @@
+import asyncio
+from dataclasses import asdict
 from datetime import datetime, timezone
 
+import orjson
 import structlog
 from fastapi import WebSocket
+from libs.event.codec import EventCodec
+from libs.recent_events import ResyncRequired
 from src.auth.models import CurrentUser
+from src.core.config import settings
 from src.redis.redis_manager import RedisManager
 from src.websocket.mapping import UserMapping
+from src.websocket.sender import (
+    RESYNC_REQUIRED,
+    OverflowPolicy,
+    SendQueueStats,
+    SocketSender,
+)
 
 logger = structlog.get_logger()
 
@@ -16,13 +28,28 @@ class WebsocketManager:
     while a reconnect replaces a dying socket. Every one of them gets the
     user's events, and the user's routing (`user:{id}:grpc_endpoint`, the
     channel endpoint sets) is only torn down when the last one goes away.
+
+    Each socket is written by its own `SocketSender`, so events are delivered
+    by queueing them, and a client that falls behind only delays itself.
+
+    Fan-out reads the senders of a user or a channel as one prebuilt tuple.
+    A tuple is built on first use and dropped whenever a socket of one of its
+    users connects or closes, or that user's channels change; between such
+    changes, delivering an event allocates nothing per recipient.
     """
 
     def __init__(self):
-        self.clients: dict[str, set[WebSocket]] = {}
+        self.clients: dict[str, dict[WebSocket, SocketSender]] = {}
         self.grpc_endpoint: str | None = None
         self.redis_manager: RedisManager | None = None
         self.user_mapping: UserMapping = UserMapping()
+        self.user_senders: dict[str, tuple[SocketSender, ...]] = {}
+        self.channel_senders: dict[str, tuple[SocketSender, ...]] = {}
+        self.send_queue_size = settings.SEND_QUEUE_MAX_SIZE
+        self.overflow_policy = OverflowPolicy(settings.SEND_QUEUE_OVERFLOW_POLICY)
+        self.send_stats = SendQueueStats()
+        self.stats_interval = 60
+        self.stats_task: asyncio.Task | None = None
 
     def set_grpc_endpoint(self, grpc_endpoint: str):
         """
@@ -38,14 +65,29 @@ class WebsocketManager:
         self.redis_manager = redis_manager
         logger.info("Redis manager set")
 
+    def start(self):
+        self.stats_task = asyncio.create_task(self._report_stats())
+
+    async def stop(self):
+        if self.stats_task:
+            self.stats_task.cancel()
+        for senders in self.clients.values():
+            for sender in senders.values():
+                await sender.stop()
+
     async def add_client(self, current_user: CurrentUser, websocket: WebSocket):
         """
         Add a client to the service - set the user's gRPC endpoint, then add this endpoint to the user's channels
         """
         await websocket.accept()
 
-        sockets = self.clients.setdefault(current_user.id, set())
-        sockets.add(websocket)
+        sockets = self.clients.setdefault(current_user.id, {})
+        sender = SocketSender(
+            websocket, self.send_queue_size, self.overflow_policy, self.send_stats
+        )
+        sender.start()
+        sockets[websocket] = sender
+        self._drop_senders(current_user.id)
 
         expiration = datetime.fromtimestamp(current_user.exp, tz=timezone.utc)
         ttl_seconds = int((expiration - datetime.now(timezone.utc)).total_seconds())
@@ -57,6 +99,7 @@ class WebsocketManager:
 
         for channel_id in channel_ids:
             self.user_mapping.add_mapping(current_user.id, channel_id)
+            self.channel_senders.pop(channel_id, None)
             await self.redis_manager.add_grpc_endpoint_to_channel(
                 channel_id, self.grpc_endpoint
             )
@@ -66,6 +109,38 @@ class WebsocketManager:
         )
         logger.info(f"Client channel IDs: {channel_ids}")
 
+    async def replay_missed_events(
+        self, user_id: str, websocket: WebSocket, since: str
+    ):
+        """
+        Send a reconnecting client what it missed since the event it last saw.
+
+        `since` is that event's timestamp, less a few seconds: events are
+        stamped by different hosts and arrive out of order, so one stamped
+        earlier may not have arrived yet. The user's and their channels'
+        recent-event buffers are read from it on; if they may have lost some of
+        what came after, the client gets a `resync_required` frame instead.
+        Events the client already has, and any delivered meanwhile on the live
+        socket, arrive twice; clients tell them apart by `event_id`.
+        """
+        sender = self.clients.get(user_id, {}).get(websocket)
+        if sender is None:
+            return
+        receiver_ids = [user_id, *self.user_mapping.get_user_channel_ids(user_id)]
+        try:
+            events = await self.redis_manager.get_recent_events(receiver_ids, since)
+        except (ResyncRequired, ValueError):
+            # ValueError: not a timestamp
+            logger.info(f"Resync required for {user_id}", since=since)
+            sender.enqueue(
+                orjson.dumps({"type": RESYNC_REQUIRED, "since": since}).decode()
+            )
+            return
+
+        for event in events:
+            sender.enqueue(EventCodec.to_pydantic(event).model_dump_json())
+        logger.info(f"Replayed {len(events)} events to {user_id}", since=since)
+
     async def refresh_user_channels(self, user_id: str):
         """
         Re-read a connected user's channel membership.
@@ -87,12 +162,14 @@ class WebsocketManager:
             if channel_id in known_channel_ids:
                 continue
             self.user_mapping.add_mapping(user_id, channel_id)
+            self.channel_senders.pop(channel_id, None)
             await self.redis_manager.add_grpc_endpoint_to_channel(
                 channel_id, self.grpc_endpoint
             )
 
         removed_channel_ids = known_channel_ids - set(channel_ids)
         for channel_id in removed_channel_ids:
+            self.channel_senders.pop(channel_id, None)
             if self.user_mapping.remove_mapping(user_id, channel_id):
                 await self.redis_manager.remove_grpc_endpoint_from_channel(
                     channel_id, self.grpc_endpoint
@@ -113,10 +190,15 @@ class WebsocketManager:
             return
 
         if websocket is not None:
-            sockets.discard(websocket)
+            closed = [sockets.pop(websocket)] if websocket in sockets else []
         else:
             # No socket named: the caller is dropping the client entirely
+            closed = list(sockets.values())
             sockets.clear()
+        # Before anything awaits, so no event is queued on a stopped sender
+        self._drop_senders(client_id)
+        for sender in closed:
+            await sender.stop()
 
         if sockets:
             logger.info(
@@ -133,11 +215,59 @@ class WebsocketManager:
         await self.redis_manager.delete_user_grpc_endpoint(client_id)
         logger.info(f"Client {client_id} disconnected")
 
-    def get_client_sockets(self, client_id: str) -> list[WebSocket]:
+    def get_client_senders(self, client_id: str) -> tuple[SocketSender, ...]:
+        """
+        The senders of every socket this client holds on this instance; empty
+        if none.
+        """
+        senders = self.user_senders.get(client_id)
+        if senders is None:
+            sockets = self.clients.get(client_id)
+            if not sockets:
+                return ()
+            senders = self.user_senders[client_id] = tuple(sockets.values())
+        return senders
+
+    def get_channel_senders(self, channel_id: str) -> tuple[SocketSender, ...]:
         """
-        Every socket this client holds on this instance; empty if none.
+        The senders of every socket on this instance whose user is in the
+        channel; empty if none.
         """
-        return list(self.clients.get(client_id, ()))
+        senders = self.channel_senders.get(channel_id)
+        if senders is None:
+            user_ids = self.user_mapping.channel_id_to_user_ids.get(channel_id)
+            if not user_ids:
+                return ()
+            senders = self.channel_senders[channel_id] = tuple(
+                sender
+                for user_id in user_ids
+                for sender in self.clients.get(user_id, {}).values()
+            )
+        return senders
+
+    def _drop_senders(self, user_id: str):
+        """Forget the prebuilt senders a user's sockets are part of."""
+        self.user_senders.pop(user_id, None)
+        for channel_id in self.user_mapping.get_user_channel_ids(user_id):
+            self.channel_senders.pop(channel_id, None)
+
+    def send_stats_snapshot(self) -> dict[str, int]:
+        depths = [
+            sender.depth
+            for senders in self.clients.values()
+            for sender in senders.values()
+        ]
+        return {
+            **asdict(self.send_stats),
+            "sockets": len(depths),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+        }
+
+    async def _report_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            logger.info("Send queue stats", **self.send_stats_snapshot())
 
 
 websocket_manager = WebsocketManager()
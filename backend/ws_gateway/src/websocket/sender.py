@@ -0,0 +1,130 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+
+import orjson
+import structlog
+from fastapi import WebSocket
+
+logger = structlog.get_logger()
+
+# Sent when the client must refetch its state over REST: a replay could not
+# cover what it missed, or its send queue overflowed under the coalesce policy.
+# A control frame, not an event: keyed `type`, so it never reaches the
+# client's event handlers.
+RESYNC_REQUIRED = "resync_required"
+_RESYNC_FRAME = orjson.dumps({"type": RESYNC_REQUIRED}).decode()
+
+# Close code for a client evicted for falling behind; it may reconnect and
+# catch up from its last event
+SLOW_CONSUMER_CLOSE_CODE = 1013  # Try Again Later
+
+
+class OverflowPolicy(str, Enum):
+    """What a full send queue does with the next frame."""
+
+    # Drop the oldest queued frame to make room
+    DROP_OLDEST = "drop_oldest"
+    # Replace everything queued with one resync_required frame
+    COALESCE = "coalesce"
+    # Close the socket; the client reconnects and replays what it missed
+    DISCONNECT = "disconnect"
+
+
+@dataclass
+class SendQueueStats:
+    """Cumulative counters over every socket on this instance."""
+
+    sent: int = 0
+    # Frames dropped by DROP_OLDEST or COALESCE
+    dropped: int = 0
+    coalesced: int = 0
+    evicted: int = 0
+    send_failures: int = 0
+
+
+class SocketSender:
+    """
+    One socket's bounded outbound queue and the task writing it out.
+
+    Delivery only appends to the queue, so a slow or stalled browser holds up
+    nobody but itself. When the queue is full, `policy` decides what gives.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_size: int,
+        policy: OverflowPolicy,
+        stats: SendQueueStats,
+    ):
+        self.websocket = websocket
+        self.max_size = max_size
+        self.policy = policy
+        self.stats = stats
+        self.queue: deque[str] = deque()
+        self.ready = asyncio.Event()
+        self.evicted = False
+        self.task: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        return len(self.queue)
+
+    def start(self):
+        self.task = asyncio.create_task(self._write_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.queue.clear()
+
+    def enqueue(self, text: str):
+        if self.evicted:
+            return
+        if len(self.queue) >= self.max_size:
+            if self.policy == OverflowPolicy.DISCONNECT:
+                self.evicted = True
+                self.stats.evicted += 1
+                self.queue.clear()
+                self.ready.set()
+                return
+            if self.policy == OverflowPolicy.COALESCE:
+                # A resync still queued from last time covers this one too
+                resyncing = self.queue[0] is _RESYNC_FRAME
+                self.stats.dropped += len(self.queue) - resyncing
+                self.stats.coalesced += 1
+                self.queue.clear()
+                self.queue.append(_RESYNC_FRAME)
+            else:
+                self.queue.popleft()
+                self.stats.dropped += 1
+        self.queue.append(text)
+        self.ready.set()
+
+    async def _write_loop(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            if self.evicted:
+                logger.warning("Evicting slow client", queue_size=self.max_size)
+                try:
+                    await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+                except Exception:
+                    pass
+                return
+            while self.queue and not self.evicted:
+                text = self.queue.popleft()
+                try:
+                    await self.websocket.send_text(text)
+                except Exception:
+                    # Gone; the receive loop sees the disconnect and removes us
+                    self.stats.send_failures += 1
+                    self.queue.clear()
+                    return
+                self.stats.sent += 1
@@ -0,0 +1,27 @@
+"""Placeholder settings for tests that import modules reading `src.core.config`.
+
+Import it before anything from `src`. Values already in the environment win;
+nothing here is ever connected to.
+"""
+
+import os
+
+for name, value in {
+    "REDIS_HOST": "localhost",
+    "REDIS_PORT": "6379",
+    "REDIS_DB": "0",
+    "DEFAULT_TTL_SECONDS": "3600",
+    "NUM_SHARDS": "2",
+    "BATCH_SIZE": "100",
+    "BATCH_INTERVAL_MS": "50",
+    "POSTGRES_USER": "test",
+    "POSTGRES_PASSWORD": "test",
+    "POSTGRES_DB": "test",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5432",
+    "GRPC_HOST": "localhost",
+    "GRPC_PORT": "50051",
+    "SECRET_KEY": "test",
+    "ALGORITHM": "HS256",
+}.items():
+    os.environ.setdefault(name, value)
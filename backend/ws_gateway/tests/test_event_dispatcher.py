@@ -0,0 +1,102 @@
+"""Persisting a batch in sync mode: a bad event is split out of its batch, and
+the rest is still committed and published.
+
+Same stdlib `unittest` setup as test_event_queue.py. Postgres is replaced by
+a `persist_batch` that fails any batch holding a bad event.
+"""
+
+import asyncio
+import sys
+import unittest
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import settings_env  # noqa: E402, F401
+from libs.event.schema import Event, EventType  # noqa: E402
+from src.event.event_dispatcher import EventDispatcher  # noqa: E402
+
+
+class FakeRedisManager:
+    def __init__(self):
+        self.published = []
+
+    async def batch_push_events_to_streams(self, batch):
+        self.published.append([event.text for event in batch])
+
+
+class FakeEventDispatcher(EventDispatcher):
+    def __init__(self, bad_texts=(), down=False):
+        super().__init__()
+        self.bad_texts = set(bad_texts)
+        self.down = down
+        self.batches = []
+        self.redis_manager = FakeRedisManager()
+
+    async def persist_batch(self, batch) -> bool:
+        texts = [e.text for events in batch.values() for e in events]
+        self.batches.append(texts)
+        return not self.down and not self.bad_texts.intersection(texts)
+
+    async def _database_reachable(self) -> bool:
+        return not self.down
+
+
+def make_events(*texts: str) -> list[Event]:
+    return [
+        Event(
+            event_type=EventType.MESSAGE,
+            sender_id=str(uuid.uuid4()),
+            receiver_id=str(uuid.uuid4()),
+            text=text,
+        )
+        for text in texts
+    ]
+
+
+def texts(events) -> list[str]:
+    return [event.text for event in events]
+
+
+class PersistEventsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_a_batch_that_writes_is_written_once(self):
+        dispatcher = FakeEventDispatcher()
+        self.assertEqual(await dispatcher.persist_events(make_events("a", "b")), [])
+        self.assertEqual(dispatcher.batches, [["a", "b"]])
+
+    async def test_only_the_bad_events_fail(self):
+        dispatcher = FakeEventDispatcher(bad_texts={"bad 1", "bad 2"})
+        events = make_events("a", "bad 1", "b", "c", "d", "bad 2", "e")
+        failed = await dispatcher.persist_events(events)
+
+        self.assertEqual(texts(failed), ["bad 1", "bad 2"])
+        written = [batch for batch in dispatcher.batches if "bad 1" not in batch]
+        written = {text for batch in written if "bad 2" not in batch for text in batch}
+        self.assertEqual(written, {"a", "b", "c", "d", "e"})
+
+    async def test_nothing_is_split_while_the_database_is_down(self):
+        dispatcher = FakeEventDispatcher(down=True)
+        failed = await dispatcher.persist_events(make_events("a", "b", "c"))
+        self.assertEqual(texts(failed), ["a", "b", "c"])
+        self.assertEqual(len(dispatcher.batches), 1)
+
+
+class DispatchEventsTest(unittest.IsolatedAsyncioTestCase):
+    async def dispatch(self, dispatcher, events):
+        await dispatcher.dispatch_events({EventType.MESSAGE: events})
+        await asyncio.sleep(0)
+        return dispatcher.redis_manager.published
+
+    async def test_the_rest_of_the_batch_is_published(self):
+        dispatcher = FakeEventDispatcher(bad_texts={"bad"})
+        published = await self.dispatch(dispatcher, make_events("a", "bad", "b"))
+        self.assertEqual(published, [["a", "b"]])
+
+    async def test_nothing_is_published_without_a_commit(self):
+        dispatcher = FakeEventDispatcher(down=True)
+        self.assertEqual(await self.dispatch(dispatcher, make_events("a", "b")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
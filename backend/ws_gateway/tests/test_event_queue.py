@@ -0,0 +1,134 @@
+"""When EventQueue flushes a batch, and how it holds producers back.
+
+Same stdlib `unittest` setup as test_recent_events.py; placeholder settings
+come from settings_env.py.
+"""
+
+import asyncio
+import sys
+import unittest
+import uuid
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import settings_env  # noqa: E402, F401
+from libs.event.schema import Event, EventType  # noqa: E402
+from src.core.config import settings  # noqa: E402
+from src.event.event_queue import EventQueue  # noqa: E402
+
+
+class FakeDispatcher:
+    """Records every batch; holds each flush until `release` is set."""
+
+    def __init__(self):
+        self.batches = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def dispatch_events(self, batch):
+        self.batches.append(batch)
+        await self.release.wait()
+
+
+def make_event(text: str) -> Event:
+    return Event(
+        event_type=EventType.MESSAGE,
+        sender_id=str(uuid.uuid4()),
+        receiver_id=str(uuid.uuid4()),
+        text=text,
+    )
+
+
+def texts(batch) -> list[str]:
+    return [event.text for events in batch.values() for event in events]
+
+
+class EventQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def make_queue(self, batch_size, interval_ms, max_size=10000):
+        for name, value in (
+            ("BATCH_SIZE", batch_size),
+            ("BATCH_INTERVAL_MS", interval_ms),
+        ):
+            patcher = mock.patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        queue = EventQueue()
+        queue.max_size = max_size
+        self.dispatcher = FakeDispatcher()
+        queue.set_event_dispatcher(self.dispatcher)
+        await queue.start_batch_processor()
+        self.addAsyncCleanup(queue.stop_batch_processor)
+        return queue
+
+    async def test_a_full_batch_is_flushed_at_once(self):
+        queue = await self.make_queue(batch_size=3, interval_ms=60_000)
+        for text in ("a", "b", "c"):
+            await queue.enqueue_event(make_event(text))
+        await asyncio.sleep(0.01)
+        await queue.enqueue_event(make_event("d"))
+        await asyncio.sleep(0.01)
+
+        self.assertEqual([texts(b) for b in self.dispatcher.batches], [["a", "b", "c"]])
+        self.assertEqual(queue.batch_size, 1, "d waits for the next batch")
+
+    async def test_a_partial_batch_is_flushed_at_the_deadline(self):
+        queue = await self.make_queue(batch_size=100, interval_ms=50)
+        await queue.enqueue_event(make_event("a"))
+        await queue.enqueue_event(make_event("b"))
+
+        await asyncio.sleep(0.02)
+        self.assertEqual(self.dispatcher.batches, [], "before the deadline")
+        await asyncio.sleep(0.06)
+        self.assertEqual([texts(b) for b in self.dispatcher.batches], [["a", "b"]])
+
+    async def test_events_queued_during_a_slow_flush_keep_their_deadline(self):
+        queue = await self.make_queue(batch_size=100, interval_ms=50)
+        self.dispatcher.release.clear()
+        await queue.enqueue_event(make_event("a"))
+        await asyncio.sleep(0.06)
+        self.assertEqual(len(self.dispatcher.batches), 1, "a is flushing")
+
+        # b waits out the flush, then only what is left of its own interval
+        await queue.enqueue_event(make_event("b"))
+        await asyncio.sleep(0.04)
+        self.dispatcher.release.set()
+        await asyncio.sleep(0.03)
+        self.assertEqual([texts(b) for b in self.dispatcher.batches], [["a"], ["b"]])
+
+    async def test_an_idle_queue_flushes_nothing(self):
+        await self.make_queue(batch_size=100, interval_ms=10)
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.dispatcher.batches, [])
+
+    async def test_a_full_queue_holds_producers_until_a_flush(self):
+        queue = await self.make_queue(batch_size=2, interval_ms=60_000, max_size=3)
+        self.dispatcher.release.clear()  # every flush stalls
+
+        await queue.enqueue_event(make_event("a"))
+        await queue.enqueue_event(make_event("b"))
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(self.dispatcher.batches), 1, "a and b are flushing")
+
+        # The next batch fills up to max_size while the flush is stuck
+        for text in ("c", "d", "e"):
+            await queue.enqueue_event(make_event(text))
+        blocked = asyncio.create_task(queue.enqueue_event(make_event("f")))
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked.done(), "past max_size the producer waits")
+        self.assertEqual(queue.batch_size, 3)
+
+        self.dispatcher.release.set()
+        await asyncio.wait_for(blocked, timeout=1)
+        await asyncio.sleep(0.01)
+        self.assertEqual(
+            [texts(b) for b in self.dispatcher.batches],
+            [["a", "b"], ["c", "d", "e"]],
+        )
+        self.assertEqual(queue.batch_size, 1, "f made it into the next batch")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+"""The COPY path of MessageEventDispatcher, against a real Postgres.
+
+Skipped unless TEST_WITH_POSTGRES=1, in which case it connects with the
+gateway's own POSTGRES_* settings (the compose database, see the README).
+Every test runs in one transaction that is rolled back, so nothing it writes
+is kept; missing tables are created first, for a scratch database.
+"""
+
+import os
+import sys
+import unittest
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import settings_env  # noqa: E402, F401
+from libs.db import (  # noqa: E402
+    Base,
+    Channel,
+    ChannelType,
+    Message,
+    User,
+    create_engine,
+    create_session_factory,
+)
+from libs.event.schema import Event, EventType  # noqa: E402
+from sqlalchemy import func, select, text  # noqa: E402
+from sqlalchemy.exc import IntegrityError  # noqa: E402
+from src.core.config import settings  # noqa: E402
+from src.message.dispatcher import MessageEventDispatcher  # noqa: E402
+
+NOW = datetime.now(timezone.utc)
+
+
+@unittest.skipUnless(
+    os.getenv("TEST_WITH_POSTGRES") == "1", "needs Postgres (TEST_WITH_POSTGRES=1)"
+)
+class MessageCopyTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_engine(settings.ASYNC_DB_URL)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session = create_session_factory(self.engine)()
+
+        self.sender_id, self.channel_id = str(uuid.uuid4()), str(uuid.uuid4())
+        self.session.add(
+            User(
+                id=self.sender_id,
+                username=f"test-{self.sender_id}",
+                email=f"{self.sender_id}@test.invalid",
+                password_hash="",
+            )
+        )
+        self.session.add(Channel(id=self.channel_id, type=ChannelType.DM))
+        await self.session.flush()
+
+        self.dispatcher = MessageEventDispatcher()
+        self.dispatcher.copy_threshold = 0
+
+    async def asyncTearDown(self):
+        await self.session.rollback()
+        await self.session.close()
+        await self.engine.dispose()
+
+    def make_events(self, *texts: str, channel_id: str | None = None) -> list[Event]:
+        return [
+            Event(
+                event_type=EventType.MESSAGE,
+                sender_id=self.sender_id,
+                receiver_id=channel_id or self.channel_id,
+                text=text,
+                timestamp=(NOW - timedelta(minutes=i)).isoformat(),
+            )
+            for i, text in enumerate(texts)
+        ]
+
+    async def messages(self) -> dict[str, tuple[str, datetime]]:
+        result = await self.session.execute(
+            select(Message.id, Message.content, Message.created_at).where(
+                Message.channel_id == self.channel_id
+            )
+        )
+        return {str(id): (content, created_at) for id, content, created_at in result}
+
+    async def staged(self) -> int:
+        result = await self.session.execute(
+            select(func.count()).select_from(text("messages_staging"))
+        )
+        return result.scalar_one()
+
+    async def test_copies_every_message_as_sent(self):
+        events = self.make_events("a", "b", "c")
+        await self.dispatcher.dispatch_events(self.session, events)
+
+        self.assertEqual(
+            await self.messages(),
+            {e.event_id: (e.text, datetime.fromisoformat(e.timestamp)) for e in events},
+        )
+        self.assertEqual(await self.staged(), 0)
+
+    async def test_a_message_already_there_is_skipped(self):
+        first, second = self.make_events("a", "b")
+        self.dispatcher.copy_threshold = float("inf")
+        await self.dispatcher.dispatch_events(self.session, [first])
+        self.dispatcher.copy_threshold = 0
+
+        rewritten = first.model_copy(update={"text": "changed"})
+        await self.dispatcher.dispatch_events(self.session, [rewritten, second, second])
+
+        messages = await self.messages()
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[first.event_id][0], "a")
+
+    async def test_each_batch_in_a_transaction_starts_from_an_empty_staging_table(
+        self,
+    ):
+        for texts in (("a", "b"), ("c",)):
+            await self.dispatcher.dispatch_events(
+                self.session, self.make_events(*texts)
+            )
+            self.assertEqual(await self.staged(), 0)
+        self.assertEqual(len(await self.messages()), 3)
+
+    async def test_a_message_to_an_unknown_channel_fails_the_batch(self):
+        events = self.make_events("a") + self.make_events(
+            "b", channel_id=str(uuid.uuid4())
+        )
+        with self.assertRaises(IntegrityError):
+            await self.dispatcher.dispatch_events(self.session, events)
+
+
+if __name__ == "__main__":
+    unittest.main()
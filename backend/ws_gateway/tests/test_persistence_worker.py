@@ -0,0 +1,272 @@
+"""Async persistence: events queued on the persistence stream are written,
+then acked and deleted; a failed write or a departed gateway leaves them to be
+claimed again, and an event that never writes ends up dead-lettered.
+
+Same stdlib `unittest` setup as test_event_queue.py. The worker runs against
+the real RedisManager, with Redis replaced by one stream and one consumer
+group kept in memory.
+"""
+
+import asyncio
+import sys
+import unittest
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import settings_env  # noqa: E402, F401
+from libs.event.schema import Event, EventType  # noqa: E402
+from libs.rediskeys import RediKeys  # noqa: E402
+from src.core.config import settings  # noqa: E402
+from src.event.event_dispatcher import EventDispatcher  # noqa: E402
+from src.event.persistence_worker import PersistenceWorker  # noqa: E402
+from src.redis.redis_manager import RedisManager  # noqa: E402
+
+STREAM = RediKeys.persistence_stream()
+DEAD_LETTER_STREAM = RediKeys.dead_letter_stream(STREAM)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def xadd(self, name, fields, **kwargs):
+        self.calls.append(lambda: self.redis.xadd(name, fields))
+
+    def xack(self, name, groupname, *ids):
+        self.calls.append(lambda: self.redis.xack(name, groupname, *ids))
+
+    def xdel(self, name, *ids):
+        self.calls.append(lambda: self.redis.xdel(name, *ids))
+
+    def xpending_range(self, name, groupname, **kwargs):
+        self.calls.append(lambda: self.redis.xpending_range(name, groupname, **kwargs))
+
+    async def execute(self):
+        return [call() for call in self.calls]
+
+
+class FakeStreamRedis:
+    """One stream, one group: entries, a delivery cursor and a PEL. Whatever
+    is added to the dead-letter stream is kept in `dead_letters`."""
+
+    def __init__(self):
+        self.entries: dict[bytes, dict] = {}
+        self.delivered: list[bytes] = []
+        # Message id -> (consumer, when it was last delivered in ms)
+        self.pending: dict[bytes, tuple[str, int]] = {}
+        self.deliveries: dict[bytes, int] = {}
+        self.dead_letters: list[dict] = []
+        self.now_ms = 1_000_000
+        self.acked: list[bytes] = []
+        self.next_seq = 0
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+    def xadd(self, name, fields, **kwargs):
+        if name == DEAD_LETTER_STREAM:
+            self.dead_letters.append(fields)
+            return
+        message_id = f"{self.now_ms}-{self.next_seq}".encode()
+        self.next_seq += 1
+        self.entries[message_id] = {
+            (k.encode() if isinstance(k, str) else k): (
+                v.encode() if isinstance(v, str) else v
+            )
+            for k, v in fields.items()
+        }
+        return message_id
+
+    def xack(self, name, groupname, *ids):
+        for message_id in ids:
+            if self.pending.pop(message_id, None):
+                self.acked.append(message_id)
+
+    def xdel(self, name, *ids):
+        for message_id in ids:
+            self.entries.pop(message_id, None)
+
+    async def xreadgroup(self, groupname, consumername, streams, count, block):
+        new = [m for m in self.entries if m not in self.delivered][:count]
+        if not new:
+            await asyncio.sleep(block / 1000)
+            return []
+        for message_id in new:
+            self.delivered.append(message_id)
+            self.pending[message_id] = (consumername, self.now_ms)
+            self.deliveries[message_id] = 1
+        return [(STREAM.encode(), [(m, self.entries[m]) for m in new])]
+
+    async def xautoclaim(self, name, groupname, consumername, min_idle_time, count):
+        claimed = []
+        for message_id, (_, delivered_at) in list(self.pending.items()):
+            if len(claimed) == count:
+                break
+            if self.now_ms - delivered_at >= min_idle_time:
+                self.pending[message_id] = (consumername, self.now_ms)
+                self.deliveries[message_id] += 1
+                claimed.append((message_id, self.entries[message_id]))
+        return b"0-0", claimed, []
+
+    def xpending_range(self, name, groupname, min, max, count):
+        if min not in self.pending:
+            return []
+        return [{"message_id": min, "times_delivered": self.deliveries[min]}]
+
+
+class FakeEventDispatcher(EventDispatcher):
+    """Writes nothing: a batch fails if it holds a bad event, or if the
+    database is down."""
+
+    def __init__(self):
+        super().__init__()
+        self.bad_texts: set[str] = set()
+        self.down = False
+        self.batches = []
+
+    async def persist_batch(self, batch) -> bool:
+        texts = [e.text for events in batch.values() for e in events]
+        self.batches.append(texts)
+        return not self.down and not self.bad_texts.intersection(texts)
+
+    async def _database_reachable(self) -> bool:
+        return not self.down
+
+
+def make_event(text: str) -> Event:
+    return Event(
+        event_type=EventType.MESSAGE,
+        sender_id=str(uuid.uuid4()),
+        receiver_id=str(uuid.uuid4()),
+        text=text,
+    )
+
+
+class PersistenceWorkerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = FakeStreamRedis()
+        self.redis_manager = RedisManager()
+        self.redis_manager.redis = self.redis
+        self.dispatcher = FakeEventDispatcher()
+
+        self.worker = PersistenceWorker()
+        self.worker.consumer_id = "gateway-a:50051"
+        self.worker.block_ms = 5
+        # Only the tests that want a claim pass get one
+        self.worker.claim_interval = 3600
+        self.worker.set_redis_manager(self.redis_manager)
+        self.worker.set_event_dispatcher(self.dispatcher)
+
+    async def queue(self, *texts: str):
+        await self.redis_manager.queue_for_persistence(
+            [make_event(text) for text in texts]
+        )
+
+    async def run_worker(self):
+        task = asyncio.create_task(self.worker._run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def test_a_written_batch_is_acked_and_deleted(self):
+        await self.queue("a", "b")
+        await self.run_worker()
+
+        self.assertEqual(self.dispatcher.batches, [["a", "b"]])
+        self.assertEqual(len(self.redis.acked), 2)
+        self.assertEqual(self.redis.pending, {})
+        self.assertEqual(self.redis.entries, {}, "deleted once persisted")
+        self.assertEqual(self.worker.stats.persisted, 2)
+        self.assertEqual(self.worker.stats.batches, 1)
+
+    async def test_a_failed_write_leaves_the_batch_pending(self):
+        self.dispatcher.down = True
+        await self.queue("a", "b")
+        await self.run_worker()
+
+        self.assertEqual(self.dispatcher.batches, [["a", "b"]], "not split")
+        self.assertEqual(self.redis.acked, [])
+        self.assertEqual(len(self.redis.pending), 2)
+        self.assertEqual(len(self.redis.entries), 2)
+        self.assertEqual(self.worker.stats.failed_batches, 1)
+        self.assertEqual(self.worker.stats.persisted, 0)
+
+        # Claimed again once idle long enough, and written this time
+        self.dispatcher.down = False
+        self.redis.now_ms += self.worker.claim_after_ms
+        self.worker.claim_interval = 0
+        await self.run_worker()
+
+        self.assertEqual(self.dispatcher.batches[-1], ["a", "b"])
+        self.assertEqual(self.redis.pending, {})
+        self.assertEqual(self.redis.entries, {})
+        self.assertEqual(self.worker.stats.claimed, 2)
+
+    async def test_entries_a_departed_gateway_read_are_claimed(self):
+        await self.queue("orphan")
+        # Read by a gateway that died before writing them
+        await self.redis.xreadgroup(
+            PersistenceWorker.GROUP, "gateway-b:50051", {STREAM: ">"}, 10, 0
+        )
+        self.worker.claim_interval = 0
+
+        await self.run_worker()
+        self.assertEqual(self.dispatcher.batches, [], "not idle long enough yet")
+
+        self.redis.now_ms += self.worker.claim_after_ms
+        await self.run_worker()
+        self.assertEqual(self.dispatcher.batches, [["orphan"]])
+        self.assertEqual(self.redis.pending, {})
+        self.assertEqual(self.worker.stats.claimed, 1)
+
+    async def test_an_undecodable_entry_is_dropped_with_the_batch(self):
+        await self.queue("a")
+        self.redis.xadd(STREAM, {"v": "99", "event": b""})
+        await self.run_worker()
+
+        self.assertEqual(self.dispatcher.batches, [["a"]])
+        self.assertEqual(self.redis.entries, {})
+        self.assertEqual(self.worker.stats.dropped, 1)
+        self.assertEqual(self.worker.stats.persisted, 1)
+
+    async def test_a_bad_event_does_not_hold_back_its_batch(self):
+        self.dispatcher.bad_texts.add("bad")
+        await self.queue("a", "bad", "b", "c")
+        await self.run_worker()
+
+        self.assertEqual(self.dispatcher.batches[0], ["a", "bad", "b", "c"])
+        self.assertEqual(len(self.redis.acked), 3)
+        self.assertEqual(len(self.redis.pending), 1, "only the bad one is left")
+        self.assertEqual(len(self.redis.entries), 1)
+        self.assertEqual(self.worker.stats.persisted, 3)
+        self.assertEqual(self.worker.stats.failed_batches, 1)
+        self.assertEqual(self.redis.dead_letters, [])
+
+    async def test_an_event_that_never_writes_is_dead_lettered(self):
+        self.dispatcher.bad_texts.add("bad")
+        await self.queue("a", "bad")
+        self.worker.claim_interval = 0
+
+        for _ in range(settings.PERSISTENCE_MAX_DELIVERIES):
+            self.assertEqual(self.redis.dead_letters, [])
+            await self.run_worker()
+            self.redis.now_ms += self.worker.claim_after_ms
+
+        self.assertEqual(self.redis.pending, {})
+        self.assertEqual(self.redis.entries, {})
+        self.assertEqual(self.worker.stats.dead_lettered, 1)
+        [dead_letter] = self.redis.dead_letters
+        self.assertEqual(
+            dead_letter["dlq_deliveries"], settings.PERSISTENCE_MAX_DELIVERIES
+        )
+        self.assertIn(dead_letter["dlq_message_id"], self.redis.acked)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+"""What a reconnecting client is replayed, or told to resync, from the
+recent-event buffers (libs.recent_events).
+
+Stdlib `unittest`, like event_consumer's tests. Redis is replaced by an
+in-memory sorted set that understands the calls RecentEvents makes.
+"""
+
+import sys
+import unittest
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from libs.event.codec import EventCodec  # noqa: E402
+from libs.event.schema import Event, EventType  # noqa: E402
+from libs.rediskeys import RediKeys  # noqa: E402
+from libs.recent_events import (  # noqa: E402
+    RECENT_EVENTS_MAX_LEN,
+    RECENT_EVENTS_RETENTION,
+    RecentEvents,
+    ResyncRequired,
+)
+
+
+def parse_score(bound) -> tuple[float, bool]:
+    """A ZRANGEBYSCORE bound as (score, exclusive)."""
+    bound = str(bound)
+    exclusive = bound.startswith("(")
+    return float(bound.lstrip("(")), exclusive
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((getattr(self.redis, name), args, kwargs))
+
+        return queue
+
+    async def execute(self):
+        return [method(*args, **kwargs) for method, args, kwargs in self.calls]
+
+
+class FakeRedis:
+    """Sorted sets as dicts of member -> score."""
+
+    def __init__(self):
+        self.sets: dict[str, dict[bytes, float]] = {}
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+    def ordered(self, key):
+        entries = self.sets.get(key, {})
+        return sorted(entries.items(), key=lambda entry: (entry[1], entry[0]))
+
+    def zadd(self, key, mapping):
+        self.sets.setdefault(key, {}).update(mapping)
+
+    def zremrangebyscore(self, key, min, max):
+        low, _ = parse_score(min)
+        high, exclusive = parse_score(max)
+        for member, score in self.ordered(key):
+            if low <= score and (score < high if exclusive else score <= high):
+                del self.sets[key][member]
+
+    def rank_range(self, key, start, end):
+        entries = self.ordered(key)
+        end = len(entries) + end if end < 0 else end
+        return entries[start : end + 1] if end >= 0 else []
+
+    def zremrangebyrank(self, key, start, end):
+        for member, _ in self.rank_range(key, start, end):
+            del self.sets[key][member]
+
+    def expire(self, key, seconds):
+        pass
+
+    def zcard(self, key):
+        return len(self.sets.get(key, {}))
+
+    def zrange(self, key, start, end, withscores=False):
+        return self.rank_range(key, start, end)
+
+    def zrangebyscore(self, key, min, max, withscores=False):
+        low, exclusive = parse_score(min)
+        high, _ = parse_score(max)
+        return [
+            (member, score)
+            for member, score in self.ordered(key)
+            if (score > low if exclusive else score >= low) and score <= high
+        ]
+
+
+CHANNEL_ID = str(uuid.uuid4())
+USER_ID = str(uuid.uuid4())
+SENDER_ID = str(uuid.uuid4())
+
+
+NOW = datetime.now(timezone.utc)
+
+
+def timestamp(seconds_ago: float) -> str:
+    return (NOW - timedelta(seconds=seconds_ago)).isoformat()
+
+
+def make_event(receiver_id: str, text: str, at: str) -> Event:
+    return Event(
+        event_type=EventType.MESSAGE,
+        sender_id=SENDER_ID,
+        receiver_id=receiver_id,
+        text=text,
+        timestamp=at,
+    )
+
+
+class RecentEventsTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.recent_events = RecentEvents()
+
+    async def buffer(self, *events: Event):
+        pipe = self.redis.pipeline()
+        self.recent_events.add(
+            pipe,
+            ((event, EventCodec.to_stream(event)["event"]) for event in events),
+        )
+        await pipe.execute()
+
+    async def since(self, at: str, receiver_ids=(CHANNEL_ID, USER_ID)) -> list[str]:
+        events = await self.recent_events.since(self.redis, receiver_ids, at)
+        return [event.text for event in events]
+
+    async def test_replays_what_came_after_the_cursor_oldest_first(self):
+        await self.buffer(
+            make_event(CHANNEL_ID, "seen", timestamp(30)),
+            make_event(CHANNEL_ID, "missed 1", timestamp(20)),
+            make_event(USER_ID, "missed 2", timestamp(15)),
+            make_event(CHANNEL_ID, "missed 3", timestamp(10)),
+        )
+        self.assertEqual(
+            await self.since(timestamp(25)), ["missed 1", "missed 2", "missed 3"]
+        )
+
+    async def test_an_empty_buffer_replays_nothing(self):
+        self.assertEqual(await self.since(timestamp(25)), [])
+
+    async def test_events_at_the_cursor_are_replayed(self):
+        # Two events written in the same microsecond; the client saw one
+        at = timestamp(20)
+        await self.buffer(
+            make_event(CHANNEL_ID, "seen", at),
+            make_event(USER_ID, "unseen", at),
+            make_event(CHANNEL_ID, "later", timestamp(10)),
+        )
+        replayed = await self.since(at)
+        self.assertCountEqual(replayed[:2], ["seen", "unseen"])
+        self.assertEqual(replayed[2], "later")
+
+    async def test_a_cursor_past_retention_needs_a_resync(self):
+        with self.assertRaises(ResyncRequired):
+            await self.since(timestamp(RECENT_EVENTS_RETENTION + 60))
+
+    async def test_a_full_buffer_that_starts_after_the_cursor_needs_a_resync(self):
+        cursor = timestamp(RECENT_EVENTS_MAX_LEN + 10)
+        await self.buffer(
+            *(
+                make_event(CHANNEL_ID, f"m{i}", timestamp(RECENT_EVENTS_MAX_LEN - i))
+                for i in range(RECENT_EVENTS_MAX_LEN + 1)
+            )
+        )
+        self.assertEqual(
+            self.redis.zcard(RediKeys.recent_events(CHANNEL_ID)), RECENT_EVENTS_MAX_LEN
+        )
+        with self.assertRaises(ResyncRequired):
+            await self.since(cursor)
+
+        # From within what the buffer still holds, nothing is missing
+        self.assertEqual(
+            await self.since(timestamp(5)),
+            [
+                f"m{i}"
+                for i in range(RECENT_EVENTS_MAX_LEN - 5, RECENT_EVENTS_MAX_LEN + 1)
+            ],
+        )
+
+    async def test_events_past_retention_are_dropped_on_write(self):
+        await self.buffer(
+            make_event(CHANNEL_ID, "old", timestamp(RECENT_EVENTS_RETENTION + 60)),
+            make_event(CHANNEL_ID, "new", timestamp(0)),
+        )
+        self.assertEqual(self.redis.zcard(RediKeys.recent_events(CHANNEL_ID)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
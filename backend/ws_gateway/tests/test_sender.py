@@ -0,0 +1,160 @@
+"""Per-socket send queues: what each overflow policy gives up when a client
+falls behind, and the writer draining the queue.
+
+Same stdlib `unittest` setup as test_recent_events.py.
+"""
+
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+import orjson
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.websocket.sender import (  # noqa: E402
+    RESYNC_REQUIRED,
+    SLOW_CONSUMER_CLOSE_CODE,
+    OverflowPolicy,
+    SendQueueStats,
+    SocketSender,
+)
+
+
+class FakeWebSocket:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.sent = []
+        self.close_codes = []
+
+    async def send_text(self, text):
+        if self.fail:
+            raise ConnectionError("client gone")
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.close_codes.append(code)
+
+
+def is_resync(frame: str) -> bool:
+    return orjson.loads(frame) == {"type": RESYNC_REQUIRED}
+
+
+class OverflowTest(unittest.TestCase):
+    """Not started, so nothing drains the queue."""
+
+    def make_sender(self, policy, max_size=2):
+        self.stats = SendQueueStats()
+        return SocketSender(FakeWebSocket(), max_size, policy, self.stats)
+
+    def test_below_the_limit_every_policy_queues(self):
+        for policy in OverflowPolicy:
+            sender = self.make_sender(policy)
+            sender.enqueue("a")
+            sender.enqueue("b")
+            self.assertEqual(list(sender.queue), ["a", "b"])
+            self.assertEqual(self.stats, SendQueueStats())
+
+    def test_drop_oldest_makes_room_for_the_newest(self):
+        sender = self.make_sender(OverflowPolicy.DROP_OLDEST)
+        for frame in ("a", "b", "c", "d"):
+            sender.enqueue(frame)
+        self.assertEqual(list(sender.queue), ["c", "d"])
+        self.assertEqual(self.stats.dropped, 2)
+        self.assertTrue(sender.ready.is_set())
+
+    def test_coalesce_replaces_the_backlog_with_a_resync(self):
+        sender = self.make_sender(OverflowPolicy.COALESCE)
+        for frame in ("a", "b", "c"):
+            sender.enqueue(frame)
+        self.assertTrue(is_resync(sender.queue[0]))
+        self.assertEqual(list(sender.queue)[1:], ["c"])
+        self.assertEqual(self.stats.dropped, 2)
+        self.assertEqual(self.stats.coalesced, 1)
+
+    def test_a_queued_resync_is_not_counted_as_dropped(self):
+        sender = self.make_sender(OverflowPolicy.COALESCE)
+        for frame in ("a", "b", "c", "d"):
+            sender.enqueue(frame)
+        # "c" was dropped; the resync in front of it was replaced by another
+        self.assertEqual(len(sender.queue), 2)
+        self.assertTrue(is_resync(sender.queue[0]))
+        self.assertEqual(sender.queue[1], "d")
+        self.assertEqual(self.stats.dropped, 3)
+        self.assertEqual(self.stats.coalesced, 2)
+
+    def test_disconnect_evicts_and_ignores_what_follows(self):
+        sender = self.make_sender(OverflowPolicy.DISCONNECT)
+        for frame in ("a", "b", "c", "d"):
+            sender.enqueue(frame)
+        self.assertTrue(sender.evicted)
+        self.assertEqual(sender.depth, 0)
+        self.assertEqual(self.stats.evicted, 1)
+        self.assertEqual(self.stats.dropped, 0)
+
+
+class WriterTest(unittest.IsolatedAsyncioTestCase):
+    def make_sender(self, websocket, policy=OverflowPolicy.DISCONNECT, max_size=8):
+        self.stats = SendQueueStats()
+        sender = SocketSender(websocket, max_size, policy, self.stats)
+        sender.start()
+        self.addAsyncCleanup(sender.stop)
+        return sender
+
+    async def test_sends_in_order(self):
+        websocket = FakeWebSocket()
+        sender = self.make_sender(websocket)
+        for frame in ("a", "b", "c"):
+            sender.enqueue(frame)
+        await asyncio.sleep(0)
+        sender.enqueue("d")
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(websocket.sent, ["a", "b", "c", "d"])
+        self.assertEqual(self.stats.sent, 4)
+        self.assertEqual(sender.depth, 0)
+
+    async def test_an_evicted_client_is_closed_as_try_again_later(self):
+        websocket = FakeWebSocket()
+        sender = self.make_sender(websocket, max_size=1)
+        sender.enqueue("a")
+        sender.enqueue("b")
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(websocket.sent, [], "nothing more once evicted")
+        self.assertEqual(websocket.close_codes, [SLOW_CONSUMER_CLOSE_CODE])
+        self.assertTrue(sender.task.done())
+
+    async def test_a_failed_send_stops_the_writer(self):
+        sender = self.make_sender(FakeWebSocket(fail=True))
+        sender.enqueue("a")
+        sender.enqueue("b")
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(self.stats.send_failures, 1)
+        self.assertEqual(self.stats.sent, 0)
+        self.assertEqual(sender.depth, 0)
+        self.assertTrue(sender.task.done())
+
+    async def test_stop_cancels_the_writer_and_drops_the_queue(self):
+        websocket = FakeWebSocket()
+        stalled = asyncio.Event()
+
+        async def stall(text):
+            await stalled.wait()
+
+        websocket.send_text = stall
+        sender = self.make_sender(websocket)
+        sender.enqueue("a")
+        sender.enqueue("b")
+        await asyncio.sleep(0.01)
+        await sender.stop()
+
+        self.assertTrue(sender.task.cancelled())
+        self.assertEqual(sender.depth, 0)
+        self.assertEqual(self.stats.sent, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+"""The prebuilt sender tuples WebsocketManager fans out over: who is in them
+as sockets connect and close and channel membership changes.
+
+Same stdlib `unittest` setup as test_sender.py. Redis is replaced by a
+record of the routing each user's sockets add and remove.
+"""
+
+import asyncio
+import sys
+import time
+import unittest
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import settings_env  # noqa: E402, F401
+from src.auth.models import CurrentUser  # noqa: E402
+from src.websocket.manager import WebsocketManager  # noqa: E402
+
+ENDPOINT = "gateway-a:50051"
+
+
+class FakeWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+
+class FakeRedisManager:
+    def __init__(self):
+        self.user_channels: dict[str, list[str]] = {}
+        self.routed_users: set[str] = set()
+        self.routed_channels: set[str] = set()
+
+    async def set_user_grpc_endpoint(self, user_id, grpc_endpoint, ttl):
+        self.routed_users.add(user_id)
+
+    async def delete_user_grpc_endpoint(self, user_id):
+        self.routed_users.discard(user_id)
+
+    async def get_user_channel_ids(self, user_id):
+        return list(self.user_channels.get(user_id, []))
+
+    async def delete_user_channels(self, user_id):
+        pass
+
+    async def add_grpc_endpoint_to_channel(self, channel_id, grpc_endpoint):
+        self.routed_channels.add(channel_id)
+
+    async def remove_grpc_endpoint_from_channel(self, channel_id, grpc_endpoint):
+        self.routed_channels.discard(channel_id)
+
+
+def make_user() -> CurrentUser:
+    user_id = str(uuid.uuid4())
+    return CurrentUser(
+        email=f"{user_id}@test.invalid",
+        name="test",
+        id=user_id,
+        exp=int(time.time()) + 3600,
+    )
+
+
+class SenderCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = FakeRedisManager()
+        self.manager = WebsocketManager()
+        self.manager.set_grpc_endpoint(ENDPOINT)
+        self.manager.set_redis_manager(self.redis)
+        self.addAsyncCleanup(self.manager.stop)
+
+        self.channel_id = str(uuid.uuid4())
+        self.alice, self.bob = make_user(), make_user()
+        for user in (self.alice, self.bob):
+            self.redis.user_channels[user.id] = [self.channel_id]
+
+    async def connect(self, user: CurrentUser) -> FakeWebSocket:
+        websocket = FakeWebSocket()
+        await self.manager.add_client(user, websocket)
+        return websocket
+
+    def sender(self, user: CurrentUser, websocket: FakeWebSocket):
+        return self.manager.clients[user.id][websocket]
+
+    def channel_senders(self) -> set:
+        return set(self.manager.get_channel_senders(self.channel_id))
+
+    @staticmethod
+    def stall_stop(sender) -> tuple[asyncio.Event, asyncio.Event]:
+        """Hold `sender.stop()` until `release` is set; `stopping` once called."""
+        stopping, release = asyncio.Event(), asyncio.Event()
+        stop = sender.stop
+
+        async def stalled_stop():
+            stopping.set()
+            await release.wait()
+            await stop()
+
+        sender.stop = stalled_stop
+        return stopping, release
+
+    async def test_a_second_tab_gets_the_users_and_channels_events(self):
+        first = await self.connect(self.alice)
+        await self.connect(self.bob)
+        # Built, and cached, with one tab
+        self.assertEqual(len(self.manager.get_client_senders(self.alice.id)), 1)
+        self.assertEqual(len(self.channel_senders()), 2)
+
+        second = await self.connect(self.alice)
+        alice_senders = {self.sender(self.alice, ws) for ws in (first, second)}
+        self.assertEqual(
+            set(self.manager.get_client_senders(self.alice.id)), alice_senders
+        )
+        self.assertLessEqual(alice_senders, self.channel_senders())
+        self.assertEqual(len(self.channel_senders()), 3)
+
+    async def test_closing_one_tab_leaves_the_other_routed(self):
+        first = await self.connect(self.alice)
+        second = await self.connect(self.alice)
+        await self.connect(self.bob)
+        self.channel_senders()
+        staying = self.sender(self.alice, second)
+
+        await self.manager.remove_client(self.alice.id, first)
+
+        self.assertEqual(self.manager.get_client_senders(self.alice.id), (staying,))
+        self.assertIn(staying, self.channel_senders())
+        self.assertEqual(len(self.channel_senders()), 2)
+        self.assertIn(self.alice.id, self.redis.routed_users)
+        self.assertIn(self.channel_id, self.redis.routed_channels)
+
+    async def test_closing_the_last_tab_unroutes_the_user(self):
+        websocket = await self.connect(self.alice)
+        bob_websocket = await self.connect(self.bob)
+        self.manager.get_client_senders(self.alice.id)
+        self.channel_senders()
+
+        await self.manager.remove_client(self.alice.id, websocket)
+        self.assertEqual(self.manager.get_client_senders(self.alice.id), ())
+        self.assertEqual(self.channel_senders(), {self.sender(self.bob, bob_websocket)})
+        self.assertNotIn(self.alice.id, self.redis.routed_users)
+        self.assertIn(self.channel_id, self.redis.routed_channels, "bob is still here")
+
+        await self.manager.remove_client(self.bob.id, bob_websocket)
+        self.assertEqual(self.channel_senders(), set())
+        self.assertNotIn(self.channel_id, self.redis.routed_channels)
+
+    async def test_refreshed_channels_are_joined_and_left(self):
+        websocket = await self.connect(self.alice)
+        sender = self.sender(self.alice, websocket)
+        joined = str(uuid.uuid4())
+        self.assertEqual(self.manager.get_channel_senders(joined), ())
+        self.assertEqual(self.channel_senders(), {sender})
+
+        self.redis.user_channels[self.alice.id] = [joined]
+        await self.manager.refresh_user_channels(self.alice.id)
+
+        self.assertEqual(self.manager.get_channel_senders(joined), (sender,))
+        self.assertEqual(self.channel_senders(), set())
+        self.assertEqual(self.redis.routed_channels, {joined})
+
+    async def test_an_event_resolved_while_a_tab_closes_skips_it(self):
+        first = await self.connect(self.alice)
+        second = await self.connect(self.alice)
+        closing = self.sender(self.alice, first)
+        staying = self.sender(self.alice, second)
+        self.channel_senders()
+
+        stopping, release = self.stall_stop(closing)
+        removal = asyncio.create_task(self.manager.remove_client(self.alice.id, first))
+        await stopping.wait()
+
+        # Resolved mid-removal: the closing sender is already gone
+        self.assertEqual(self.manager.get_client_senders(self.alice.id), (staying,))
+        self.assertEqual(self.channel_senders(), {staying})
+
+        release.set()
+        await removal
+        self.assertEqual(self.manager.get_client_senders(self.alice.id), (staying,))
+        self.assertEqual(self.channel_senders(), {staying})
+
+    async def test_an_event_resolved_while_the_last_tab_closes_skips_it(self):
+        websocket = await self.connect(self.alice)
+        bob_websocket = await self.connect(self.bob)
+        closing = self.sender(self.alice, websocket)
+        bob = self.sender(self.bob, bob_websocket)
+        self.channel_senders()
+
+        stopping, release = self.stall_stop(closing)
+        removal = asyncio.create_task(
+            self.manager.remove_client(self.alice.id, websocket)
+        )
+        await stopping.wait()
+
+        self.assertEqual(self.manager.get_client_senders(self.alice.id), ())
+        self.assertEqual(self.channel_senders(), {bob})
+
+        release.set()
+        await removal
+        self.assertEqual(self.channel_senders(), {bob})
+        self.assertNotIn(self.alice.id, self.manager.clients)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,8 +8,15 @@ import React, {
   useCallback,
 } from "react";
 import { useAuth } from "../auth/AuthContext";
+import { useFriendStore } from "../friends/friendStore";
+import { useChannelStore } from "../shared/channelStore";
+import { useMessageStore } from "../shared/messageStore";
 import { eventBus } from "./EventBus";
-import type { EventPayload } from "./eventType";
+import {
+  RESYNC_REQUIRED,
+  type ControlFrame,
+  type EventPayload,
+} from "./eventType";
 
 interface WebSocketContextType {
   getWs: () => WebSocket | null;
@@ -21,6 +28,42 @@ interface WebSocketContextType {
 
 const WebSocketContext = createContext<WebSocketContextType | null>(null);
 
+// Events may have been lost: refetch every store the events keep current
+const resyncStores = () => {
+  const messageStore = useMessageStore.getState();
+  const channelStore = useChannelStore.getState();
+  const friendStore = useFriendStore.getState();
+  void Promise.allSettled([
+    ...Object.keys(messageStore.byChannel).map((channelId) =>
+      messageStore.fetchChannelMessages(channelId)
+    ),
+    channelStore
+      .fetchUserChannels()
+      .then(() => channelStore.fetchDMChannelParticipants()),
+    friendStore.fetchFriends(),
+    friendStore.fetchFriendRequests(),
+    friendStore.fetchOutgoingRequests(),
+  ]);
+};
+
+// A reconnect replays from this long before the newest event received.
+// Events are stamped by different hosts and arrive over different shards, so
+// one stamped a little earlier may still have been in flight when the socket
+// dropped. What comes back twice is dropped by event_id.
+const REPLAY_SKEW_MS = 5000;
+// How many event ids are remembered for that; the oldest go first
+const SEEN_EVENT_IDS = 1000;
+
+const replayFrom = (timestamp: string): string => {
+  const at = Date.parse(timestamp);
+  return Number.isNaN(at)
+    ? timestamp
+    : new Date(at - REPLAY_SKEW_MS).toISOString();
+};
+
+const isNewer = (timestamp: string, than: string | null): boolean =>
+  than === null || !(Date.parse(timestamp) <= Date.parse(than));
+
 const MAX_RETRIES = 5;
 const INITIAL_RETRY_DELAY = 1000; // 1 second
 const MAX_RETRY_DELAY = 30000; // 30 seconds
@@ -34,6 +77,11 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({
   const retryTimeoutRef = useRef<number | null>(null);
   const retryCountRef = useRef(0);
   const shouldReconnectRef = useRef(true);
+  // Timestamp of the newest event received, so a reconnect replays what was
+  // missed instead of refetching everything
+  const lastEventAtRef = useRef<string | null>(null);
+  // Ids of the events received most recently, oldest first
+  const seenEventIdsRef = useRef<Set<string>>(new Set());
   const { getToken } = useAuth();
 
   const connect = useCallback(() => {
@@ -50,7 +98,12 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({
 
     const protocol = window.location.protocol === "https:" ? "wss" : "ws";
     const host = window.location.host;
-    const newWs = new WebSocket(`${protocol}://${host}/ws?token=${token}`);
+    const since = lastEventAtRef.current
+      ? `&since=${encodeURIComponent(replayFrom(lastEventAtRef.current))}`
+      : "";
+    const newWs = new WebSocket(
+      `${protocol}://${host}/ws?token=${token}${since}`
+    );
 
     newWs.onopen = () => {
       console.log("✅ WebSocket connected");
@@ -61,7 +114,28 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({
 
     newWs.onmessage = (msg) => {
       try {
-        const data: EventPayload = JSON.parse(msg.data);
+        const data: EventPayload | ControlFrame = JSON.parse(msg.data);
+        if ("type" in data) {
+          if (data.type === RESYNC_REQUIRED) {
+            console.log("🔄 Resync required, refetching state");
+            // The refetch covers everything up to now; a reconnect before
+            // the next event should not replay from the old cursor
+            lastEventAtRef.current = null;
+            resyncStores();
+          }
+          return;
+        }
+        // A replayed event this tab already has
+        const seenEventIds = seenEventIdsRef.current;
+        if (seenEventIds.has(data.event_id)) return;
+        seenEventIds.add(data.event_id);
+        if (seenEventIds.size > SEEN_EVENT_IDS) {
+          seenEventIds.delete(seenEventIds.values().next().value as string);
+        }
+        // Only events move the replay cursor, and never back
+        if (data.timestamp && isNewer(data.timestamp, lastEventAtRef.current)) {
+          lastEventAtRef.current = data.timestamp;
+        }
         eventBus.emit(data);
         console.log("🔔 Message received:", data);
       } catch (err) {
@@ -19,6 +19,17 @@ export enum EventAction {
   VOICE_LEFT = "voice_left",
 }
 
+/**
+ * `type` of the frame the gateway sends instead of events when it cannot
+ * replay everything a reconnecting tab missed, or this tab fell too far
+ * behind. The tab has to refetch its state over REST.
+ */
+export const RESYNC_REQUIRED = "resync_required";
+
+export type ControlFrame = {
+  type: typeof RESYNC_REQUIRED;
+};
+
 export type EventPayload = {
   event_id: string;
   event_type: string;
@@ -203,7 +203,8 @@ POSTGRES_DB=raindb""",
 
     print(
         "\nNUM_SHARDS (ws_gateway) and NUM_STREAMS (consumer, lease manager) "
-        "must stay equal - both are 2 above.\n"
+        "start out equal - both are 2 above. To reshard later, change "
+        "NUM_STREAMS in lease_manager's file only.\n"
         "Next: copy livekit.example.yaml to livekit.yaml and set its "
         f"`webhook.api_key` to {livekit_api_key}."
     )